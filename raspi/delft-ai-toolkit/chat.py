@@ -0,0 +1,299 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# a conversation on the robot itself: what it hears goes straight to a
+# response function, and the answer is spoken without a round trip to Unity.
+#
+#   /chat/ start <model> <lang> <seconds> <voice> [tag]   listen, answer, speak, listen again...
+#   /chat/ stop
+#
+# a turn goes through four stages, each in its own thread with queues in between:
+#   listen      speech to text until there is a final transcript
+#   respond     respond(text, history) gives the answer in pieces, which are cut into sentences
+#   synthesize  each sentence to audio as soon as it is complete
+#   play        each sentence once it is synthesized and the one before has finished
+# so the first sentence is synthesized while later ones are still being
+# written, and the next one while the one before plays. The microphone is off
+# while the robot speaks, so it does not answer itself, and opens again as
+# soon as the last sentence has played.
+#
+# a response function is any function(text, history) that returns or yields
+# strings, named with --chat_responder module:function. history holds
+# (heard, said) for the turns before. Each finished turn is reported on
+# /str/chat/ as what was said, what was heard and the request tag, and its
+# timing on /str/chat_timing/, in seconds after the final transcript:
+#   <text> <first sentence> <first audio> <first sound> <done> <one after another>
+# the last is how long the turn would have taken with every stage waiting
+# for the one before it to finish.
+#
+#   python3 chat.py [--turns 3]
+# holds a conversation between stub speech engines and shows the timing.
+
+import re
+import time
+import queue
+import logging
+import importlib
+import threading
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+DONE = None # the last item of a turn in the stage queues
+
+def sentences(pieces):
+  # joins pieces of text and yields it again a sentence at a time
+  if isinstance(pieces, str):
+    pieces = [pieces]
+  pending = ""
+  for piece in pieces:
+    pending += piece
+    parts = SENTENCE_END.split(pending)
+    for sentence in parts[:-1]:
+      if sentence.strip() != "":
+        yield sentence.strip()
+    pending = parts[-1]
+  if pending.strip() != "":
+    yield pending.strip()
+
+def echo(text, history):
+  # the default responder, says back what it heard
+  yield "You said: " + text + "."
+
+def load_responder(name):
+  # "module:function"
+  module, function = name.split(":")
+  return getattr(importlib.import_module(module), function)
+
+class Turn(object):
+  def __init__(self, number, heard, heard_at):
+    self.number = number
+    self.heard = heard
+    self.heard_at = heard_at # time.monotonic() of the final transcript
+    self.said = []
+    self.times = {} # the first time each stage got something done
+    self.busy = {"respond": 0.0, "synthesize": 0.0, "play": 0.0} # seconds each stage worked on it
+    self.done = threading.Event()
+
+  def mark(self, stage):
+    self.times.setdefault(stage, time.monotonic())
+
+  def after(self, stage):
+    # seconds from the final transcript to the stage, -1 if it never got there
+    if stage not in self.times:
+      return -1.0
+    return self.times[stage] - self.heard_at
+
+  def timing(self):
+    return [self.after("sentence"), self.after("audio"), self.after("sound"), self.after("played"),
+      sum(self.busy.values())]
+
+  def describe(self):
+    first_sentence, first_audio, first_sound, done, sequential = self.timing()
+    return "turn {} heard '{}' said {} sentences: first sentence {:.2f}s, first audio {:.2f}s, first sound {:.2f}s, done {:.2f}s ({:.2f}s one after another)".format(
+      self.number, self.heard, len(self.said), first_sentence, first_audio, first_sound, done, sequential)
+
+class ChatPipeline(object):
+  def __init__(self, listener, respond, speaker, report, history=6):
+    self.listener = listener # listener.listen() returns (text, time of the final transcript), text None to stop
+    self.respond = respond # respond(text, history) returns or yields the answer
+    self.speaker = speaker # speaker.synthesize(text) returns audio or None, speaker.play(audio), speaker.stop()
+    self.report = report # called with each finished Turn
+    self.history = history # turns the responder is given
+    self.stop_e = threading.Event()
+    self.synthesize_q = queue.Queue()
+    self.play_q = queue.Queue(maxsize=2) # a couple of sentences ahead of the speaker is plenty
+
+  def stop(self):
+    # the listener has to be cancelled by whoever owns it
+    self.stop_e.set()
+    self.speaker.stop()
+
+  def run(self, keep_going=lambda: True):
+    # one turn after another until the listener or keep_going says to stop
+    stages = [threading.Thread(target=self.synthesize_stage, name="chat-synthesize", daemon=True),
+      threading.Thread(target=self.play_stage, name="chat-play", daemon=True)]
+    for stage in stages:
+      stage.start()
+    history = []
+    number = 0
+    try:
+      while keep_going() and not self.stop_e.is_set():
+        start = time.monotonic()
+        text, heard_at = self.listener.listen()
+        if text == None or self.stop_e.is_set():
+          break
+        if text.strip() == "":
+          continue # nothing heard, listen again
+        number += 1
+        turn = Turn(number, text.strip(), heard_at or time.monotonic())
+        metrics.histogram("chat_stage_seconds", stage="listen").observe(turn.heard_at - start)
+        self.respond_stage(turn, history)
+        turn.done.wait() # the microphone stays off until the answer has been played
+        history.append((turn.heard, " ".join(turn.said)))
+        del history[:-self.history]
+        self.finish(turn)
+    finally:
+      self.synthesize_q.put(None) # ends both stages
+      for stage in stages:
+        stage.join()
+    return number
+
+  def respond_stage(self, turn, history):
+    start = time.monotonic()
+    try:
+      for sentence in sentences(self.respond(turn.heard, list(history))):
+        if self.stop_e.is_set():
+          break
+        turn.mark("sentence")
+        turn.said.append(sentence)
+        self.synthesize_q.put((turn, sentence))
+    except Exception:
+      log.exception("chat responder failed")
+    turn.busy["respond"] = time.monotonic() - start
+    metrics.histogram("chat_stage_seconds", stage="respond").observe(turn.busy["respond"])
+    self.synthesize_q.put((turn, DONE))
+
+  def synthesize_stage(self):
+    while True:
+      item = self.synthesize_q.get()
+      if item == None:
+        self.play_q.put(None)
+        return
+      turn, sentence = item
+      if sentence == DONE:
+        self.play_q.put((turn, DONE))
+        continue
+      if self.stop_e.is_set():
+        continue
+      start = time.monotonic()
+      try:
+        audio = self.speaker.synthesize(sentence)
+      except Exception:
+        log.exception("chat can't synthesize '%s'", sentence)
+        audio = None
+      took = time.monotonic() - start
+      turn.busy["synthesize"] += took
+      metrics.histogram("chat_stage_seconds", stage="synthesize").observe(took)
+      if audio != None:
+        turn.mark("audio")
+        self.play_q.put((turn, audio))
+
+  def play_stage(self):
+    while True:
+      item = self.play_q.get()
+      if item == None:
+        return
+      turn, audio = item
+      if audio == DONE:
+        turn.mark("played")
+        turn.done.set()
+        continue
+      if self.stop_e.is_set():
+        continue
+      turn.mark("sound")
+      start = time.monotonic()
+      try:
+        self.speaker.play(audio)
+      except Exception:
+        log.exception("chat can't play")
+      took = time.monotonic() - start
+      turn.busy["play"] += took
+      metrics.histogram("chat_stage_seconds", stage="play").observe(took)
+
+  def finish(self, turn):
+    for stage, name in (("sentence", "first_sentence"), ("audio", "first_audio"), ("sound", "first_sound"), ("played", "turn")):
+      if turn.after(stage) >= 0:
+        metrics.histogram("chat_stage_seconds", stage=name).observe(turn.after(stage))
+    metrics.counter("chat_turns").inc()
+    log.info("chat %s", turn.describe())
+    self.report(turn)
+
+class WatsonListener(object):
+  # the listen process's speech to text, one utterance at a time with the microphone off in between
+  def __init__(self, stt, lang, time_limit):
+    self.stt = stt
+    self.lang = lang
+    self.time_limit = time_limit
+
+  def listen(self):
+    text = self.stt.transcribe(self.lang, self.time_limit)
+    if text == None:
+      return None, None # cancelled
+    if not self.stt.got_final:
+      return "", None
+    return text.replace("'",""), self.stt.final_at
+
+class PicoSpeaker(object):
+  # pico in this process, each sentence synthesized into memory and played from there
+  def __init__(self, voice):
+    self.voice = voice
+    self.stop_e = threading.Event()
+
+  def synthesize(self, text):
+    import text_to_speech_pico as tts_pico
+    return tts_pico.pcm(text, self.voice)
+
+  def play(self, samples):
+    import text_to_speech_pico as tts_pico
+    tts_pico.play(samples, self.stop_e)
+
+  def stop(self):
+    self.stop_e.set()
+
+class StubListener(object):
+  # "hears" each line after as long as it would take to say, then stops
+  def __init__(self, lines, words_per_second=2.5):
+    self.lines = list(lines)
+    self.words_per_second = words_per_second
+
+  def listen(self):
+    if len(self.lines) == 0:
+      return None, None
+    line = self.lines.pop(0)
+    time.sleep(len(line.split()) / self.words_per_second)
+    return line, time.monotonic()
+
+class StubSpeaker(object):
+  # synthesis takes a little time per character, the "audio" is how long it would play for
+  def __init__(self, synthesize_seconds=0.05, per_char=0.004, chars_per_second=14.0):
+    self.synthesize_seconds = synthesize_seconds
+    self.per_char = per_char
+    self.chars_per_second = chars_per_second
+    self.stop_e = threading.Event()
+
+  def synthesize(self, text):
+    time.sleep(self.synthesize_seconds + self.per_char * len(text))
+    return len(text) / self.chars_per_second
+
+  def play(self, seconds):
+    self.stop_e.wait(seconds)
+
+  def stop(self):
+    self.stop_e.set()
+
+if __name__ == '__main__':
+  import argparse
+  parser = argparse.ArgumentParser(description="a conversation between stub speech engines")
+  parser.add_argument("--turns", type=int, default=3)
+  parser.add_argument("--think", type=float, default=0.3, help="seconds the stub responder takes per sentence")
+  args = parser.parse_args()
+  logging.basicConfig(level=logging.WARNING)
+
+  def story(text, history):
+    # a slow responder that streams its answer a few words at a time
+    answer = "I heard you say {}. That was turn {} for us. Here is one more sentence to say. And a last one.".format(
+      text.lower().rstrip("."), len(history) + 1)
+    for i, word in enumerate(answer.split(" ")):
+      if i % 4 == 0:
+        time.sleep(args.think / 2)
+      yield word + " "
+
+  lines = ["Hello robot", "What can you see", "Tell me a story", "Goodbye for now"] * args.turns
+  pipeline = ChatPipeline(StubListener(lines[:args.turns]), story, StubSpeaker(),
+    lambda turn: print(turn.describe()))
+  start = time.monotonic()
+  turns = pipeline.run()
+  print("{} turns in {:.1f}s".format(turns, time.monotonic() - start))
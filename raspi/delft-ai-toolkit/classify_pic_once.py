@@ -10,16 +10,29 @@ import sys
 import tarfile
 import argparse
 import time
+import logging
 
 import cv2
-from picamera.array import PiRGBArray
-from picamera import PiCamera
+
+import metrics
+import detection
+import model_registry
+from scene_gate import SceneGate
+
+log = logging.getLogger(__name__)
 
 net = None
 camera = None
+# frames shared by the camera process, used instead of the camera when there is one
+bus = None
 rawCapture = None
 classes = None
 current_model = None
+current_spec = None
+# every model we can load, from models.json
+registry = model_registry.load_manifest()
+# reuses the last result while the camera sees the same scene
+gate = SceneGate(threshold=0.0) # off unless init() is given a threshold
 
 #camera = PiCamera()
 
@@ -27,56 +40,40 @@ def change_model(modeltype="squeezenet"):
 	global net
 	global classes
 	global current_model
+	global current_spec
 
 	if modeltype != current_model:
-		labels="labels/synset_words.txt"
-		current_model = modeltype
-
-		# set up the model
-		if modeltype == "googlenet":
-			model = "models/bvlc_googlenet.caffemodel"
-			prototxt = "models/bvlc_googlenet.prototxt"
-		elif modeltype == "squeezenet":
-			model = "models/squeezenet_v1.1.caffemodel"
-			prototxt = "models/squeezenet_v1.1.prototxt"
-		elif modeltype == "alexnet":
-			model = "models/bvlc_alexnet.caffemodel"
-			prototxt = "models/bvlc_alexnet.prototxt"
-		elif modeltype == "inception":
-			model = "models/Inception21k.caffemodel"
-			prototxt = "models/Inception21k.prototxt"
-			labels="labels/synset21k.txt"
-		elif modeltype == "rcnn":
-			model = "models/bvlc_reference_rcnn_ilsvrc13.caffemodel"
-			prototxt = "models/bvlc_reference_rcnn_ilsvrc13.prototxt"
-			labels="labels/synset_rcnn.txt"
-		# elif modeltype == "rcnn-vgg16":
-		# 	model = "models/faster_rcnn_vgg16.caffemodel"
-		# 	prototxt = "models/faster_rcnn_vgg16.prototxt"
-		# elif modeltype == "rcnn-zf":
-		# 	model = "models/faster_rcnn_zf.caffemodel"
-		# 	prototxt = "models/faster_rcnn_zf.prototxt"
+		# the files and preprocessing for each model are in models.json
+		if modeltype not in registry:
+			log.warning("unknown model %s, keeping %s", modeltype, current_model)
+			return
+		spec = registry[modeltype]
 
 		# load the class labels from disk
-		rows = open(labels).read().strip().split("\n")
-		# get the labels
-		classes = [r[r.find(" ") + 1:].split(",")[0] for r in rows] # only get first label
-
-		print("[INFO] loading model...")
-		# load the serialized model from disk
-		net = cv2.dnn.readNetFromCaffe(prototxt, model)
-		print("[INFO] model loaded")
+		classes = model_registry.load_labels(spec)
+
+		log.info("loading model %s...", modeltype)
+		# load the serialized model from disk, cv2.dnn works out the format
+		start = time.time()
+		net = model_registry.load_net(spec)
+		metrics.histogram("model_load_seconds", model=modeltype).observe(time.time() - start)
+		current_model = modeltype
+		current_spec = spec
+		log.info("model loaded")
 		return
 
 	else:
-		print("[INFO] model already loaded")
+		log.debug("model already loaded")
 		return
 
-def init(camera_in, modeltype):
+def init(camera_in, modeltype, scene_threshold=0.0, scene_max_age=5.0, bus_in=None):
 	"""Initializes the camera stream and the recognition model using changeModel()
 
 	Args:
 		modeltype: name of the deep learning model we will use for inference
+		scene_threshold: how much the scene must change to run the model again, 0 always runs it
+		scene_max_age: seconds a result is reused for at most
+		bus_in: a frame_bus.FrameBus to take pictures from instead of camera_in
 
 	Returns:
 		Nothing
@@ -84,17 +81,96 @@ def init(camera_in, modeltype):
 	global camera
 	global rawCapture
 	global classes
+	global bus
 	# initialize the camera and grab a reference to the raw camera capture
 	# camera = PiCamera()
 	camera = camera_in
+	bus = bus_in
+	gate.threshold = scene_threshold
+	gate.max_age = scene_max_age
 	change_model(modeltype)
 	return
 
+def warmup():
+	"""Runs one forward pass on a blank image so that the first real
+	recognition does not pay for the network's lazy allocations
+
+	Returns:
+		Nothing
+	"""
+	width, height = current_spec.input_size
+	image = np.zeros((height, width, 3), dtype=np.uint8)
+	blob = model_registry.blob(current_spec, image)
+	net.setInput(blob)
+	net.forward()
+	return
+
 def close():
 	global camera
-	camera.close()
+	if camera != None:
+		camera.close()
 	return
 
+def capture():
+	# grab an image from the camera
+	log.debug("capturing image...")
+	start = time.time()
+	if bus != None:
+		# the newest frame from the camera process, copied as we draw on it
+		if bus.wait(0, 5.0) == None:
+			log.warning("no frames on the frame bus, using a blank picture")
+			return np.zeros((bus.height, bus.width, bus.channels), dtype=np.uint8)
+		image, captured = bus.read()
+		metrics.histogram("camera_capture_seconds").observe(time.time() - start)
+		return image
+	from picamera.array import PiRGBArray # only needed without the frame bus
+	rawCapture = PiRGBArray(camera)
+	camera.capture(rawCapture, format="bgr")
+	image = rawCapture.array
+	metrics.histogram("camera_capture_seconds").observe(time.time() - start)
+	return image
+
+def run_detection_on_image(modeltype):
+	"""Captures image from the Pi Cam and finds the objects in it with a
+	detection model such as mobilenet-ssd
+
+	Returns:
+		List: (label, score, (left, top, right, bottom)) for each object, best
+		first, with the box corners as fractions of the picture
+	"""
+
+	change_model(modeltype)
+	if current_spec.task != "detect":
+		log.warning("%s is not a detection model", current_model)
+		return []
+	image = capture()
+
+	key = "detect:" + current_model
+	cached = gate.check(image, key)
+	if cached != None:
+		log.debug("scene unchanged (%.2f), reusing the last detections", gate.last_difference)
+		return cached
+
+	blob = model_registry.blob(current_spec, image)
+	net.setInput(blob)
+	start = time.time()
+	output = net.forward()
+	metrics.histogram("inference_seconds", model=current_model).observe(time.time() - start)
+	confidence, threshold = detection.thresholds(current_spec)
+	found = detection.decode(output, classes, confidence, threshold)
+
+	# draw the boxes on the saved picture
+	height, width = image.shape[:2]
+	for label, score, box in found:
+		left, top, right, bottom = [int(v) for v in np.multiply(box, [width, height, width, height])]
+		cv2.rectangle(image, (left, top), (right, bottom), (0, 0, 255), 2)
+		cv2.putText(image, "{}: {:.2f}".format(label, score), (left + 3, top + 18),
+			cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
+	cv2.imwrite('capture.png', image)
+	gate.store(found, key)
+	log.info("detection took %.5f seconds, %d objects", time.time() - start, len(found))
+	return found
+
 def run_inference_on_image(modeltype):
 	"""Captures image from the Pi Cam and runs inference
 
@@ -103,30 +179,36 @@ def run_inference_on_image(modeltype):
 	"""
 
 	change_model(modeltype)
-	# grab an image from the camera
-	print("[INFO] capturing image...")
-	rawCapture = PiRGBArray(camera)
-	camera.capture(rawCapture, format="bgr")
-	image = rawCapture.array
+	if current_spec.task == "detect":
+		# a detector asked to recognize answers with the objects it found
+		return detection.summary(run_detection_on_image(modeltype))
+	image = capture()
+
+	# nothing has changed since the last recognition, skip the network
+	cached = gate.check(image, current_model)
+	if cached != None:
+		log.debug("scene unchanged (%.2f), reusing the last result", gate.last_difference)
+		return cached
 
 	# our CNN requires fixed spatial dimensions for our input image(s)
-	# so we need to ensure it is resized to 224x224 pixels while
-	# performing mean subtraction (104, 117, 123) to normalize the input;
+	# so we need to ensure it is resized to the model's input size (e.g. 224x224)
+	# while performing its mean subtraction and scaling to normalize the input;
 	# after executing this command our "blob" now has the shape:
-	# (1, 3, 224, 224)
-	blob = cv2.dnn.blobFromImage(image, 1, (224, 224), (104, 117, 123))
+	# (1, 3, height, width)
+	blob = model_registry.blob(current_spec, image)
 
 	# set the blob as input to the network and perform a forward-pass to
 	# obtain our output classification
 	net.setInput(blob)
 	start = time.time()
 	preds = net.forward()
+	metrics.histogram("inference_seconds", model=current_model).observe(time.time() - start)
 	# end = time.time()
 	# print("[INFO] classification took {:.5} seconds".format(end - start))
 
 	# sort the indexes of the probabilities in descending order (higher
 	# probabilitiy first) and grab the top-5 predictions
-	preds = preds.reshape((1, len(classes)))
+	preds = model_registry.probabilities(current_spec, preds).reshape((1, len(classes)))
 	idxs = np.argsort(preds[0])[::-1][:5]
 	responseText = ""
 
@@ -150,6 +232,7 @@ def run_inference_on_image(modeltype):
 
 	#print(responseText)
 	cv2.imwrite('capture.png', image)
+	gate.store(responseText, current_model)
 	end = time.time()
-	print("[INFO] classification took {:.5} seconds".format(end - start))
+	log.info("classification took %.5f seconds", end - start)
 	return responseText
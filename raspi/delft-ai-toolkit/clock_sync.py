@@ -0,0 +1,105 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# keeps this robot's clock lined up with the Unity host, NTP style.
+#
+# the bridge sends /sync/ping/ <seq> <t1> to Unity every few seconds, Unity
+# answers /pong/ <seq> <t1> <t2> <t3> with its own (Unix time) clock when the
+# ping arrived and when it answered, and the pong arrives back here at t4.
+# t1 and t4 are time.monotonic() on the Pi, which gives
+#   offset = ((t2 - t1) + (t3 - t4)) / 2    Unity time = monotonic + offset
+#   rtt    = (t4 - t1) - (t3 - t2)
+# the sample with the smallest round trip out of the last few is the one
+# trusted, as a slow round trip is usually a lopsided one. Until the first pong
+# the Pi's own Unix time is used, so timestamps are always Unix seconds.
+#
+# the offset lives in shared memory made at import, before the worker
+# processes are forked, so they stamp their results with the same clock:
+#   clock_sync.send(client, "/str/recognize/", [results, id], captured)
+# adds the shared-clock time of captured (a time.monotonic()) as a double.
+# It always goes after the existing arguments: Unity's DingDataPhysical reads
+# Data[1] and Data[2] of /num/ messages, so those keep their old values.
+
+import time
+import logging
+import threading
+import multiprocessing
+from collections import deque
+
+from pythonosc import osc_message_builder
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+PING = "/sync/ping/"
+
+_offset = multiprocessing.Value('d', time.time() - time.monotonic())
+_synced = multiprocessing.Value('b', 0)
+
+def shared_time(mono=None):
+  # the shared clock time of a time.monotonic() reading, now if None
+  if mono == None:
+    mono = time.monotonic()
+  return mono + _offset.value
+
+def is_synced():
+  return _synced.value == 1
+
+def message(address, args, captured=None):
+  # an OSC message with args followed by the capture time on the shared clock as a double
+  builder = osc_message_builder.OscMessageBuilder(address=address)
+  for arg in args:
+    builder.add_arg(arg)
+  builder.add_arg(shared_time(captured), osc_message_builder.OscMessageBuilder.ARG_TYPE_DOUBLE)
+  return builder.build()
+
+def send(client, address, args, captured=None):
+  client.send(message(address, args, captured))
+
+class ClockSync(object):
+  # runs in the bridge, pings Unity and tracks the offset and round trip time
+  def __init__(self, client, interval=2.0, window=8):
+    self.client = client
+    self.interval = interval
+    self.samples = deque(maxlen=window) # (rtt, offset)
+    self.seq = 0
+    self.rtt = None
+    self.offset = None
+
+  def start(self):
+    thread = threading.Thread(target=self.run, name="clock-sync", daemon=True)
+    thread.start()
+    return thread
+
+  def run(self):
+    while True:
+      self.ping()
+      time.sleep(self.interval)
+
+  def ping(self):
+    self.seq += 1
+    builder = osc_message_builder.OscMessageBuilder(address=PING)
+    builder.add_arg(self.seq)
+    builder.add_arg(time.monotonic(), osc_message_builder.OscMessageBuilder.ARG_TYPE_DOUBLE)
+    self.client.send(builder.build())
+
+  def pong(self, seq, t1, t2, t3):
+    t4 = time.monotonic()
+    rtt = (t4 - t1) - (t3 - t2)
+    offset = ((t2 - t1) + (t3 - t4)) / 2
+    if rtt < 0 or t4 - t1 > 10 * max(self.interval, 1.0):
+      return # not one of ours, or far too old
+    metrics.histogram("network_rtt_seconds").observe(rtt)
+    self.samples.append((rtt, offset))
+    best_rtt, best_offset = min(self.samples)
+    first = not is_synced()
+    with _offset.get_lock():
+      _offset.value = best_offset
+    _synced.value = 1
+    self.rtt = rtt
+    self.offset = best_offset
+    metrics.gauge("clock_offset_seconds").set(best_offset - (time.time() - time.monotonic()))
+    metrics.gauge("clock_rtt_seconds").set(best_rtt)
+    if first:
+      log.info("clock synced with Unity, rtt %.1fms", rtt * 1000)
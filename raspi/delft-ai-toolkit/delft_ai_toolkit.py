@@ -6,36 +6,45 @@
 # test analog with new 3V proximity sensor
 
 import time
+start_time = time.monotonic() # for the startup report
 import argparse
 import os.path
 import sys
-import serial
-import picamera
-import serial.tools.list_ports
 from pythonosc import dispatcher
 from pythonosc import osc_server
 from pythonosc import osc_message_builder
-from pythonosc import udp_client
 
+import threading
 from threading import Thread
+import atexit
 import multiprocessing
 import socket
 
 # import my libraries
-import classify_pic_once as rec
-import text_to_speech_pico as tts_pico
-import text_to_speech_watson as tts_watson
-import speech_to_text_watson as stt_watson
-import play_wav as pw
-from adafruit_crickit import crickit
-import neopixel
-from adafruit_seesaw.neopixel import NeoPixel
+# the heavy ones (cv2, picamera, watson, pyaudio, CRICKIT) are imported by the
+# process or thread that uses them, so each process only loads what it needs
+import startup
+import metrics
+import toolkit_log
+import profiling
+import motion
+import timeline
+import fleet
+import fanout
+import clock_sync # makes the shared clock offset, before the workers are forked
+import governor # and the limits the recognize process keeps to when the Pi runs hot
+import scheduling
+import logging
+from work_queue import WorkQueue
+
+log = logging.getLogger("delft_ai_toolkit")
 
 FLAGS = None
 MCU = "CRICKIT"
+ser = None
 
 events = ["move","leds","delay", "analogin", "servo", "speak", "listen", "chat"]
-types = ["stop", "forward", "backward", "turnRight", "turnLeft", "set", "blink", "allOff", "pause", "start", "immediate", "varspeed", "male", "female", "timed", "auto", "standard"]
+types = ["stop", "forward", "backward", "turnRight", "turnLeft", "set", "blink", "allOff", "pause", "start", "immediate", "varspeed", "male", "female", "timed", "auto", "standard", "fade", "chase", "pulse"]
 easings = ["none", "easeIn", "easeOut", "easeInOut"]
 
 speak_task = False
@@ -45,33 +54,21 @@ listen_duration = 2
 
 default_recognize_model = "squeezenet"
 
-#CRICKET setup
-
-#define the motors
-motor_1 = crickit.dc_motor_1
-motor_2 = crickit.dc_motor_2
-
-# stop the motors
-motor_1.throttle = 0.0
-motor_2.throttle = 0.0
+#CRICKET setup -- done in the background by init_hardware()
+crickit = None
+motor_1 = None
+motor_2 = None
+motion_engine = None
+servo_engine = None
+pixels = None
+led_engine = None
+ss = None
+hardware_ready_e = threading.Event()
+# the seesaw reads in two steps with a sleep between, so every thread that uses the CRICKIT holds this
+i2c_lock = threading.Lock()
 
 #NeoPixel
 num_pixels = 16
-# for blinking
-blink = False
-blink_state = False
-blink_color = (127,0,0,0)
-blink_delay = 0.1
-blink_times = 2
-blink_next_time = time.time() + blink_delay
-# bpp=4 is required for RGBW
-pixels = NeoPixel(crickit.seesaw, 20, num_pixels, brightness=0.02, pixel_order=neopixel.RGBW, bpp=4)
-# black out the LEDs
-pixels.fill((1,2,3,0)) # there's a bug in the neopixel lib that ignores zeros in rgbw
-# https://github.com/adafruit/Adafruit_CircuitPython_seesaw/issues/32
-# DEFINE sensors
-# For signal control, we'll chat directly with seesaw, use 'ss' to shorted typing!
-ss = crickit.seesaw
 
 # analogin = False
 analog_interval = .5
@@ -85,8 +82,12 @@ touch_next_time = time.time() + touch_interval
 # ports to be scanned each interval
 touch_ports = [False,False,False,False,False]
 
-move_stop_time = time.time()
-move_stop_interval = 10.0 #seconds
+# the governor stretches the analog and touch intervals when the Pi runs hot
+sensor_scale = 1.0
+# and caps the LED frame rate, None for --led_fps
+led_fps_limit = None
+
+move_stop_interval = 10.0 # seconds, safety timeout for moves without a time
 
 def name_val(arr, name):
   if name in arr:
@@ -97,102 +98,406 @@ def name_val(arr, name):
 def strip_adr(adr):
   return adr.replace("/", "")
 
-def osc_loop():
+def timed_handler(cb):
+  # wraps an OSC callback so its dispatch time is recorded per address
+  def handler(adr, *args):
+    start = time.perf_counter()
+    try:
+      cb(adr, *args)
+    finally:
+      metrics.histogram("osc_dispatch_seconds", address=adr).observe(time.perf_counter() - start)
+  return handler
+
+def osc_loop(ready_q):
   # runs as a thread waiting for incoming OSC messages
   # set up server
-  server = osc_server.ThreadingOSCUDPServer((get_ip(), 5005), dispatcher)
+  start = time.monotonic()
+  server = osc_server.ThreadingOSCUDPServer((get_ip(), FLAGS.osc_port), dispatcher)
   #server = osc_server.ThreadingOSCUDPServer(("127.0.0.1", 5005), dispatcher)
-  print("Serving on {}".format(server.server_address))
+  log.info("Serving on %s", server.server_address)
+  startup.report(ready_q, "control", startup.READY, start)
   # blocks on this
   server.serve_forever()
 
-def audio_output_loop(q):
+def init_hardware(ready_q):
+  # runs as a thread at startup so the CRICKIT (or Arduino) setup overlaps
+  # with the worker processes loading their libraries and models
+  global crickit, motor_1, motor_2, motion_engine, servo_engine, pixels, led_engine, ss, ser
+  begin = time.monotonic()
+  if MCU == "ARDUINO":
+    ser = open_serial(FLAGS.usb)
+  else:
+    start = time.monotonic()
+    if FLAGS.simulate:
+      import sim_crickit
+      crickit = sim_crickit.SimCrickit()
+    else:
+      from adafruit_crickit import crickit
+      import neopixel
+      from adafruit_seesaw.neopixel import NeoPixel
+    import servos
+    import leds
+    startup.report(ready_q, "hardware", "imports", start)
+
+    start = time.monotonic()
+    #define the motors
+    motor_1 = crickit.dc_motor_1
+    motor_2 = crickit.dc_motor_2
+
+    # stop the motors
+    motor_1.throttle = 0.0
+    motor_2.throttle = 0.0
+    # runs timed and eased moves at a fixed rate
+    motion_engine = motion.MotionEngine([motor_1, motor_2], safety_timeout=move_stop_interval, bus=i2c_lock)
+    # moves all four servos smoothly from a single /servo/ message
+    servo_engine = servos.ServoEngine([crickit.servo_1, crickit.servo_2, crickit.servo_3, crickit.servo_4], bus=i2c_lock)
+
+    # bpp=4 is required for RGBW
+    # the LED engine sends each frame with a single show()
+    if FLAGS.simulate:
+      pixels = sim_crickit.SimPixels(num_pixels)
+    else:
+      pixels = NeoPixel(crickit.seesaw, 20, num_pixels, brightness=0.02, pixel_order=neopixel.RGBW, bpp=4, auto_write=False)
+    # black out the LEDs
+    pixels.fill((1,2,3,0)) # there's a bug in the neopixel lib that ignores zeros in rgbw
+    pixels.show()
+    led_engine = leds.LedEngine(pixels, num_pixels, led_fps(), bus=i2c_lock) # the governor may have capped it already
+    # https://github.com/adafruit/Adafruit_CircuitPython_seesaw/issues/32
+    # DEFINE sensors
+    # For signal control, we'll chat directly with seesaw, use 'ss' to shorted typing!
+    ss = crickit.seesaw
+    startup.report(ready_q, "hardware", "crickit", start)
+
+  # turn off all analog ports
+  analogin_cb("/analogin/", "stop", 50, -1)
+  #############ADD TURN OFF ALL MOTORS/SERVOS
+  hardware_ready_e.set()
+  startup.report(ready_q, "hardware", startup.READY, begin)
+
+def open_serial(usb):
+  # setup USB Port for connection to Arduino
+  import serial
+  import serial.tools.list_ports
+  try:
+    port = serial.Serial(usb, baudrate=115200,
+                    parity=serial.PARITY_NONE,
+                    stopbits=serial.STOPBITS_ONE,
+                    bytesize=serial.EIGHTBITS,
+                    timeout=1
+                    )
+    log.info("Connected to USB port: %s", usb)
+    return port
+  except:
+    comlist = serial.tools.list_ports.comports()
+    connected = []
+    for element in comlist:
+        connected.append(element.device)
+    log.error("Can't connect to USB port: %s, Available USB ports: %s", usb, connected)
+    return None
+
+def startup_monitor(ready_q, report):
+  # collects the startup phases from every subsystem and tells Unity as each comes up
+  while not report.all_ready():
+    subsystem, phase, start, end = ready_q.get()
+    report.add(subsystem, phase, start, end)
+    if phase == startup.READY:
+      log.info("%s ready after %.2f seconds", subsystem, end - report.t0)
+      client.send_message("/str/ready/", subsystem)
+  log.info("%s", report.breakdown())
+  queue_put(audio_output_q, ("speak","pico","GB","hello"))
+  log.info("Delft Toolkit Initialization Complete")
+  # blink leds
+  leds_cb("/leds", "blink", 0.1, 10, "0,0,127")
+
+def audio_output_loop(q, ready_q, metrics_q, out_q):
+  toolkit_log.setup("audio", FLAGS.log_level)
+  scheduling.configure("audio", FLAGS)
+  metrics.start_reporter(metrics_q, "audio")
+  start = time.monotonic()
+  import text_to_speech_pico as tts_pico
+  import play_wav as pw
+  tts_pico.engine_for(tts_pico.voice_for("")) # loads the default voice's lingware now rather than on the first /textToSpeech/
+  startup.report(ready_q, "audio", startup.READY, start)
   tts = None
+  client = fanout.QueueClient(out_q) # the bridge sends it on
+  profiler = profiling.Profiler("audio", profile_reply(client))
   while True:
-    command = q.get() # the queue has a tuple in it
-    if command[0] == "init":
-      print("Watson TTS initializing " + command[1])
+    command = q.get().item # the queue has a tuple in it
+    profiler.tick()
+    start = time.monotonic()
+    if command[0] == "profile":
+      profiler.command(*command[1:4])
+    elif command[0] == "init":
+      log.info("Watson TTS initializing %s", command[1])
       if command[1] == "watson":
         if tts == None:
           iamkey, url = command[2:4]
+          import text_to_speech_watson as tts_watson
           tts = tts_watson.tts_watson(iamkey, url)
         else:
-          print("Watson TTS Already Initialized ")
+          log.info("Watson TTS Already Initialized")
     elif command[0] == "speak":
       model, voice, utterance = command[1:4]
       if model == "pico":
         tts_pico.speak(utterance, voice)
-        print("Pico Speaking... " + utterance)
+        log.debug("Pico Speaking... %s", utterance)
       if model == "watson":
         if tts != None:
           tts.speak(utterance, voice)
-          print("Watson Speaking... " + utterance)
+          log.debug("Watson Speaking... %s", utterance)
         else:
-          print("Can't speak, Watson not initialized...")
+          log.warning("Can't speak, Watson not initialized...")
+      metrics.histogram("speak_seconds", engine=model).observe(time.monotonic() - start)
     elif command[0] == "playsound":
       filename = command[1]
       #print("Playing sound... " + filename)
       pw.play(filename)
-
-
-def listen_loop(q):
-  stt = None
-  client = udp_client.SimpleUDPClient(FLAGS.server_ip, 5006)
-  watson_init = False
-  watson_lang = ""
+      metrics.histogram("playsound_seconds").observe(time.monotonic() - start)
+
+
+def listen_loop(q, ready_q, metrics_q, out_q):
+  toolkit_log.setup("listen", FLAGS.log_level)
+  scheduling.configure("listen", FLAGS)
+  # commands are read here, transcription runs in listen_worker so that a newer
+  # request (or a stop) can cancel the one in progress instead of queueing behind it
+  metrics.start_reporter(metrics_q, "listen")
+  start = time.monotonic()
+  import speech_to_text_watson as stt_watson # pyaudio and the watson sdk
+  import chat
+  try:
+    responder = chat.load_responder(FLAGS.chat_responder)
+  except Exception:
+    log.exception("can't load chat responder %s, chat will echo", FLAGS.chat_responder)
+    responder = chat.echo
+  startup.report(ready_q, "listen", startup.READY, start)
+  client = fanout.QueueClient(out_q) # the bridge sends it on
+  state = {
+    "stt": None,
+    "interim_interval": -1, # interim hypotheses are only forwarded when this is >= 0
+    "request": None, # newest transcribe/continuous request not yet picked up
+    "active": None, # request the worker is transcribing
+    "generation": 0, # bumped by every request so the worker can spot superseded ones
+    "chat": None, # the conversation the worker is holding
+    "responder": responder
+  }
+  cond = threading.Condition()
+  worker = Thread(target=listen_worker, args=(state, cond, client), daemon=True)
+  worker.start()
+  profiler = profiling.Profiler("listen", profile_reply(client))
   while True:
-    command = q.get()
+    work = q.get()
+    command = work.item
+    profiler.tick()
     #time.sleep(0.1)
-    print("got command: ",command)
-    if command[0] == "init":
+    log.debug("got command: %s waited %.3f", command[0], work.wait)
+    if command[0] == "profile":
+      profiler.command(*command[1:4])
+    elif command[0] == "interim":
+      type, interval = command[1:3]
+      if type == "start":
+        state["interim_interval"] = max(0.0, float(interval))
+      else:
+        state["interim_interval"] = -1
+      log.info("interim transcripts: %s min interval: %s", type, state["interim_interval"])
+    elif command[0] == "init":
       if command[1] == "watson":
-        if stt == None:
+        if state["stt"] == None:
             iamkey, url = command[2:4]
             watson_lang = "enUS"
             timeout = -1
               # print("Watson STT initializing key: " + iamkey + " url: " + url)
-            stt = stt_watson.stt_watson(iamkey, url, watson_lang, timeout)
-            watson_init = True
-        else:
-          print("Watson STT Already Initialized ")
-    elif command[0] == "transcribe":
-      model, lang, time_limit = command[1:4]
-      if model == "watson":
-        if stt != None and watson_init and lang == watson_lang:
-          print("request transcript")
-          watson_lang = lang
-          #print("Watson Transcribing... ")
-          transcription = stt.transcribe(watson_lang, time_limit).replace("'","")
+            state["stt"] = stt_watson.stt_watson(iamkey, url, watson_lang, timeout)
         else:
-          # print("Can't transcribe, Watson not initialized...")
-          # transcription = "Watson STT not initialized"
-          print("Watson STT initializing key: " + iamkey + " url: " + url)
-          stt.restart(watson_lang)
-          transcription = stt.transcribe(watson_lang, time_limit).replace("'","")
-          watson_init = True
-        # transcription = sp.speech2text(duration).replace("'","")
-        if (transcription != ""):
-          client.send_message("/str/speech2text/", transcription)
-          print("accepted final transcription: " + transcription)
+          log.info("Watson STT Already Initialized")
+    elif command[0] in ("transcribe", "continuous", "chat", "stop"):
+      with cond:
+        state["generation"] += 1
+        # the newest request always wins, anything older is dropped or cancelled
+        if command[0] == "stop":
+          state["request"] = None
         else:
-          print("no transcription")
-          client.send_message("/str/speech2text/", "no transcription")
-
-
-def reconize_loop(q, e, FLAGS, model):
+          state["request"] = command + (state["generation"], work.id)
+        if state["active"] != None and state["stt"] != None:
+          log.info("cancelling %s request", state["active"][0])
+          state["stt"].cancel()
+        if state["chat"] != None:
+          state["chat"].stop()
+        cond.notify()
+
+def listen_worker(state, cond, client):
+  import speech_to_text_watson as stt_watson
+  import chat
+  while True:
+    with cond:
+      while state["request"] == None:
+        cond.wait()
+      request = state["request"]
+      state["request"] = None
+      state["active"] = request
+      stt = state["stt"]
+    mode, model, lang, time_limit = request[:4]
+    generation, request_id = request[-2:]
+    on_interim = None
+    if state["interim_interval"] >= 0:
+      on_interim = stt_watson.stt_watson.InterimFilter(
+        lambda text: clock_sync.send(client, "/str/speech2text_interim/", [text.replace("'","")]),
+        state["interim_interval"])
+    if model != "watson" or stt == None:
+      log.warning("Can't transcribe, Watson not initialized...")
+      clock_sync.send(client, "/str/chat/" if mode == "chat" else "/str/speech2text/", ["no transcription", request_id])
+    elif mode == "transcribe":
+      log.debug("request transcript")
+      transcription = stt.transcribe(lang, time_limit, on_interim)
+      if transcription == None:
+        log.info("transcription cancelled")
+      elif (transcription.replace("'","") != ""):
+        transcription = transcription.replace("'","")
+        clock_sync.send(client, "/str/speech2text/", [transcription, request_id], stt.final_at)
+        log.info("accepted final transcription: %s", transcription)
+      else:
+        log.info("no transcription")
+        clock_sync.send(client, "/str/speech2text/", ["no transcription", request_id])
+    elif mode == "chat":
+      # listens, answers and speaks here, the only messages out are the reports
+      pipeline = chat.ChatPipeline(chat.WatsonListener(stt, lang, time_limit), state["responder"],
+        chat.PicoSpeaker(request[4]), chat_reply(client, request_id))
+      with cond:
+        if state["generation"] == generation:
+          state["chat"] = pipeline
+      if state["chat"] is pipeline:
+        log.info("chat started")
+        pipeline.run(lambda: state["generation"] == generation)
+        log.info("chat stopped")
+      with cond:
+        state["chat"] = None
+    else: # continuous, one transcript per utterance until stopped or superseded
+      log.info("continuous listening started")
+      while state["generation"] == generation:
+        transcription = stt.transcribe(lang, time_limit, on_interim, keep_streaming=True)
+        if transcription == None:
+          break
+        if stt.got_final and transcription.replace("'","").strip() != "":
+          transcription = transcription.replace("'","")
+          clock_sync.send(client, "/str/speech2text/", [transcription, request_id], stt.final_at)
+          log.info("accepted final transcription: %s", transcription)
+      log.info("continuous listening stopped")
+    with cond:
+      state["active"] = None
+      if stt != None:
+        stt.clear_cancel() # a cancel aimed at the request that just ended
+        if state["request"] == None:
+          stt.stop_listening()
+
+
+def chat_reply(client, request_id):
+  # each chat turn: what was said and heard, then how long every stage took
+  def reply(turn):
+    clock_sync.send(client, "/str/chat/", [" ".join(turn.said), turn.heard, request_id], turn.heard_at)
+    clock_sync.send(client, "/str/chat_timing/", [turn.describe()] + turn.timing())
+  return reply
+
+def camera_loop(bus, ready_q, metrics_q, FLAGS):
+  # the only process that talks to the camera, every frame goes on the frame bus
+  toolkit_log.setup("camera", FLAGS.log_level)
+  scheduling.configure("camera", FLAGS)
+  metrics.start_reporter(metrics_q, "camera")
+  begin = time.monotonic()
+  import frame_bus
+  source = frame_bus.open_source(FLAGS.camera, bus.width, bus.height, FLAGS.camera_fps)
+  startup.report(ready_q, "camera", startup.READY, begin)
+  log.info("%s camera publishing %dx%d at %s fps on %s", FLAGS.camera, bus.width, bus.height, FLAGS.camera_fps, bus.name)
+  frame_bus.capture_loop(bus, source, FLAGS.camera_fps)
+
+def preview_loop(bus, overlay, ready_q, metrics_q, FLAGS):
+  # MJPEG of the camera, at a lower priority than everything else so watching never slows recognition
+  toolkit_log.setup("preview", FLAGS.log_level)
+  metrics.start_reporter(metrics_q, "preview")
+  begin = time.monotonic()
+  os.nice(10)
+  import cv2
+  cv2.setNumThreads(1)
+  scheduling.configure("preview", FLAGS) # on top of those defaults
+  import preview
+  viewer = preview.Preview(bus, FLAGS.preview_width, FLAGS.preview_fps, FLAGS.preview_quality, overlay)
+  viewer.start()
+  preview.serve(viewer, FLAGS.preview_port, name=FLAGS.robot_id)
+  startup.report(ready_q, "preview", startup.READY, begin)
+  log.info("camera preview on http://%s:%s/", get_ip(), FLAGS.preview_port)
+  threading.Event().wait()
+
+def reconize_loop(q, ready_q, metrics_q, out_q, FLAGS, model, bus=None, overlay=None):
   #obj.take_picture_recognize.picture_being_taken= False
-  camera = picamera.PiCamera()
-  client = udp_client.SimpleUDPClient(FLAGS.server_ip, 5006)
-  print("server: " + FLAGS.server_ip)
-  print("initializing recognition model...")
-  rec.init(camera, model)
-  e.set() # notify main process that model intialization is done
+  toolkit_log.setup("recognize", FLAGS.log_level)
+  scheduling.configure("recognize", FLAGS)
+  metrics.start_reporter(metrics_q, "recognize")
+  begin = time.monotonic()
+  import classify_pic_once as rec # cv2 and numpy
+  import detection
+  import preview
+  startup.report(ready_q, "recognize", "imports", begin)
+  client = fanout.QueueClient(out_q) # the bridge sends it on
+  log.debug("server: %s", FLAGS.server_ip)
+
+  # open the camera while the model loads, unless the camera process has it
+  cameras = []
+  def open_camera():
+    start = time.monotonic()
+    if bus == None:
+      import picamera # only on a Pi with a camera, --camera synthetic runs without it
+      cameras.append(picamera.PiCamera())
+    else:
+      cameras.append(None)
+    startup.report(ready_q, "recognize", "camera", start)
+  camera_thread = Thread(target=open_camera)
+  camera_thread.start()
+
+  log.info("initializing recognition model...")
+  start = time.monotonic()
+  rec.change_model(model)
+  startup.report(ready_q, "recognize", "model", start)
+  start = time.monotonic()
+  rec.warmup() # the first forward pass is much slower than the rest
+  startup.report(ready_q, "recognize", "warmup", start)
+
+  camera_thread.join()
+  rec.init(cameras[0], model, FLAGS.scene_threshold, FLAGS.scene_max_age, bus)
+  startup.report(ready_q, "recognize", startup.READY, begin)
+  profiler = profiling.Profiler("recognize", profile_reply(client))
+  last_run = 0.0
   while True:
-    new_model = q.get()
+    # when the Pi runs hot the governor spaces recognitions out, the queue
+    # keeps only the newest request meanwhile
+    wait = last_run + governor.recognize_interval() - time.monotonic()
+    if wait > 0:
+      time.sleep(wait)
+    # only the newest request is kept, so results describe the current scene
+    work = q.get()
+    profiler.tick()
+    if work.item[0] == "profile":
+      profiler.command(*work.item[1:4])
+      continue
+    last_run = time.monotonic()
+    new_model = work.item[1]
+    if work.item[0] == "recognize" and governor.recognize_model() != "":
+      new_model = governor.recognize_model() # a lighter model while it cools down
+    captured = time.monotonic() # the picture is taken first thing
+    if work.item[0] == "detect":
+      found = rec.run_detection_on_image(new_model)
+      clock_sync.send(client, "/str/detect/", detection.osc_args(found, work.id), captured)
+      if overlay != None:
+        preview.publish_overlay(overlay, detection.summary(found), found)
+      metrics.histogram("recognize_seconds").observe(time.monotonic() - work.queued_at)
+      log.info("Obj detection: %s", detection.summary(found))
+      continue
     match_results = rec.run_inference_on_image(new_model)
     time.sleep(0.08)
-    client.send_message("/str/recognize/", match_results)
-    print("Obj recognition: " + match_results)
+    # the request id lets Unity match the result to the /recognize/ it sent,
+    # the timestamp says when the picture was taken
+    clock_sync.send(client, "/str/recognize/", [match_results, work.id], captured)
+    if overlay != None:
+      preview.publish_overlay(overlay, match_results)
+    metrics.histogram("recognize_seconds").observe(time.monotonic() - work.queued_at)
+    log.info("Obj recognition: %s", match_results)
 
 def get_ip():
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -207,9 +512,8 @@ def get_ip():
     return IP
 
 def move_cb(adr, type, move_time, speed, easing):
-  global move_stop_time, move_stop_interval
   move_time = '%.5f'%(move_time) # Unity sends very long floats that upset the Arduino
-  print("move: " + type + " " + str(move_time) + " " + str(speed) + " " +  easing)
+  log.debug("move: %s %s %s %s", type, move_time, speed, easing)
   arduinoStr = '{},{},{},{},{}\n'.format(
     name_val(events, strip_adr(adr)),
     name_val(types, type),
@@ -218,11 +522,12 @@ def move_cb(adr, type, move_time, speed, easing):
     name_val(easings, easing)
   )
   if not send_serial_command(arduinoStr):
-    # make sure the motor timeout is set before we start the motors
-    move_stop_time = time.time() + move_stop_interval
+    if not hardware_ready_e.is_set():
+      log.warning("CRICKIT not ready yet, ignoring move")
+      return
     speed = float(speed)
     speed = max(-1, min(speed, 1)) # make sure the motor speed is between -1 and 1
-    print("CRICKIT MOTOR speed: " + str(speed))
+    log.debug("CRICKIT MOTOR speed: %s", speed)
         # MOVE "stop", "forward", "backward", "turnRight", "turnLeft",
         # MOVE adr, type, time, speed, easing
     if type == "stop":
@@ -245,15 +550,17 @@ def move_cb(adr, type, move_time, speed, easing):
        left_val = 0
        right_val = 0
 
-    motor_1.throttle = left_val
-    motor_2.throttle = right_val
+    # the motion engine ramps the motors and stops them when move_time is up
+    if left_val == 0 and right_val == 0:
+      motion_engine.stop()
+    else:
+      motion_engine.start_move([left_val, right_val], float(move_time), easing)
 
-    print("Move TYPE: " + type + " L=" + str(left_val) + " R=" + str(right_val),move_stop_time)
+    log.debug("Move TYPE: %s L=%s R=%s time=%s %s", type, left_val, right_val, move_time, easing)
 
 
 
 def leds_cb(adr, type, dly_time, lednum, color):
-  global blink, blink_color, blink_delay, blink_next_time, blink_state, blink_times
   dly_time = '%.5f'%(dly_time) # Unity sends very long floats that upset the Arduino
   #print("leds: " + type + " " +  str(dly_time) + " " + str(lednum) + " " +  color)
   arduinoStr = '{},{},{},{},{}\n'.format(
@@ -264,6 +571,9 @@ def leds_cb(adr, type, dly_time, lednum, color):
     color
   )
   if not send_serial_command(arduinoStr):
+    if not hardware_ready_e.is_set():
+      log.warning("CRICKIT not ready yet, ignoring leds")
+      return
     red = int(color.split(',')[0])
     green = int(color.split(',')[1])
     blue = int(color.split(',')[2])
@@ -272,28 +582,22 @@ def leds_cb(adr, type, dly_time, lednum, color):
     #print("led command...",set_color)
 
     #print("type: " + type + " " + str(name_val(types, "set")))
+    # the LED engine draws and sends the frames
     if type == "set":
       #print("leds set")
       if lednum == -1:
         # set all the leds to the same color
-        pixels.fill((set_color))
+        led_engine.set(set_color)
       elif lednum > 0 and lednum < num_pixels:
-        pixels[lednum] = set_color
+        led_engine.set(set_color, lednum)
     #elif type == name_val(types, "allOff"):
     elif type == "allOff":
-      print("leds allOff")
-      pixels.fill((0,0,0,0))
-    elif type == "blink":
-      print("leds set blink...")
-      blink_delay = float(dly_time)
-      blink_next_time = time.time()
-      blink = True
-      blink_color = set_color
-      blink_state = False
-      blink_times = (lednum  * 2)
-
-      #pixels.fill((color))
-      #print(blink, blink_color, blink_delay, blink_next_time, blink_state, blink_times)
+      log.debug("leds allOff")
+      led_engine.off()
+    elif type in ("blink", "fade", "chase", "pulse"):
+      # blink, fade, chase or pulse, lednum is how many times
+      log.debug("leds %s...", type)
+      led_engine.animate(type, set_color, float(dly_time), lednum)
 
 
 def delay_cb(adr, type, time):
@@ -309,7 +613,7 @@ def delay_cb(adr, type, time):
 def analogin_cb(adr, type, interval, port):
   global analog_ports, analog_interval
   port = max(1, min(port, 8)) # make sure port is between 1 & 8
-  print("analogin: " + type + " interval: " +  str(interval) + " port: " + str(port))
+  log.info("analogin: %s interval: %s port: %s", type, interval, port)
   arduinoStr = '{},{},{},{}\n'.format(
     name_val(events, strip_adr(adr)),
     name_val(types, type),
@@ -326,7 +630,7 @@ def analogin_cb(adr, type, interval, port):
 def touch_cb(adr, type, interval, port):
   global touch_ports, touch_interval
   port = max(1, min(port, 4)) # make sure port is between 1 & 4 -- the Adafruit CRICKIT is labeled 1,2,3,4
-  print("touch: " + type + " interval: " +  str(interval) + " port: " + str(port))
+  log.info("touch: %s interval: %s port: %s", type, interval, port)
   arduinoStr = '{},{},{},{}\n'.format(
     name_val(events, strip_adr(adr)),
     name_val(types, type),
@@ -341,7 +645,7 @@ def touch_cb(adr, type, interval, port):
           touch_ports[port] = False
 
 def servo_cb(adr, type, angle, port, varspeed, easing):
-  print("servo: " + type + " " +  str(angle) + " port: " + str(port))
+  log.debug("servo: %s %s port: %s", type, angle, port)
   arduinoStr = '{},{},{},{},{},{}\n'.format(
     name_val(events, strip_adr(adr)),
     name_val(types, type),
@@ -351,80 +655,200 @@ def servo_cb(adr, type, angle, port, varspeed, easing):
     name_val(easings, easing)
   )
   if not send_serial_command(arduinoStr):
+    if not hardware_ready_e.is_set():
+      log.warning("CRICKIT not ready yet, ignoring servo")
+      return
     port = str(port)
-    print("CRICKIT SERVO: " + port)
-    if port == "1": # first servo out
-        realport = crickit.servo_1
-    elif port == "2": # second servo out
-        realport = crickit.servo_2
-    elif port == "3":
-        realport = crickit.servo_3
-    elif port == "4":
-        realport = crickit.servo_4
+    log.debug("CRICKIT SERVO: %s", port)
+    if port in ("1", "2", "3", "4"):
+        index = int(port) - 1
     else:
-        realport = crickit.servo_1
-    realport.angle = int(angle)
+        index = 0 # first servo out
+    if type == "varspeed":
+      servo_engine.move(index, float(angle), varspeed, easing)
+    else: # immediate
+      servo_engine.move(index, float(angle))
 
 def crickit_servo(str):
   adr, type, angle, port, varspeed, easing = str.split()
 
+def queue_put(q, item, key=None, id=None):
+  if q.put(item, key=key, id=id) == None:
+    log.warning("queue %s is full, dropped %s", q.name, item[0], extra=toolkit_log.every(1.0))
+
 def play_sound_cb(adr, filename, time):
-  audio_output_q.put(("playsound",filename))
+  queue_put(audio_output_q, ("playsound",filename))
+
+# an optional last argument tags the result with the caller's own request id
+
+def listen_cb(adr, model, lang, duration, *tag):
+  queue_put(listen_q, ("transcribe", model, lang, duration), "listen", *tag[:1])
+
+def listen_continuous_cb(adr, model, lang, duration, *tag):
+  queue_put(listen_q, ("continuous", model, lang, duration), "listen", *tag[:1])
 
-def listen_cb(adr, model, lang, duration):
-  listen_q.put(("transcribe", model, lang, duration))
+def listen_stop_cb(adr, *args):
+  queue_put(listen_q, ("stop",), "listen")
+
+def listen_interim_cb(adr, type, interval):
+  queue_put(listen_q, ("interim", type, interval), "interim")
+
+def chat_cb(adr, type, model="watson", lang="enUS", duration=10, voice="enUS", *tag):
+  # /chat/ start|stop, a conversation held by the listen process, see chat.py
+  if type == "stop":
+    queue_put(listen_q, ("stop",), "listen")
+  else:
+    queue_put(listen_q, ("chat", model, lang, duration, voice), "listen", *tag[:1])
 
 def initstt_cb(adr, model, iamkey, url):
-  listen_q.put(("init", model, iamkey, url))
+  queue_put(listen_q, ("init", model, iamkey, url), "init")
 
 def speak_cb(adr, model, voice, utterance):
-  print("speak: " + utterance)
-  audio_output_q.put(("speak", model, voice, utterance))
+  log.debug("speak: %s", utterance)
+  queue_put(audio_output_q, ("speak", model, voice, utterance))
 
 def inittts_cb(adr, model, iamkey, url):
-  audio_output_q.put(("init", model, iamkey, url))
-
-def recognize_cb(adr, type, model):
-  print("received cmd recognize: " + adr + " " + type + " " + model)
-  recognize_q.put(model)
+  queue_put(audio_output_q, ("init", model, iamkey, url))
+
+def ready_cb(adr, *args):
+  # Unity can ask which subsystems are up, e.g. after it reconnects
+  client.send_message("/str/ready/", startup_report.status())
+
+def recognize_cb(adr, type, model, *tag):
+  log.debug("received cmd recognize: %s %s %s", adr, type, model)
+  queue_put(recognize_q, ("recognize", model), None, *tag[:1])
+
+def detect_cb(adr, type, model="mobilenet-ssd", *tag):
+  # /detect/ <type> [model] [request id], answered on /str/detect/
+  log.debug("received cmd detect: %s %s %s", adr, type, model)
+  queue_put(recognize_q, ("detect", model), None, *tag[:1])
+
+def update_queue_gauges():
+  for q in (audio_output_q, listen_q, recognize_q):
+    stats = q.stats()
+    metrics.gauge("queue_depth", queue=q.name).set(stats["depth"])
+    metrics.gauge("queue_dropped", queue=q.name).set(stats["dropped"])
+
+stats_interval = 0 # seconds between /str/stats/ snapshots, 0 = only when asked
+stats_e = threading.Event()
+
+def stats_cb(adr, *args):
+  # /stats/ sends one snapshot, /stats/ <seconds> keeps sending them, /stats/ 0 stops
+  global stats_interval
+  if len(args) > 0:
+    stats_interval = max(0.0, float(args[0]))
+  stats_e.set()
+
+def stats_loop(aggregator):
+  while True:
+    stats_e.wait(stats_interval if stats_interval > 0 else None)
+    stats_e.clear()
+    for process, snapshot in aggregator.snapshots().items():
+      lines = metrics.summary_lines(process, snapshot)
+      if len(lines) > 0:
+        client.send_message("/str/stats/", "\n".join(lines))
+
+def profile_reply(client):
+  # sends a profiler summary back to Unity
+  return lambda lines: client.send_message("/str/profile/", "\n".join(lines))
+
+def profile_cb(adr, action, process="all", mode="sampling", n=10):
+  # /profile/ start|stop|dump bridge|audio|listen|recognize|all [sampling|deterministic] [top n]
+  command = ("profile", action, mode, int(n))
+  if process in ("bridge", "all"):
+    profiler.command(*command[1:])
+  if process in ("audio", "all"):
+    queue_put(audio_output_q, command)
+  if process in ("listen", "all"):
+    queue_put(listen_q, command, "profile")
+  if process in ("recognize", "all"):
+    queue_put(recognize_q, command, "profile")
+
+def timeline_cb(adr, action, name="", arg=None):
+  timelines.command(action, name, arg)
+
+def timeline_reply(line):
+  client.send_message("/str/timeline/", line)
+
+def read_sensor(kind, port):
+  # one reading for the sensor log, touch reads 1023 or 0 like /num/touch/
+  hardware_ready_e.wait()
+  if kind == "touch":
+    with i2c_lock:
+      return 1023 if getattr(crickit, "touch_" + str(max(1, min(port, 4)))).value else 0
+  with i2c_lock, metrics.histogram("i2c_read_seconds", device="sensorlog").time():
+    return ss.analog_read(getattr(crickit, "SIGNAL" + str(max(1, min(port, 8)))))
+
+sensors = None
+sensors_lock = threading.Lock()
+
+def sensorlog_cb(adr, action, kind="analog", port=1, a=None, b=None):
+  global sensors
+  with sensors_lock:
+    if sensors == None:
+      # numpy is only loaded once the sensor log is used
+      import sensor_log
+      sensors = sensor_log.SensorLog(read_sensor, sensorlog_reply, FLAGS.sensor_log_dir, FLAGS.sensor_log_size,
+        sensor_log.CRICKIT_RATE)
+  sensors.command(action, kind, port, a, b)
+
+def sensorlog_reply(args, captured=None):
+  clock_sync.send(client, "/str/sensorlog/", args, captured)
+
+def led_fps():
+  # never faster than --led_fps
+  return FLAGS.led_fps if led_fps_limit == None else min(FLAGS.led_fps, led_fps_limit)
+
+def governor_apply(name, value):
+  # the governor's changes to the bridge's own rates, motors and servos are never slowed
+  global sensor_scale, led_fps_limit
+  if name == "sensor_scale":
+    sensor_scale = value
+  elif name == "led_fps":
+    led_fps_limit = value # kept for init_hardware if the LEDs are not set up yet
+    if led_engine != None:
+      led_engine.set_fps(led_fps())
+
+def governor_reply(line):
+  client.send_message("/str/governor/", line)
+
+def governor_cb(adr, *args):
+  # /governor/ asks for the current level and readings
+  governor_reply(thermal.status())
+
+def pong_cb(adr, seq, t1, t2, t3):
+  # Unity's answer to a /sync/ping/
+  clock.pong(seq, t1, t2, t3)
+
+def subscribe_cb(adr, host, port, pattern="*", max_rate=0, ttl=fanout.DEFAULT_TTL):
+  client.subscribe(host, port, pattern, max_rate, ttl)
+  client.target(host, port).send_message("/str/subscribed/", pattern)
+
+def unsubscribe_cb(adr, host, port, pattern=None):
+  client.unsubscribe(host, port, pattern)
+
+def subscribers_cb(adr, *args):
+  client.send_message("/str/subscribers/", "\n".join(client.summary()))
+
+def queues_cb(adr, *args):
+  for q in (audio_output_q, listen_q, recognize_q):
+    client.send_message("/str/queues/", q.summary())
 
 def main(_):
-  global ser, blink, blink_state, blink_delay, blink_next_time, blink_color, blink_times
-  global analogin, analog_ports, analog_interval, analog_next_time, move_stop_time
+  global ser
+  global analogin, analog_ports, analog_interval, analog_next_time
   global touch_ports, touch_interval, touch_next_time
   count = 0.0;
+  hardware_ready_e.wait() # the control loop needs the CRICKIT
+  # optionally real-time, along with the threads that drive the motors, servos and LEDs
+  scheduling.control_realtime(FLAGS, [e.thread for e in (motion_engine, servo_engine, led_engine) if e != None])
   while True:
+      profiler.tick()
       # print("touch",touch_ports,touch_next_time, check_touch())
-      # shut down any motor moves after move_stop_time
-      if time.time() > move_stop_time:
-          if motor_1.throttle > 0 or motor_2.throttle > 0:
-              motor_1.throttle = 0
-              motor_2.throttle = 0
-              print("#########TIMEOUT -- STOPPING MOTORS")
-              #print(time.time(),move_stop_time, move_stop_time - time.time())
-      #### BLINK
-      if blink == True:
-        #print("blink ON " + str(time.time()))
-        if time.time() > blink_next_time and blink_times > 0:
-          #print("blink... times=" + str(blink_times) + " next time=" + str(blink_next_time))
-          if blink_state:
-            pixels.fill((0,0,0,0)) #OFF
-            #print("OFF")
-          else:
-            print(str(blink_times / 2) + " " + "ON")
-            pixels.fill(blink_color) #ON
-          blink_next_time = time.time() + blink_delay
-          blink_times = blink_times - 1
-          blink_state = not blink_state
-        elif time.time() <= blink_next_time and blink_times < 1:
-            #print("blink DONE")
-            blink = False
-            pixels.fill((0,0,0,0)) #OFF
-
       #### ANALOGIN
       # the interval is the same for all ports -- maybe have a separate array for intervals?
       if time.time() > analog_next_time and check_analog():
-        analog_next_time = time.time() + analog_interval
+        analog_next_time = time.time() + analog_interval * sensor_scale
         for i, read in enumerate(analog_ports):
             if analog_ports[i] == True:
                 sensor = crickit.SIGNAL1
@@ -446,21 +870,20 @@ def main(_):
                     sensor = crickit.SIGNAL8
                 else:
                     sensor = crickit.SIGNAL8
-                analog_value = float(ss.analog_read(sensor))
+                captured = time.monotonic()
+                with i2c_lock, metrics.histogram("i2c_read_seconds", device="analogin").time():
+                  analog_value = float(ss.analog_read(sensor))
                 osc_address="/num/analogin/" + str(i) + "/"
 
-                print(osc_address + " :",i,analog_value, "analog interval:",analog_interval)
-                builder = osc_message_builder.OscMessageBuilder(address = osc_address)
-                builder.add_arg(analog_value)
-                builder.add_arg(100)
-                builder.add_arg(999)
-                msg = builder.build()
-                client.send(msg)
+                log.debug("%s : %s %s analog interval: %s", osc_address, i, analog_value, analog_interval, extra=toolkit_log.every(1.0))
+                # value, the 100 and 999 Unity's DingDataPhysical has always had as value1 and value2,
+                # then when it was read on the clock shared with Unity
+                client.send(clock_sync.message(osc_address, [analog_value, 100, 999], captured))
 
         #### TOUCH
       # print("touch",touch_ports,touch_next_time, check_touch())
       if time.time() > touch_next_time and check_touch():
-        touch_next_time = time.time() + touch_interval
+        touch_next_time = time.time() + touch_interval * sensor_scale
         for i, read in enumerate(touch_ports):
           if touch_ports[i] == True:
               if i == 1:
@@ -475,20 +898,18 @@ def main(_):
                   sensor = crickit.touch_1
 
               # get the sensor status
-              if sensor.value: # check if the touch port is active from a touch
+              captured = time.monotonic()
+              with i2c_lock, metrics.histogram("i2c_read_seconds", device="touch").time():
+                  touched = sensor.value
+              if touched: # check if the touch port is active from a touch
                   touch_value = 1023
               else:
                   touch_value = 0
               # print("touch read, port:",i,touch_value, "touch interval:",touch_interval)
 
               osc_address="/num/touch/" + str(i) + "/"
-              print(osc_address + " :",i,touch_value, "touch interval:",touch_interval)
-              builder = osc_message_builder.OscMessageBuilder(address = osc_address)
-              builder.add_arg(touch_value)
-              builder.add_arg(100)
-              builder.add_arg(999)
-              msg = builder.build()
-              client.send(msg)
+              log.debug("%s : %s %s touch interval: %s", osc_address, i, touch_value, touch_interval, extra=toolkit_log.every(1.0))
+              client.send(clock_sync.message(osc_address, [touch_value, 100, 999], captured))
 
       # handle incoming messages from Arduino
       elif MCU == "ARDUINO" and ser != None:
@@ -506,7 +927,7 @@ def main(_):
             msg = builder.build()
             client.send(msg)
           else:
-            print ("unknown Arduino message:" + line)
+            log.warning("unknown Arduino message: %s", line.strip(), extra=toolkit_log.every(5.0))
       elif MCU == "ARDUINO":
         # send fake sensor numbers
         count += 1
@@ -521,6 +942,9 @@ def main(_):
         # blink leds
         time.sleep(0.01)
 
+      # sensor reads are due every few ms at most, the rest of the time leave the core to others
+      time.sleep(FLAGS.control_period)
+
 def check_analog():
     # are there any ports active?
     for port in analog_ports:
@@ -554,7 +978,6 @@ if __name__ == '__main__':
   parser = argparse.ArgumentParser()
 
   print("Delft Toolkit Initializing...")
-  print("network: " + socket.gethostname() + " " + get_ip())
   parser.add_argument(
       '--server_ip',
       type=str,
@@ -569,89 +992,429 @@ if __name__ == '__main__':
       help='serial port name for the arduino'
   )
 
-  FLAGS, unparsed = parser.parse_known_args()
+  parser.add_argument(
+      '--osc_port',
+      type=int,
+      default=5005,
+      help='port this robot takes OSC commands on, change it to run several bridges on one host'
+  )
 
-  # set up handlers for incoming OSC messages
-  dispatcher = dispatcher.Dispatcher()
-  dispatcher.map("/move/", move_cb)
-  dispatcher.map("/leds/", leds_cb)
-  dispatcher.map("/delay/", delay_cb)
-  dispatcher.map("/analogin/", analogin_cb)
-  dispatcher.map("/touch/", touch_cb)
-  dispatcher.map("/servo/", servo_cb)
-  dispatcher.map("/textToSpeech/", speak_cb)
-  dispatcher.map("/inittts/", inittts_cb)
-  dispatcher.map("/speechToText/", listen_cb)
-  dispatcher.map("/initstt/", initstt_cb)
-  dispatcher.map("/recognize/", recognize_cb)
-  dispatcher.map("/playSound/", play_sound_cb)
+  parser.add_argument(
+      '--fleet',
+      action='store_true',
+      help='also take commands from the fleet multicast group and announce this robot there'
+  )
 
-  # setup USB Port for connection to Arduino
-  if MCU == "ARDUINO":
-      try:
-        ser = serial.Serial(FLAGS.usb, baudrate=115200,
-                        parity=serial.PARITY_NONE,
-                        stopbits=serial.STOPBITS_ONE,
-                        bytesize=serial.EIGHTBITS,
-                        timeout=1
-                        )
-        print("Connected to USB port: " + FLAGS.usb)
-      except:
-        ser = None
-        comlist = serial.tools.list_ports.comports()
-        connected = []
-        for element in comlist:
-            connected.append(element.device)
-        print("Can't connect to USB port: " + FLAGS.usb + ", Available USB ports: " + str(connected))
-  # set up camera
-  #camera = picamera.PiCamera()
-  picture_ready = False
-  picture_being_taken = False
+  parser.add_argument(
+      '--robot_id',
+      type=str,
+      default=socket.gethostname(),
+      help='name of this robot in the fleet, commands to /robot/<robot_id>/... are only for it'
+  )
 
-  # turn off all analog ports
-  analogin_cb("/analogin/", "stop", 50, -1)
-  #############ADD TURN OFF ALL MOTORS/SERVOS
+  parser.add_argument(
+      '--fleet_groups',
+      type=str,
+      default='',
+      help='comma separated groups this robot is in, for commands to /group/<name>/...'
+  )
 
-  # use thread to handle incoming OSC messages from Unity
-  osc_thread = Thread(target=osc_loop,args=())
-  osc_thread.start() # run in background as a thread
+  parser.add_argument(
+      '--fleet_group',
+      type=str,
+      default='239.255.0.42',
+      help='multicast group of the fleet'
+  )
 
-  # Events for multiprocessing
-  recognition_ready_e = multiprocessing.Event()
+  parser.add_argument(
+      '--fleet_port',
+      type=int,
+      default=5007,
+      help='port of the fleet multicast group'
+  )
+
+  parser.add_argument(
+      '--fleet_interface',
+      type=str,
+      default='0.0.0.0',
+      help='IP of the network interface for the fleet group, 127.0.0.1 to try several bridges on one host'
+  )
+
+  parser.add_argument(
+      '--log_level',
+      type=str,
+      default='INFO',
+      help='DEBUG shows every command and sensor reading, or INFO, WARNING, ERROR'
+  )
+
+  parser.add_argument(
+      '--led_fps',
+      type=int,
+      default=30,
+      help='highest frame rate for LED effects'
+  )
+
+  parser.add_argument(
+      '--scene_threshold',
+      type=float,
+      default=0.0,
+      help='how much the camera image must change (grey levels) before recognition runs again, e.g. 4 when Unity asks for recognitions over and over; 0 always runs it'
+  )
+
+  parser.add_argument(
+      '--scene_max_age',
+      type=float,
+      default=5.0,
+      help='seconds a recognition result is reused for while the scene does not change'
+  )
+
+  parser.add_argument(
+      '--frame_bus',
+      action='store_true',
+      help='capture in a process of its own and share the frames in memory, so several vision features can use them'
+  )
+
+  parser.add_argument(
+      '--camera',
+      type=str,
+      default='picamera',
+      choices=['picamera', 'synthetic'],
+      help='where frames come from, synthetic makes test pictures and turns on --frame_bus'
+  )
+
+  parser.add_argument(
+      '--frame_size',
+      type=str,
+      default='640x480',
+      help='width x height of the frames on the frame bus'
+  )
+
+  parser.add_argument(
+      '--camera_fps',
+      type=float,
+      default=15.0,
+      help='frames per second put on the frame bus'
+  )
+
+  parser.add_argument(
+      '--preview_port',
+      type=int,
+      default=0,
+      help='port for an MJPEG preview of the camera at http://<robot>:<port>/, 0 to turn it off'
+  )
+
+  parser.add_argument(
+      '--preview_width',
+      type=int,
+      default=320,
+      help='largest width of the preview in pixels'
+  )
+
+  parser.add_argument(
+      '--preview_fps',
+      type=float,
+      default=5.0,
+      help='most preview frames a second'
+  )
+
+  parser.add_argument(
+      '--preview_quality',
+      type=int,
+      default=60,
+      help='JPEG quality of the preview, 0-100'
+  )
+
+  parser.add_argument(
+      '--preview_labels',
+      action='store_true',
+      help='draw the last recognition or detection on the preview'
+  )
+
+  parser.add_argument(
+      '--sensor_log_dir',
+      type=str,
+      default='sensorlog',
+      help='folder for the /sensorlog/ sample rings'
+  )
+
+  parser.add_argument(
+      '--sensor_log_size',
+      type=int,
+      default=65536,
+      help='samples kept for each sensor by /sensorlog/'
+  )
+
+  parser.add_argument(
+      '--affinity',
+      type=str,
+      default='',
+      help='cores for each process, e.g. "bridge=0;recognize=2-3;audio=1;listen=1"'
+  )
+
+  parser.add_argument(
+      '--nice',
+      type=str,
+      default='',
+      help='niceness for each process, e.g. "recognize=5;listen=2"'
+  )
+
+  parser.add_argument(
+      '--control_rt',
+      type=int,
+      default=0,
+      help='SCHED_FIFO priority (1-99) for the control loop, motion, servo and LED threads, 0 to leave them normal'
+  )
+
+  parser.add_argument(
+      '--cv_threads',
+      type=int,
+      default=0,
+      help='OpenCV threads for recognition and the preview, 0 for one per core in --affinity'
+  )
+
+  parser.add_argument(
+      '--control_period',
+      type=float,
+      default=0.002,
+      help='seconds the control loop sleeps between passes'
+  )
+
+  parser.add_argument(
+      '--governor_interval',
+      type=float,
+      default=2.0,
+      help='seconds between CPU temperature, throttling and load checks, 0 turns the governor off'
+  )
+
+  parser.add_argument(
+      '--governor_temps',
+      type=str,
+      default='70,77,82',
+      help='CPU temperatures (C) for the warm, hot and critical levels'
+  )
+
+  parser.add_argument(
+      '--governor_model',
+      type=str,
+      default='squeezenet',
+      help='lighter model recognition switches to at the hot and critical levels'
+  )
+
+  parser.add_argument(
+      '--governor_fake',
+      type=str,
+      default='',
+      help='comma separated temperatures to play back instead of reading the CPU, one per check, for testing'
+  )
+
+  parser.add_argument(
+      '--record',
+      type=str,
+      default='',
+      help='folder to record every OSC message in and out to, a new file each run, for replay.py'
+  )
+
+  parser.add_argument(
+      '--simulate',
+      action='store_true',
+      help='run without a robot: simulated CRICKIT motors, servos, LEDs and sensors and a synthetic camera'
+  )
+
+  parser.add_argument(
+      '--sync_interval',
+      type=float,
+      default=2.0,
+      help='seconds between clock sync pings to Unity, 0 to turn them off'
+  )
+
+  parser.add_argument(
+      '--chat_responder',
+      type=str,
+      default='chat:echo',
+      help='module:function that answers in /chat/ conversations, given the transcript and the turns before'
+  )
+
+  parser.add_argument(
+      '--stats_port',
+      type=int,
+      default=9105,
+      help='port for the Prometheus metrics endpoint, 0 to turn it off'
+  )
+
+  FLAGS, unparsed = parser.parse_known_args()
+  if FLAGS.simulate:
+    FLAGS.camera = "synthetic"
+  toolkit_log.setup("bridge", FLAGS.log_level)
+  log.info("network: %s %s", socket.gethostname(), get_ip())
+
+  # set up OSC client, everything the robot reports goes out through here and Unity gets all of it
+  client = fanout.Fanout()
+  client.subscribe(FLAGS.server_ip, 5006, "*", ttl=0)
+
+  # set up handlers for incoming OSC messages
+  osc_commands = [
+    ("/move/", move_cb),
+    ("/leds/", leds_cb),
+    ("/delay/", delay_cb),
+    ("/analogin/", analogin_cb),
+    ("/touch/", touch_cb),
+    ("/servo/", servo_cb),
+    ("/textToSpeech/", speak_cb),
+    ("/inittts/", inittts_cb),
+    ("/speechToText/", listen_cb),
+    ("/speechToTextContinuous/", listen_continuous_cb),
+    ("/speechToTextStop/", listen_stop_cb),
+    ("/speechToTextInterim/", listen_interim_cb),
+    ("/chat/", chat_cb),
+    ("/initstt/", initstt_cb),
+    ("/recognize/", recognize_cb),
+    ("/detect/", detect_cb),
+    ("/playSound/", play_sound_cb),
+    ("/ready/", ready_cb),
+    ("/queues/", queues_cb),
+    ("/stats/", stats_cb),
+    ("/profile/", profile_cb),
+    ("/timeline/", timeline_cb),
+    ("/sensorlog/", sensorlog_cb),
+    ("/governor/", governor_cb),
+    ("/pong/", pong_cb),
+    ("/subscribe/", subscribe_cb),
+    ("/unsubscribe/", unsubscribe_cb),
+    ("/subscribers/", subscribers_cb)
+  ]
+  dispatcher = dispatcher.Dispatcher()
+  for address, handler in osc_commands:
+    dispatcher.map(address, timed_handler(handler))
+
+  if FLAGS.record != "":
+    # everything Unity sends and everything sent back, with timing, for replay.py
+    import recorder
+    session = recorder.Recorder(recorder.session_path(FLAGS.record),
+      meta={"robot_id": FLAGS.robot_id, "simulate": FLAGS.simulate})
+    recorder.tap(dispatcher, session)
+    client.recorder = session
+    atexit.register(session.close) # the last half second is often the part that matters
+
+  # uploaded sequences can use any of the commands above, apart from /timeline/ itself
+  timelines = timeline.Timelines(dict(c for c in osc_commands if c[0] != "/timeline/"), timeline_reply)
+
+  if FLAGS.fleet:
+    # the same commands, sent once to the whole fleet over multicast
+    groups = [g for g in FLAGS.fleet_groups.split(",") if g != ""]
+    robots = fleet.Fleet(FLAGS.robot_id, groups, dict((a, timed_handler(h)) for a, h in osc_commands),
+      group=FLAGS.fleet_group, port=FLAGS.fleet_port, ip=get_ip(), osc_port=FLAGS.osc_port,
+      interface=FLAGS.fleet_interface)
+
+  # one capture process shares each frame with every vision feature
+  bus = None
+  if FLAGS.frame_bus or FLAGS.camera == "synthetic" or FLAGS.preview_port > 0:
+    import frame_bus
+    width, height = [int(v) for v in FLAGS.frame_size.split("x")]
+    bus = frame_bus.FrameBus.create(width, height, name=frame_bus.bus_name(FLAGS.osc_port))
+
+  # every subsystem reports its startup phases on this queue
+  ready_q = multiprocessing.Queue()
+  subsystems = ["control", "hardware", "audio", "listen", "recognize"] + (["camera"] if bus != None else [])
+  overlay = None
+  if FLAGS.preview_port > 0:
+    subsystems.append("preview")
+    if FLAGS.preview_labels:
+      import preview
+      overlay = preview.overlay_buffer() # the recognize process draws its results in here
+  startup_report = startup.StartupReport(subsystems, start_time)
+
+  # worker processes send their metrics to the bridge on this queue
+  metrics_q = multiprocessing.Queue()
+
+  # and hand their outgoing messages to the bridge, which sends them to the subscribers
+  out_q = multiprocessing.Queue()
 
   # Queues for multiprocessing
-  audio_output_q = multiprocessing.Queue()
-  listen_q = multiprocessing.Queue()
-  recognize_q = multiprocessing.Queue()
+  # speech and sounds play in order, a listen or recognize request replaces any older one still waiting
+  audio_output_q = WorkQueue("audio", "fifo", maxsize=8)
+  listen_q = WorkQueue("listen", "latest")
+  recognize_q = WorkQueue("recognize", "latest")
 
-  # launch processes
+  # launch processes, each one loads its own libraries and models in parallel.
+  # they are forked before any threads exist, which keeps fork() safe and only takes milliseconds
   audio_output_process = multiprocessing.Process(name='audio_output_process',
                                target=audio_output_loop,
-                               args=(audio_output_q,))
+                               args=(audio_output_q, ready_q, metrics_q, out_q))
 
   listen_process = multiprocessing.Process(name='listen_process',
                                target=listen_loop,
-                               args=(listen_q,))
+                               args=(listen_q, ready_q, metrics_q, out_q))
 
   recognize_process = multiprocessing.Process(name='recognize_process',
                                target=reconize_loop,
-                               args=(recognize_q,recognition_ready_e,FLAGS, default_recognize_model))
-
+                               args=(recognize_q, ready_q, metrics_q, out_q, FLAGS, default_recognize_model, bus, overlay))
+
+  if bus != None:
+    camera_process = multiprocessing.Process(name='camera_process',
+                               target=camera_loop,
+                               args=(bus, ready_q, metrics_q, FLAGS))
+    camera_process.start()
+  if FLAGS.preview_port > 0:
+    preview_process = multiprocessing.Process(name='preview_process',
+                               target=preview_loop,
+                               args=(bus, overlay, ready_q, metrics_q, FLAGS))
+    preview_process.start()
   recognize_process.start()
   audio_output_process.start()
   listen_process.start()
 
-  # wait for model init to finish before waiting for commands
-  recognition_ready_e.wait()
+  # the workers have their own cores and priorities, the bridge's threads all inherit these
+  scheduling.configure("bridge", FLAGS)
 
-  audio_output_q.put(("speak","pico","GB","hello"))
-  print("Delft Toolkit Initialization Complete")
-  # blink leds
-  leds_cb("/leds", "blink", 0.1, 10, "0,0,127")
+  # created on this thread so the control loop in main() is the thread it profiles,
+  # and before the OSC thread so a /profile/ during startup finds it
+  profiler = profiling.Profiler("bridge", profile_reply(client))
+
+  # holds optional work back before the Pi overheats, made before the OSC thread
+  # so a /governor/ during startup finds it, and started further down
+  if FLAGS.governor_fake != "":
+    source = governor.FakeSource([float(t) for t in FLAGS.governor_fake.split(",")])
+  else:
+    source = governor.SysfsSource()
+  thermal = governor.Governor(source, governor_apply, governor_reply, FLAGS.governor_interval,
+    [float(t) for t in FLAGS.governor_temps.split(",")], governor.Limits(FLAGS.governor_model))
+
+  # use thread to handle incoming OSC messages from Unity, commands are accepted
+  # from here on and each subsystem announces itself on /str/ready/ as it comes up
+  osc_thread = Thread(target=osc_loop,args=(ready_q,))
+  osc_thread.start() # run in background as a thread
+  if FLAGS.fleet:
+    robots.start()
+
+  # lines up this robot's timestamps with the Unity host's clock
+  clock = clock_sync.ClockSync(client.target(FLAGS.server_ip, 5006), FLAGS.sync_interval)
+  if FLAGS.sync_interval > 0:
+    clock.start()
+
+  # checks the temperature every --governor_interval seconds
+  if FLAGS.governor_interval > 0:
+    thermal.start()
+
+  # CRICKIT or Arduino setup runs alongside the worker processes
+  hardware_thread = Thread(target=init_hardware, args=(ready_q,), daemon=True)
+  hardware_thread.start()
+
+  monitor_thread = Thread(target=startup_monitor, args=(ready_q, startup_report), daemon=True)
+  monitor_thread.start()
+
+  forward_thread = Thread(target=client.forward, args=(out_q,), daemon=True)
+  forward_thread.start()
+
+  # metrics from all processes, published on /str/stats/ and over HTTP
+  aggregator = metrics.Aggregator(metrics_q)
+  aggregator.collect_hooks.append(update_queue_gauges)
+  stats_thread = Thread(target=stats_loop, args=(aggregator,), daemon=True)
+  stats_thread.start()
+  if FLAGS.stats_port > 0:
+    metrics.serve_http(aggregator, FLAGS.stats_port)
+    log.info("metrics on http://%s:%s/metrics", get_ip(), FLAGS.stats_port)
 
   analogin = False
 
-  # set up OSC client
-  client = udp_client.SimpleUDPClient(FLAGS.server_ip, 5006)
   main(sys.argv)
   #run(main=main, argv=[sys.argv[0]] + unparsed)
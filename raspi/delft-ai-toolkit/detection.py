@@ -0,0 +1,143 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# finds objects and where they are in the picture with a single shot detector
+# such as MobileNet-SSD (an entry in models.json with "task": "detect").
+#
+# the network outputs up to a hundred or so candidate boxes as rows of
+#   [image, class, score, left, top, right, bottom]   (corners 0-1 of the picture)
+# the rows below the confidence threshold are dropped, then non-maximum
+# suppression keeps the best box of each group of boxes of the same class
+# that overlap by more than the nms threshold (intersection over union).
+# Both are done on whole numpy arrays rather than box by box.
+#
+# each object comes back as (label, score, (left, top, right, bottom)), and
+# the bridge sends them on /str/detect/ as
+#   <summary> <request id> <count> <label> <score> <left> <top> <right> <bottom> ... <timestamp>
+# where summary is "label: score\label: score..." like /str/recognize/.
+#
+#   python3 detection.py [--runs 50]
+# times the filtering and suppression on made up detections, and the whole
+# detector on a random picture when the mobilenet-ssd files are in models/.
+
+import time
+import logging
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+CONFIDENCE = 0.4
+NMS = 0.45
+
+def thresholds(spec):
+  # the detection thresholds from the model's models.json entry
+  return float(spec.extra.get("confidence", CONFIDENCE)), float(spec.extra.get("nms", NMS))
+
+def iou(box, boxes):
+  # intersection over union of one box with each row of boxes
+  left = np.maximum(box[0], boxes[:, 0])
+  top = np.maximum(box[1], boxes[:, 1])
+  right = np.minimum(box[2], boxes[:, 2])
+  bottom = np.minimum(box[3], boxes[:, 3])
+  inter = np.clip(right - left, 0, None) * np.clip(bottom - top, 0, None)
+  area = (box[2] - box[0]) * (box[3] - box[1])
+  areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+  return inter / np.maximum(area + areas - inter, 1e-9)
+
+def nms(boxes, scores, class_ids, threshold=NMS):
+  # indexes of the boxes to keep, best first. Boxes of different classes never
+  # suppress each other: each class is moved to its own patch of space first.
+  shifted = boxes + (class_ids.astype(boxes.dtype) * 2.0)[:, None]
+  order = np.argsort(scores)[::-1]
+  keep = []
+  while len(order) > 0:
+    best = order[0]
+    keep.append(best)
+    rest = order[1:]
+    order = rest[iou(shifted[best], shifted[rest]) <= threshold]
+  return np.array(keep, dtype=np.int64)
+
+def decode(output, labels, confidence=CONFIDENCE, threshold=NMS):
+  # [(label, score, (left, top, right, bottom))] from the raw SSD output
+  rows = output.reshape(-1, 7)
+  rows = rows[(rows[:, 2] >= confidence) & (rows[:, 1] > 0)] # class 0 is the background
+  if len(rows) == 0:
+    return []
+  boxes = np.clip(rows[:, 3:7], 0.0, 1.0)
+  valid = (boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])
+  rows, boxes = rows[valid], boxes[valid]
+  class_ids = rows[:, 1].astype(np.int64)
+  keep = nms(boxes, rows[:, 2], class_ids, threshold)
+  return [(labels[class_ids[i]] if class_ids[i] < len(labels) else str(class_ids[i]),
+    float(rows[i, 2]), tuple(float(v) for v in boxes[i])) for i in keep]
+
+def summary(detections):
+  # "label: score\label: score", the same shape as a classification result
+  return "\\".join("{}: {:.5F}".format(label, score) for label, score, box in detections)
+
+def osc_args(detections, request_id):
+  args = [summary(detections), request_id, len(detections)]
+  for label, score, box in detections:
+    args += [label, score] + list(box)
+  return args
+
+def synthetic(count, classes=20, seed=0):
+  # made up SSD output: clusters of jittered boxes around a few objects
+  rng = np.random.default_rng(seed)
+  centers = rng.uniform(0.2, 0.8, (max(1, count // 10), 2))
+  pick = rng.integers(0, len(centers), count)
+  size = rng.uniform(0.1, 0.3, (count, 2))
+  middle = centers[pick] + rng.normal(0, 0.02, (count, 2))
+  rows = np.zeros((count, 7), dtype=np.float32)
+  rows[:, 1] = 1 + pick % classes
+  rows[:, 2] = rng.uniform(0.0, 1.0, count)
+  rows[:, 3:5] = middle - size / 2
+  rows[:, 5:7] = middle + size / 2
+  return rows.reshape(1, 1, count, 7)
+
+if __name__ == '__main__':
+  import argparse
+  import model_registry
+  parser = argparse.ArgumentParser(description="time object detection")
+  parser.add_argument("--runs", type=int, default=50, help="timed runs of each step")
+  parser.add_argument("--model", default="mobilenet-ssd", help="detection model in models.json")
+  args = parser.parse_args()
+
+  labels = ["background"] + ["class{}".format(i) for i in range(1, 21)]
+  for count in (100, 1000):
+    output = synthetic(count)
+    times = []
+    for i in range(args.runs):
+      start = time.perf_counter()
+      found = decode(output, labels)
+      times.append(time.perf_counter() - start)
+    times.sort()
+    print("decode {:>5} boxes -> {:>3} objects  p50 {:.5f}s  p90 {:.5f}s".format(
+      count, len(found), times[len(times) // 2], times[int(len(times) * 0.9)]))
+
+  spec = model_registry.load_manifest().get(args.model)
+  if spec == None or not spec.available():
+    print("{} files not in models/, skipping the network".format(args.model))
+  else:
+    import cv2
+    net = model_registry.load_net(spec)
+    labels = model_registry.load_labels(spec)
+    confidence, threshold = thresholds(spec)
+    image = np.random.default_rng(0).integers(0, 255, (480, 640, 3)).astype(np.uint8)
+    stages = {"blob": [], "forward": [], "decode": []}
+    for i in range(args.runs + 1):
+      start = time.perf_counter()
+      blob = model_registry.blob(spec, image)
+      stages["blob"].append(time.perf_counter() - start)
+      start = time.perf_counter()
+      net.setInput(blob)
+      output = net.forward()
+      stages["forward"].append(time.perf_counter() - start)
+      start = time.perf_counter()
+      decode(output, labels, confidence, threshold)
+      stages["decode"].append(time.perf_counter() - start)
+    print("{} on {} cv2 threads, first forward {:.4f}s".format(args.model, cv2.getNumThreads(), stages["forward"][0]))
+    for name, times in stages.items():
+      times = sorted(times[1:])
+      print("  {:<8} p50 {:.5f}s  p90 {:.5f}s".format(name, times[len(times) // 2], times[int(len(times) * 0.9)]))
@@ -0,0 +1,171 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# sends everything the robot reports to whoever subscribed to it.
+#
+# Unity at --server_ip always gets everything. A dashboard, a logger or a second
+# Unity can subscribe to the addresses it wants with
+#   /subscribe/ <host> <port> <pattern> [max_rate] [ttl]
+#   /unsubscribe/ <host> <port> [pattern]
+# pattern is a shell style pattern like /num/analogin/* or /str/*, max_rate is
+# the most messages per second per address it wants (0 for all of them), and a
+# subscription runs out after ttl seconds (default 60) unless it is sent again.
+#
+# the bridge has one Fanout and one socket. Worker processes send through a
+# QueueClient, which hands the messages to the bridge to send on.
+
+import time
+import queue
+import socket
+import fnmatch
+import logging
+import threading
+from collections.abc import Iterable
+
+from pythonosc import osc_message_builder
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+DEFAULT_TTL = 60.0
+
+def build(address, value):
+  # the same message SimpleUDPClient.send_message would send
+  builder = osc_message_builder.OscMessageBuilder(address=address)
+  if value == None:
+    values = []
+  elif not isinstance(value, Iterable) or isinstance(value, (str, bytes)):
+    values = [value]
+  else:
+    values = value
+  for v in values:
+    builder.add_arg(v)
+  return builder.build()
+
+class Subscription(object):
+  def __init__(self, target, pattern, max_rate, ttl):
+    self.target = target # (host, port)
+    self.pattern = pattern
+    self.min_interval = 1.0 / max_rate if max_rate > 0 else 0.0
+    self.ttl = ttl # 0 for never
+    self.expires = time.monotonic() + ttl
+    self.last_sent = {} # address -> time.monotonic() of the last message sent
+    self.sent = 0
+    self.dropped = 0
+
+  def matches(self, address):
+    return fnmatch.fnmatchcase(address, self.pattern)
+
+  def due(self, address, now):
+    # rate limit per address, so a fast sensor does not crowd out the others
+    if self.min_interval > 0:
+      last = self.last_sent.get(address)
+      if last != None and now - last < self.min_interval:
+        self.dropped += 1
+        return False
+      self.last_sent[address] = now
+    self.sent += 1
+    return True
+
+class Target(object):
+  # sends straight to one host over the fanout's socket, e.g. clock sync pings to Unity
+  def __init__(self, fanout, target):
+    self.fanout = fanout
+    self.target = target
+
+  def send(self, message):
+    self.fanout.sock.sendto(message.dgram, self.target)
+
+  def send_message(self, address, value):
+    self.send(build(address, value))
+
+class Fanout(object):
+  def __init__(self):
+    self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.lock = threading.Lock()
+    self.subscriptions = []
+    self.next_sweep = 0.0
+    self.recorder = None # a recorder.Recorder that gets everything sent, whoever it goes to
+
+  def subscribe(self, host, port, pattern="*", max_rate=0, ttl=DEFAULT_TTL):
+    # subscribing again to the same pattern renews it with the new rate and ttl
+    target = (host, int(port))
+    subscription = Subscription(target, pattern, float(max_rate), float(ttl))
+    with self.lock:
+      self.subscriptions = [s for s in self.subscriptions if not (s.target == target and s.pattern == pattern)]
+      self.subscriptions.append(subscription)
+      metrics.gauge("fanout_subscriptions").set(len(self.subscriptions))
+    log.info("subscribed %s:%s to %s max_rate %s ttl %s", host, port, pattern, max_rate, ttl)
+    return subscription
+
+  def unsubscribe(self, host, port, pattern=None):
+    target = (host, int(port))
+    with self.lock:
+      self.subscriptions = [s for s in self.subscriptions
+        if not (s.target == target and (pattern == None or s.pattern == pattern))]
+      metrics.gauge("fanout_subscriptions").set(len(self.subscriptions))
+    log.info("unsubscribed %s:%s %s", host, port, pattern if pattern != None else "")
+
+  def target(self, host, port):
+    return Target(self, (host, int(port)))
+
+  def send(self, message):
+    self.send_dgram(message.address, message.dgram)
+
+  def send_message(self, address, value):
+    self.send_dgram(address, build(address, value).dgram)
+
+  def send_dgram(self, address, dgram):
+    if self.recorder != None:
+      self.recorder.record(b"o", dgram)
+    now = time.monotonic()
+    if now > self.next_sweep:
+      self.sweep(now)
+    with self.lock:
+      targets = set(s.target for s in self.subscriptions if s.matches(address) and s.due(address, now))
+    for target in targets:
+      try:
+        self.sock.sendto(dgram, target)
+      except OSError as e:
+        log.warning("can't send %s to %s: %s", address, target, e)
+    metrics.counter("fanout_messages_sent").inc(len(targets))
+
+  def sweep(self, now):
+    # drops subscriptions nobody renewed
+    with self.lock:
+      self.next_sweep = now + 1.0
+      expired = [s for s in self.subscriptions if s.ttl > 0 and now > s.expires]
+      if len(expired) == 0:
+        return
+      self.subscriptions = [s for s in self.subscriptions if s not in expired]
+      metrics.gauge("fanout_subscriptions").set(len(self.subscriptions))
+    for s in expired:
+      log.info("subscription %s:%s %s expired", s.target[0], s.target[1], s.pattern)
+
+  def summary(self):
+    with self.lock:
+      return ["{}:{} {} max_rate={:g} sent={} dropped={}{}".format(s.target[0], s.target[1], s.pattern,
+        1.0 / s.min_interval if s.min_interval > 0 else 0, s.sent, s.dropped,
+        " expires in {:.0f}s".format(s.expires - time.monotonic()) if s.ttl > 0 else "")
+        for s in self.subscriptions]
+
+  def forward(self, q):
+    # runs as a thread in the bridge, sends on what the worker processes put on q
+    while True:
+      address, dgram = q.get()
+      self.send_dgram(address, dgram)
+
+class QueueClient(object):
+  # stands in for a SimpleUDPClient in a worker process
+  def __init__(self, q):
+    self.q = q
+
+  def send(self, message):
+    try:
+      self.q.put_nowait((message.address, message.dgram))
+    except queue.Full:
+      pass
+
+  def send_message(self, address, value):
+    self.send(build(address, value))
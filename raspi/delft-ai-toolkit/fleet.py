@@ -0,0 +1,190 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# fleet mode, for one Unity host running many robots.
+#
+# every robot joins a multicast group and takes commands sent there, so Unity
+# sends each command once for the whole fleet:
+#   /move/ ...               every robot
+#   /robot/<id>/move/ ...    only robot <id>
+#   /group/<name>/move/ ...  only robots in group <name> (--fleet_groups)
+# commands in an OSC bundle all run at the bundle's timetag, so one datagram
+# starts a move on every robot at the same moment. Robots announce themselves
+# on the group every few seconds, and straight away when they get
+# /fleet/discover/, with
+#   /fleet/announce/ <id> <ip> <port> <groups>
+# several bridges can share one host, the group port is opened with SO_REUSEPORT.
+
+import time
+import heapq
+import socket
+import struct
+import logging
+import threading
+
+from pythonosc import osc_packet
+from pythonosc import osc_message_builder
+
+import metrics
+import toolkit_log
+
+log = logging.getLogger(__name__)
+
+ANNOUNCE = "/fleet/announce/"
+DISCOVER = "/fleet/discover/"
+
+def open_group(group, port, interface="0.0.0.0"):
+  # UDP socket that receives the multicast group, shared with other bridges on this host
+  sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+  sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+  if hasattr(socket, "SO_REUSEPORT"):
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+  sock.bind(("", port))
+  membership = struct.pack("4s4s", socket.inet_aton(group), socket.inet_aton(interface))
+  sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+  return sock
+
+def open_sender(interface="0.0.0.0", ttl=1):
+  sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+  sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+  sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1) # so bridges on the same host hear it
+  if interface != "0.0.0.0":
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+  return sock
+
+class Fleet(object):
+  def __init__(self, robot_id, groups, commands, group="239.255.0.42", port=5007,
+      ip="127.0.0.1", osc_port=5005, interface="0.0.0.0", announce_interval=2.0):
+    self.robot_id = robot_id
+    self.groups = list(groups)
+    self.commands = commands # address -> callback, as in the bridge's dispatcher
+    self.group = group
+    self.port = port
+    self.ip = ip # where this robot takes unicast commands
+    self.osc_port = osc_port
+    self.announce_interval = announce_interval
+    self.robot_prefix = "/robot/" + robot_id
+    self.group_prefixes = ["/group/" + name for name in self.groups]
+    self.sock = open_group(group, port, interface)
+    self.sender = open_sender(interface)
+    self.cond = threading.Condition()
+    self.due = [] # heap of (monotonic time, order, address, args)
+    self.order = 0
+    self.received = 0
+    self.ignored = 0
+
+  def start(self):
+    for target, name in ((self.receive, "fleet-receive"), (self.run_due, "fleet-due"), (self.announce_loop, "fleet-announce")):
+      threading.Thread(target=target, name=name, daemon=True).start()
+    log.info("fleet: %s in %s on %s:%s", self.robot_id, self.groups, self.group, self.port)
+
+  def accept(self, address):
+    # the command address this robot should run, or None if the message is for someone else
+    if address.startswith("/robot/"):
+      if address.startswith(self.robot_prefix + "/"):
+        return address[len(self.robot_prefix):]
+      return None
+    if address.startswith("/group/"):
+      for prefix in self.group_prefixes:
+        if address.startswith(prefix + "/"):
+          return address[len(prefix):]
+      return None
+    return address
+
+  def receive(self):
+    while True:
+      data, sender = self.sock.recvfrom(65536)
+      try:
+        packet = osc_packet.OscPacket(data)
+      except osc_packet.ParseError:
+        log.warning("fleet: bad packet from %s", sender, extra=toolkit_log.every(1.0))
+        continue
+      now_wall = time.time()
+      now = time.monotonic()
+      for timed in packet.messages:
+        address = self.accept(timed.message.address)
+        if address == ANNOUNCE:
+          continue # other robots, or our own
+        if address == DISCOVER:
+          self.announce()
+          continue
+        if address == None or address not in self.commands:
+          self.ignored += 1
+          continue
+        self.received += 1
+        # bundle timetags are wall clock times, run them on the monotonic clock
+        self.schedule(now + (timed.time - now_wall), address, timed.message.params)
+
+  def schedule(self, when, address, args):
+    with self.cond:
+      self.order += 1
+      heapq.heappush(self.due, (when, self.order, address, args))
+      self.cond.notify()
+
+  def run_due(self):
+    while True:
+      with self.cond:
+        while len(self.due) == 0:
+          self.cond.wait()
+        when = self.due[0][0]
+        delay = when - time.monotonic()
+        if delay > 0:
+          self.cond.wait(delay) # an earlier command may come in meanwhile
+          continue
+        when, order, address, args = heapq.heappop(self.due)
+      metrics.histogram("fleet_timetag_lateness_seconds").observe(time.monotonic() - when)
+      try:
+        self.commands[address](address, *args)
+      except Exception:
+        log.exception("fleet: %s failed", address)
+
+  def announce(self):
+    builder = osc_message_builder.OscMessageBuilder(address=ANNOUNCE)
+    builder.add_arg(self.robot_id)
+    builder.add_arg(self.ip)
+    builder.add_arg(self.osc_port)
+    builder.add_arg(",".join(self.groups))
+    self.sender.sendto(builder.build().dgram, (self.group, self.port))
+
+  def announce_loop(self):
+    while True:
+      self.announce()
+      time.sleep(self.announce_interval)
+
+def bundle(messages, at):
+  # one datagram that runs all messages at wall clock time at, e.g. time.time() + 0.1
+  from pythonosc import osc_bundle_builder
+  builder = osc_bundle_builder.OscBundleBuilder(at)
+  for address, args in messages:
+    message = osc_message_builder.OscMessageBuilder(address=address)
+    for arg in args:
+      message.add_arg(arg)
+    builder.add_content(message.build())
+  return builder.build().dgram
+
+if __name__ == '__main__':
+  # three robots on this host over loopback multicast, prints when each one ran a bundled command
+  import sys
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+  ran = {}
+  def make_command(robot_id):
+    def command(address, *args):
+      ran.setdefault(robot_id, []).append((time.monotonic(), address, args))
+    return command
+  robots = []
+  for i in range(count):
+    robot_id = "robot" + str(i + 1)
+    fleet = Fleet(robot_id, ["even" if i % 2 else "odd"], {"/move/": make_command(robot_id), "/leds/": make_command(robot_id)},
+      interface="127.0.0.1", announce_interval=60)
+    fleet.start()
+    robots.append(fleet)
+  sender = open_sender("127.0.0.1")
+  time.sleep(0.2)
+  sent = time.monotonic()
+  sender.sendto(bundle([("/move/", ["forward", 1.0, 0.5, "none"]),
+    ("/robot/robot2/leds/", ["blink", 0.1, 2, "0,0,127"]),
+    ("/group/odd/leds/", ["set", 0, -1, "127,0,0"])], time.time() + 0.2), ("239.255.0.42", 5007))
+  time.sleep(0.5)
+  for robot_id in sorted(ran):
+    for at, address, args in ran[robot_id]:
+      print("{} ran {} {} at +{:.4f}s".format(robot_id, address, args[0], at - sent))
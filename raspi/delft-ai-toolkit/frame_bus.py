@@ -0,0 +1,310 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# one camera, many readers: a capture process writes every frame into a ring
+# of slots in shared memory and any number of processes read the newest one
+# in place, without copying or pickling it.
+#
+# the shared memory holds a small header, a sequence number and capture time
+# per slot, then the slots themselves (height x width x 3 BGR bytes each).
+# Frame n goes in slot n % slots. While the writer fills a slot its sequence
+# is odd, when done it is 2n and the header's head becomes n (a seqlock), so
+# a reader can tell when a slot changed under it:
+#   bus = FrameBus.create(640, 480, bus_name(5005)) # in the bridge, before forking
+#   frame = bus.latest()                       # zero copy, read only view
+#   ...use frame.image...
+#   if frame.valid(): ...                      # not overwritten meanwhile
+#   image, captured = bus.read()               # a consistent copy
+# a view stays good for slots - 1 more frames, so readers slower than that
+# should read() a copy. Forked processes use the bus they inherited, other
+# programs FrameBus.attach(bus_name(<the bridge's OSC port>)). Each bridge on
+# a host has its own bus, named after its OSC port.
+#
+#   python3 frame_bus.py [--seconds 5] [--readers 3]
+# runs a synthetic camera and a few readers and reports what they received.
+
+import os
+import time
+import logging
+
+import numpy as np
+from multiprocessing import shared_memory
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+NAME = "delft_frames"
+MAGIC = 0x44465242 # "DFRB"
+HEADER = 8 # int64s: magic, width, height, channels, slots, head, pid of the creator
+POLL = 0.002 # seconds between looks at the head while waiting
+
+def bus_name(port):
+  # one bus per bridge, so bridges sharing a host don't take over each other's
+  return "{}_{}".format(NAME, port)
+
+def running(pid):
+  try:
+    os.kill(pid, 0)
+    return True
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    return True
+
+def untrack(shm):
+  # the bridge owns it, don't let this process's tracker remove it on exit
+  try:
+    from multiprocessing import resource_tracker
+    resource_tracker.unregister(shm._name, "shared_memory")
+  except Exception:
+    pass
+
+class Frame(object):
+  def __init__(self, bus, number, captured, image):
+    self.bus = bus
+    self.number = number # 1, 2, 3... frames since the bus was made
+    self.captured = captured # time.monotonic() when it was taken
+    self.image = image
+
+  def valid(self):
+    # False once the writer has started reusing this frame's slot
+    return self.bus.seqs[self.number % self.bus.slots] == self.number * 2
+
+class FrameBus(object):
+  def __init__(self, shm, owner):
+    self.shm = shm
+    self.owner = owner
+    header = np.ndarray((HEADER,), dtype=np.int64, buffer=shm.buf)
+    if header[0] != MAGIC:
+      raise ValueError("{} is not a frame bus".format(shm.name))
+    self.header = header
+    self.width, self.height, self.channels, self.slots = [int(v) for v in header[1:5]]
+    offset = HEADER * 8
+    self.seqs = np.ndarray((self.slots,), dtype=np.int64, buffer=shm.buf, offset=offset)
+    offset += self.slots * 8
+    self.times = np.ndarray((self.slots,), dtype=np.float64, buffer=shm.buf, offset=offset)
+    offset += self.slots * 8
+    self.images = np.ndarray((self.slots, self.height, self.width, self.channels), dtype=np.uint8,
+      buffer=shm.buf, offset=offset)
+    self.views = [self.images[i] for i in range(self.slots)]
+    self.readonly = []
+    for view in self.views:
+      view = view.view()
+      view.flags.writeable = False
+      self.readonly.append(view)
+
+  @classmethod
+  def create(cls, width, height, channels=3, slots=4, name=NAME):
+    size = HEADER * 8 + slots * 16 + slots * width * height * channels
+    try:
+      shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+    except FileExistsError:
+      stale = shared_memory.SharedMemory(name=name)
+      owner = 0
+      if stale.size >= HEADER * 8:
+        header = np.ndarray((HEADER,), dtype=np.int64, buffer=stale.buf)
+        owner = int(header[6]) if header[0] == MAGIC else 0
+        del header
+      if owner > 0 and owner != os.getpid() and running(owner):
+        stale.close()
+        untrack(stale)
+        raise FileExistsError("frame bus {} belongs to process {}, which is still running".format(name, owner))
+      # left behind by a bridge that was killed
+      stale.close()
+      stale.unlink()
+      shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+    header = np.ndarray((HEADER,), dtype=np.int64, buffer=shm.buf)
+    header[:] = [MAGIC, width, height, channels, slots, 0, os.getpid(), 0]
+    log.info("frame bus %s: %d slots of %dx%dx%d", name, slots, width, height, channels)
+    return cls(shm, True)
+
+  @classmethod
+  def attach(cls, name=NAME):
+    # for a separate program; forked processes just use the bus they inherited
+    shm = shared_memory.SharedMemory(name=name)
+    untrack(shm)
+    return cls(shm, False)
+
+  @property
+  def name(self):
+    return self.shm.name
+
+  def head(self):
+    # number of the newest complete frame, 0 before the first one
+    return int(self.header[5])
+
+  # writer
+
+  def begin(self):
+    # the slot for the next frame, to capture straight into
+    number = self.head() + 1
+    slot = number % self.slots
+    self.seqs[slot] = number * 2 + 1 # odd while being written
+    return self.views[slot]
+
+  def commit(self, captured=None):
+    number = self.head() + 1
+    slot = number % self.slots
+    self.times[slot] = time.monotonic() if captured == None else captured
+    self.seqs[slot] = number * 2
+    self.header[5] = number
+    metrics.counter("frame_bus_frames").inc()
+    return number
+
+  def publish(self, image, captured=None):
+    # copies an image that is already somewhere else into the next slot
+    np.copyto(self.begin(), image.reshape(self.height, self.width, self.channels))
+    return self.commit(captured)
+
+  # readers
+
+  def latest(self):
+    # the newest frame as a read only view into shared memory, None if there is none yet
+    while True:
+      number = self.head()
+      if number == 0:
+        return None
+      slot = number % self.slots
+      if self.seqs[slot] == number * 2:
+        frame = Frame(self, number, float(self.times[slot]), self.readonly[slot])
+        if frame.valid():
+          return frame
+      # the writer lapped us between reading the head and the slot
+
+  def read(self, out=None):
+    # a copy of the newest frame that is known not to be torn: (image, captured), (None, 0) if none yet
+    while True:
+      frame = self.latest()
+      if frame == None:
+        return None, 0.0
+      if out is None:
+        out = np.empty_like(frame.image)
+      np.copyto(out, frame.image)
+      if frame.valid():
+        return out, frame.captured
+      metrics.counter("frame_bus_torn_reads").inc()
+
+  def wait(self, after=0, timeout=None):
+    # the first frame newer than frame number after, None on timeout
+    deadline = None if timeout == None else time.monotonic() + timeout
+    while self.head() <= after:
+      if deadline != None and time.monotonic() > deadline:
+        return None
+      time.sleep(POLL)
+    return self.latest()
+
+  def close(self):
+    # views into the buffer have to go before it can be closed
+    self.header = self.seqs = self.times = self.images = None
+    self.views = self.readonly = []
+    self.shm.close()
+    if self.owner:
+      self.shm.unlink()
+
+class SyntheticSource(object):
+  # a test picture for running without a camera: coloured bars sliding across
+  # and a block stepping down with each frame
+  def __init__(self, width, height):
+    self.width = width
+    self.height = height
+    self.count = 0
+    x = np.arange(width)
+    self.bars = np.stack([(x * 3) % 256, (x * 5 + 85) % 256, (x * 7 + 170) % 256], axis=1).astype(np.uint8)
+
+  def capture(self, out):
+    shift = (self.count * 4) % self.width
+    out[:] = np.roll(self.bars, shift, axis=0)[None, :, :]
+    top = (self.count * 8) % max(1, self.height - 32)
+    out[top:top + 32, :32] = 255
+    self.count += 1
+
+  def close(self):
+    pass
+
+class PiCameraSource(object):
+  def __init__(self, width, height, fps):
+    import picamera
+    self.camera = picamera.PiCamera(resolution=(width, height), framerate=fps)
+    time.sleep(2) # let the exposure settle
+
+  def capture(self, out):
+    # the video port is fast enough for every frame, and writes straight into the slot
+    self.camera.capture(out, format="bgr", use_video_port=True)
+
+  def close(self):
+    self.camera.close()
+
+def open_source(kind, width, height, fps):
+  if kind == "synthetic":
+    return SyntheticSource(width, height)
+  return PiCameraSource(width, height, fps)
+
+def capture_loop(bus, source, fps, frames=0):
+  # fills the bus at fps (as fast as the source goes if 0), forever or for frames frames
+  interval = 1.0 / fps if fps > 0 else 0.0
+  next_time = time.monotonic()
+  count = 0
+  while frames <= 0 or count < frames:
+    captured = time.monotonic()
+    with metrics.histogram("camera_capture_seconds").time():
+      source.capture(bus.begin())
+    bus.commit(captured)
+    count += 1
+    if interval > 0:
+      next_time += interval
+      delay = next_time - time.monotonic()
+      if delay > 0:
+        time.sleep(delay)
+      else:
+        next_time = time.monotonic() # fell behind, don't try to catch up
+
+if __name__ == '__main__':
+  import argparse
+  import multiprocessing
+  parser = argparse.ArgumentParser(description="run a synthetic camera on a frame bus with a few readers")
+  parser.add_argument("--seconds", type=float, default=5.0)
+  parser.add_argument("--readers", type=int, default=3)
+  parser.add_argument("--fps", type=float, default=30.0)
+  parser.add_argument("--size", default="640x480")
+  args = parser.parse_args()
+  width, height = [int(v) for v in args.size.split("x")]
+  if args.fps <= 0:
+    parser.error("--fps has to be more than 0")
+
+  bus = FrameBus.create(width, height, name=NAME + "_demo")
+  frames = int(args.seconds * args.fps)
+
+  def reader(index, results):
+    # each reader works at its own pace: the first keeps up, the others are slower
+    work = 0.01 * index * index
+    seen = last = stale = 0
+    latency = []
+    while last < frames:
+      frame = bus.wait(last, timeout=1.0)
+      if frame == None:
+        break
+      latency.append(time.monotonic() - frame.captured)
+      frame.image[::8, ::8].sum() # touch the pixels
+      time.sleep(work)
+      if not frame.valid():
+        stale += 1
+      seen += 1
+      last = frame.number
+    latency.sort()
+    results.put((index, seen, stale, latency[len(latency) // 2] if latency else 0.0))
+
+  results = multiprocessing.Queue()
+  readers = [multiprocessing.Process(target=reader, args=(i, results)) for i in range(args.readers)]
+  for r in readers:
+    r.start()
+  start = time.monotonic()
+  capture_loop(bus, SyntheticSource(width, height), args.fps, frames)
+  took = time.monotonic() - start
+  for r in readers:
+    r.join()
+  print("wrote {} frames of {}x{} in {:.2f}s ({:.1f} fps)".format(frames, width, height, took, frames / took))
+  for index, seen, stale, latency in sorted(results.get() for r in readers):
+    print("reader {} (works {:.0f}ms a frame): got {} frames, {} overwritten while in use, median age {:.2f}ms".format(
+      index, 10 * index * index, seen, stale, latency * 1000))
+  bus.close()
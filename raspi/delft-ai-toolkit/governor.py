@@ -0,0 +1,243 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# slows the robot's optional work down before the Pi overheats and throttles
+# itself, which would slow everything, motors included, in ways nobody chose.
+#
+# every few seconds it reads the CPU temperature, the firmware's throttle
+# flags and the load from sysfs and procfs and picks a level:
+#   normal    nothing is held back
+#   warm      recognition at most every recognize_intervals[1] seconds
+#   hot       less often still, the lighter fallback model, sensors and LEDs slower
+#   critical  the least of everything
+# a level is entered when the temperature reaches its threshold (or the
+# firmware says it is throttling the CPU right now, or the load is high) and
+# left only once the temperature is a few degrees below it for a while, so it
+# does not flap. A low clock on its own means nothing, an idle Pi runs at a
+# fraction of its top speed. Motors and servos are never slowed down, everything else makes room
+# for them.
+#
+# the recognize process is forked from the bridge, so the limits it has to
+# keep to live in shared memory made at import, like clock_sync's offset.
+# Each change of level is reported on /str/governor/ with the readings and
+# what was changed.
+#
+#   python3 governor.py
+# runs it on a made up heat up and cool down.
+
+import os
+import time
+import shutil
+import subprocess
+import logging
+import threading
+import multiprocessing
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+LEVELS = ["normal", "warm", "hot", "critical"]
+
+# get_throttled bits for what is happening now: 0x4 throttled, 0x8 soft temperature limit
+THROTTLED_NOW = 0x4 | 0x8
+
+_recognize_interval = multiprocessing.Value('d', 0.0)
+_recognize_model = multiprocessing.Array('c', 64)
+
+def recognize_interval():
+  # least seconds between recognitions right now
+  return _recognize_interval.value
+
+def recognize_model():
+  # the model to use instead of the one asked for, "" for the one asked for
+  return _recognize_model.value.decode()
+
+class Reading(object):
+  def __init__(self, temperature=None, throttled=None, load=None):
+    self.temperature = temperature # degrees C
+    self.throttled = throttled # True while the firmware is throttling the CPU
+    self.load = load # 1 minute load average per core
+
+  def describe(self):
+    parts = []
+    if self.temperature != None:
+      parts.append("{:.1f}C".format(self.temperature))
+    if self.throttled:
+      parts.append("throttled")
+    if self.load != None:
+      parts.append("load {:.2f}".format(self.load))
+    return " ".join(parts) if parts else "no readings"
+
+def read_number(path):
+  try:
+    with open(path) as f:
+      return float(f.read().split()[0])
+  except (IOError, OSError, ValueError, IndexError):
+    return None
+
+def read_throttled(path):
+  # the firmware's throttle flags, from sysfs or vcgencmd, None on anything but a Pi
+  try:
+    with open(path) as f:
+      return int(f.read().strip(), 16)
+  except (IOError, OSError, ValueError):
+    pass
+  if shutil.which("vcgencmd") == None:
+    return None
+  try:
+    # throttled=0x50005
+    output = subprocess.check_output(["vcgencmd", "get_throttled"], timeout=2.0).decode()
+    return int(output.strip().split("=")[1], 16)
+  except (subprocess.SubprocessError, OSError, ValueError, IndexError):
+    return None
+
+class SysfsSource(object):
+  # the Pi's own sensors, anything the system does not have reads as None
+  def __init__(self, zone="/sys/class/thermal/thermal_zone0",
+               throttled="/sys/devices/platform/soc/soc:firmware/get_throttled"):
+    self.zone = zone
+    self.throttled = throttled
+    self.cores = os.cpu_count() or 1
+
+  def read(self):
+    temperature = read_number(os.path.join(self.zone, "temp"))
+    flags = read_throttled(self.throttled)
+    load = read_number("/proc/loadavg")
+    return Reading(temperature / 1000.0 if temperature != None else None,
+      bool(flags & THROTTLED_NOW) if flags != None else None,
+      load / self.cores if load != None else None)
+
+class FakeSource(object):
+  # plays back a list of temperatures, one per read, then stays at the last one
+  def __init__(self, temperatures, throttled=False, load=0.5):
+    self.temperatures = list(temperatures)
+    self.throttled = throttled
+    self.load = load
+    self.reads = 0
+
+  def read(self):
+    temperature = self.temperatures[min(self.reads, len(self.temperatures) - 1)]
+    self.reads += 1
+    return Reading(temperature, self.throttled, self.load)
+
+class Limits(object):
+  # what each level allows, index 0 is normal. A value of None leaves it as configured.
+  def __init__(self, fallback_model="squeezenet"):
+    self.recognize_intervals = [0.0, 1.0, 3.0, 8.0] # least seconds between recognitions
+    self.models = [None, None, fallback_model, fallback_model]
+    self.sensor_scales = [1.0, 1.0, 2.0, 4.0] # analog and touch intervals are multiplied by this
+    self.led_fps = [None, None, 15, 5]
+
+class Governor(object):
+  def __init__(self, source, apply, reply, interval=2.0, thresholds=(70.0, 77.0, 82.0),
+               limits=None, hysteresis=3.0, hold=10.0, high_load=1.5):
+    self.source = source
+    self.apply = apply # apply(limit name, value) changes a rate in the bridge
+    self.reply = reply # called with a line for /str/governor/
+    self.interval = interval
+    self.thresholds = list(thresholds) # warm, hot, critical in degrees C
+    self.limits = limits if limits != None else Limits()
+    self.hysteresis = hysteresis
+    self.hold = hold # seconds below a level before dropping out of it
+    self.high_load = high_load
+    self.level = 0
+    self.cool_since = None
+    self.reading = Reading()
+    self.reason = ""
+
+  def start(self):
+    thread = threading.Thread(target=self.run, name="governor", daemon=True)
+    thread.start()
+    return thread
+
+  def run(self):
+    while True:
+      self.step()
+      time.sleep(self.interval)
+
+  def wanted(self, reading):
+    # the level the readings call for on their own, and why
+    level, reason = 0, ""
+    if reading.temperature != None:
+      for i, threshold in enumerate(self.thresholds):
+        if reading.temperature >= threshold:
+          level, reason = i + 1, "temperature"
+    if reading.throttled and level < 2:
+      level, reason = 2, "throttled"
+    if reading.load != None and reading.load > self.high_load and level < 1:
+      level, reason = 1, "load"
+    return level, reason
+
+  def step(self, now=None):
+    now = time.monotonic() if now == None else now
+    reading = self.source.read()
+    self.reading = reading
+    self.gauges(reading)
+    level, reason = self.wanted(reading)
+    if level > self.level:
+      self.cool_since = None
+      self.change(level, reason)
+    elif level < self.level:
+      # only come down once it has been cool enough for a while
+      threshold = self.thresholds[self.level - 1]
+      cool = reading.temperature == None or reading.temperature < threshold - self.hysteresis
+      if cool:
+        if self.cool_since == None:
+          self.cool_since = now
+        elif now - self.cool_since >= self.hold:
+          self.cool_since = None
+          self.change(level, reason or "cooled down")
+      else:
+        self.cool_since = None
+    else:
+      self.cool_since = None
+    return self.level
+
+  def change(self, level, reason):
+    old = self.level
+    self.level = level
+    self.reason = reason
+    limits = self.limits
+    _recognize_interval.value = limits.recognize_intervals[level]
+    model = limits.models[level] or ""
+    with _recognize_model.get_lock():
+      _recognize_model.value = model.encode()[:63]
+    self.apply("sensor_scale", limits.sensor_scales[level])
+    self.apply("led_fps", limits.led_fps[level])
+    metrics.gauge("governor_level").set(level)
+    metrics.counter("governor_changes").inc()
+    line = "{} -> {} ({}: {}) {}".format(LEVELS[old], LEVELS[level], reason, self.reading.describe(), self.describe())
+    log.info("governor %s", line)
+    self.reply(line)
+
+  def describe(self):
+    limits = self.limits
+    level = self.level
+    return "recognize every {:g}s, model {}, sensors x{:g}, leds {}".format(
+      limits.recognize_intervals[level], limits.models[level] or "as asked",
+      limits.sensor_scales[level], "{}fps".format(limits.led_fps[level]) if limits.led_fps[level] else "as set")
+
+  def status(self):
+    return "{} ({}) {}, {}".format(LEVELS[self.level], self.reason or "-", self.reading.describe(), self.describe())
+
+  def gauges(self, reading):
+    if reading.temperature != None:
+      metrics.gauge("cpu_temperature_celsius").set(reading.temperature)
+    if reading.throttled != None:
+      metrics.gauge("cpu_throttled").set(1 if reading.throttled else 0)
+    if reading.load != None:
+      metrics.gauge("cpu_load_per_core").set(reading.load)
+
+if __name__ == '__main__':
+  # heats up past every threshold, then cools down again, one reading every "2 seconds"
+  temperatures = [55, 62, 69, 71, 74, 78, 80, 83, 84, 81, 79, 78, 76, 73, 72, 70, 68, 66, 64, 60, 58, 55, 55, 55, 55]
+  applied = {}
+  def apply(name, value):
+    applied[name] = value
+  governor = Governor(FakeSource(temperatures), apply, lambda line: print("  /str/governor/", line), hold=4.0)
+  print("real sensors here:", SysfsSource().read().describe())
+  for i, temperature in enumerate(temperatures):
+    level = governor.step(now=i * 2.0)
+    print("{:>4.0f}s {:>3}C {:<8} recognize every {:g}s model {!r} {}".format(i * 2.0, temperature, LEVELS[level],
+      recognize_interval(), recognize_model(), applied))
@@ -0,0 +1,164 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# LED animations for the CRICKIT NeoPixels.
+#
+# the colors live in a numpy framebuffer, one RGBW row per pixel in the order
+# the strip expects. "set" and "allOff" change the framebuffer, an effect draws
+# over it until it finishes:
+#   blink - all pixels on and off, times blinks of delay seconds each
+#   fade  - from the current colors to color over delay seconds
+#   chase - one lit pixel running round the ring, times laps, delay per pixel
+#   pulse - all pixels breathing, times pulses of delay seconds, 0 for endless
+# a thread draws frames at up to fps frames a second, and only sends a frame to
+# the seesaw when it differs from the last one sent. When nothing is animating
+# the thread sleeps.
+
+import time
+import logging
+import threading
+
+import numpy as np
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+EFFECTS = ["blink", "fade", "chase", "pulse"]
+
+class Effect(object):
+  def __init__(self, kind, color, delay, times, start, base):
+    self.kind = kind
+    self.color = np.array(color, dtype=float)
+    self.delay = max(float(delay), 0.01)
+    self.times = int(times)
+    self.start = start
+    self.base = base.astype(float) # the colors when the effect started
+
+  def render(self, now, frame):
+    # fills frame for time now, returns False once the effect is over
+    elapsed = now - self.start
+    if self.kind == "blink":
+      step = int(elapsed / self.delay)
+      if step >= self.times * 2:
+        return False
+      frame[:] = self.color if step % 2 == 0 else 0
+    elif self.kind == "fade":
+      share = min(elapsed / self.delay, 1.0)
+      frame[:] = np.rint(self.base + (self.color - self.base) * share)
+      return share < 1.0
+    elif self.kind == "chase":
+      step = int(elapsed / self.delay)
+      if self.times > 0 and step >= self.times * len(frame):
+        return False
+      frame[:] = 0
+      frame[step % len(frame)] = self.color
+    elif self.kind == "pulse":
+      cycles = elapsed / self.delay
+      if self.times > 0 and cycles >= self.times:
+        return False
+      frame[:] = np.rint(self.color * (0.5 - 0.5 * np.cos(2 * np.pi * cycles)))
+    return True
+
+  def finish(self, framebuffer):
+    # what the pixels show after the effect
+    if self.kind == "fade":
+      framebuffer[:] = self.color
+    else:
+      framebuffer[:] = 0
+
+class LedEngine(object):
+  def __init__(self, pixels, num_pixels, fps=30, bus=None):
+    self.pixels = pixels # a seesaw NeoPixel, made with auto_write=False
+    self.bus = bus if bus != None else threading.Lock() # held for each frame, shared with the rest of the I2C bus
+    self.period = 1.0 / fps
+    self.cond = threading.Condition()
+    self.framebuffer = np.zeros((num_pixels, 4), dtype=np.uint8)
+    self.shown = None # last frame sent to the pixels
+    self.effect = None
+    self.dirty = False # nothing is drawn until the first command
+    self.frames = 0
+    self.skipped = 0
+    self.thread = threading.Thread(target=self.run, name="leds", daemon=True)
+    self.thread.start()
+
+  def set(self, color, lednum=-1):
+    # -1 sets every pixel, also stops any effect
+    with self.cond:
+      self.effect = None
+      if lednum == -1:
+        self.framebuffer[:] = color
+      else:
+        self.framebuffer[lednum] = color
+      self.dirty = True
+      self.cond.notify()
+
+  def set_fps(self, fps):
+    # the governor slows effects down when the Pi runs hot
+    self.period = 1.0 / fps
+
+  def off(self):
+    self.set((0, 0, 0, 0))
+
+  def animate(self, kind, color, delay, times=0):
+    with self.cond:
+      self.effect = Effect(kind, color, delay, times, time.monotonic(), self.framebuffer)
+      self.dirty = True
+      self.cond.notify()
+
+  def run(self):
+    frame = np.zeros_like(self.framebuffer)
+    next_frame = time.monotonic()
+    while True:
+      with self.cond:
+        while self.effect == None and not self.dirty:
+          self.cond.wait()
+        now = time.monotonic()
+        frame[:] = self.framebuffer
+        effect = self.effect
+        if effect != None and not effect.render(now, frame):
+          effect.finish(self.framebuffer)
+          frame[:] = self.framebuffer
+          self.effect = None
+        self.dirty = False
+      self.flush(frame)
+      next_frame += self.period
+      delay = next_frame - time.monotonic()
+      if delay > 0:
+        time.sleep(delay) # caps the frame rate, commands that come in meanwhile show next frame
+      else:
+        next_frame = time.monotonic()
+
+  def flush(self, frame):
+    # one transfer for a single color, otherwise only the pixels that changed, then one show()
+    if self.shown is not None and np.array_equal(frame, self.shown):
+      self.skipped += 1
+      metrics.counter("led_frames_skipped").inc()
+      return
+    with self.bus, metrics.histogram("i2c_write_seconds", device="neopixel").time():
+      if (frame == frame[0]).all():
+        self.pixels.fill(tuple(int(c) for c in frame[0]))
+      else:
+        if self.shown is None:
+          changed = range(len(frame))
+        else:
+          changed = np.flatnonzero((frame != self.shown).any(axis=1))
+        for i in changed:
+          self.pixels[int(i)] = tuple(int(c) for c in frame[i])
+      self.pixels.show()
+    self.shown = frame.copy()
+    self.frames += 1
+    metrics.counter("led_frames").inc()
+
+if __name__ == '__main__':
+  # runs each effect on simulated pixels and prints how many frames and transfers it took
+  from sim_crickit import SimPixels
+  pixels = SimPixels(16)
+  engine = LedEngine(pixels, 16)
+  for kind, delay, times in (("blink", 0.1, 3), ("fade", 0.5, 0), ("chase", 0.02, 1), ("pulse", 0.5, 1)):
+    pixels.clear()
+    frames, skipped = engine.frames, engine.skipped
+    engine.animate(kind, (0, 127, 0, 0), delay, times)
+    time.sleep(0.7)
+    print("{:<6} frames={:<3} skipped={:<3} transfers={:<4} shows={}".format(
+      kind, engine.frames - frames, engine.skipped - skipped, pixels.transfers, pixels.shows))
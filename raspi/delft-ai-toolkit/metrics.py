@@ -0,0 +1,245 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# lightweight latency and throughput metrics.
+#
+# every process records into its own module level registry, e.g.
+#   metrics.histogram("inference_seconds", model="squeezenet").observe(took)
+#   with metrics.histogram("i2c_write_seconds", device="motors").time(): ...
+# worker processes send a snapshot of their registry to the bridge every
+# second over a multiprocessing queue (start_reporter), the bridge keeps the
+# latest snapshot per process (Aggregator) and publishes them on OSC and as
+# Prometheus text over HTTP (serve_http).
+
+import time
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# seconds, suits everything from an OSC callback to a Watson round trip
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Counter(object):
+  kind = "counter"
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.value = 0.0
+
+  def inc(self, amount=1):
+    with self.lock:
+      self.value += amount
+
+  def sample(self):
+    return self.value
+
+class Gauge(object):
+  kind = "gauge"
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.value = 0.0
+
+  def set(self, value):
+    self.value = value
+
+  def inc(self, amount=1):
+    with self.lock:
+      self.value += amount
+
+  def dec(self, amount=1):
+    self.inc(-amount)
+
+  def sample(self):
+    return self.value
+
+class Histogram(object):
+  # fixed buckets, counts[i] is the number of observations <= buckets[i],
+  # the last count is for everything above the largest bucket
+  kind = "histogram"
+
+  def __init__(self, buckets=DEFAULT_BUCKETS):
+    self.lock = threading.Lock()
+    self.buckets = tuple(buckets)
+    self.counts = [0] * (len(self.buckets) + 1)
+    self.sum = 0.0
+    self.count = 0
+
+  def observe(self, value):
+    i = bisect.bisect_left(self.buckets, value)
+    with self.lock:
+      self.counts[i] += 1
+      self.sum += value
+      self.count += 1
+
+  def time(self):
+    return _Timer(self)
+
+  def sample(self):
+    with self.lock:
+      return (self.buckets, list(self.counts), self.sum, self.count)
+
+class _Timer(object):
+  def __init__(self, histogram):
+    self.histogram = histogram
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    self.histogram.observe(time.perf_counter() - self.start)
+    return False
+
+class Registry(object):
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.metrics = {} # (name, labels) -> metric
+
+  def get(self, cls, name, labels, *args):
+    key = (name, tuple(sorted(labels.items())))
+    metric = self.metrics.get(key)
+    if metric == None:
+      with self.lock:
+        metric = self.metrics.get(key)
+        if metric == None:
+          metric = cls(*args)
+          self.metrics[key] = metric
+    return metric
+
+  def reset(self):
+    with self.lock:
+      self.metrics = {}
+
+  def snapshot(self):
+    # plain tuples so the snapshot can be pickled to the bridge
+    with self.lock:
+      items = list(self.metrics.items())
+    return [(metric.kind, name, labels, metric.sample()) for (name, labels), metric in items]
+
+registry = Registry()
+
+def counter(name, **labels):
+  return registry.get(Counter, name, labels)
+
+def gauge(name, **labels):
+  return registry.get(Gauge, name, labels)
+
+def histogram(name, buckets=DEFAULT_BUCKETS, **labels):
+  return registry.get(Histogram, name, labels, buckets)
+
+def start_reporter(q, process, interval=1.0):
+  # runs in each worker process, sends the registry to the bridge every interval
+  registry.reset() # drop anything inherited from the bridge by fork()
+  def report():
+    while True:
+      time.sleep(interval)
+      q.put((process, registry.snapshot()))
+  thread = threading.Thread(target=report, daemon=True)
+  thread.start()
+  return thread
+
+class Aggregator(object):
+  # lives in the bridge and keeps the newest snapshot from every process
+  def __init__(self, q, process="bridge"):
+    self.q = q
+    self.process = process
+    self.lock = threading.Lock()
+    self.latest = {}
+    self.collect_hooks = [] # called before each local snapshot, e.g. to update gauges
+    thread = threading.Thread(target=self.receive, daemon=True)
+    thread.start()
+
+  def receive(self):
+    while True:
+      process, snapshot = self.q.get()
+      with self.lock:
+        self.latest[process] = snapshot
+
+  def snapshots(self):
+    for hook in self.collect_hooks:
+      hook()
+    with self.lock:
+      snapshots = dict(self.latest)
+    snapshots[self.process] = registry.snapshot()
+    return snapshots
+
+def _labels(process, labels, extra=()):
+  items = (("process", process),) + tuple(labels) + tuple(extra)
+  return "{" + ",".join('{}="{}"'.format(k, str(v).replace('"', "'")) for k, v in items) + "}"
+
+def prometheus_text(snapshots):
+  # Prometheus text exposition format, one TYPE line per metric name
+  by_name = {}
+  for process, snapshot in snapshots.items():
+    for kind, name, labels, value in snapshot:
+      by_name.setdefault(name, (kind, []))[1].append((process, labels, value))
+  lines = []
+  for name in sorted(by_name):
+    kind, samples = by_name[name]
+    lines.append("# TYPE {} {}".format(name, kind))
+    for process, labels, value in samples:
+      if kind == "histogram":
+        buckets, counts, total, count = value
+        cumulative = 0
+        for bound, n in zip(buckets, counts):
+          cumulative += n
+          lines.append("{}_bucket{} {}".format(name, _labels(process, labels, (("le", bound),)), cumulative))
+        lines.append("{}_bucket{} {}".format(name, _labels(process, labels, (("le", "+Inf"),)), count))
+        lines.append("{}_sum{} {}".format(name, _labels(process, labels), total))
+        lines.append("{}_count{} {}".format(name, _labels(process, labels), count))
+      else:
+        lines.append("{}{} {}".format(name, _labels(process, labels), value))
+  return "\n".join(lines) + "\n"
+
+def quantile(value, q):
+  # estimate a quantile from histogram buckets, returns the bucket's upper bound
+  buckets, counts, total, count = value
+  if count == 0:
+    return 0.0
+  rank = q * count
+  cumulative = 0
+  for bound, n in zip(buckets, counts):
+    cumulative += n
+    if cumulative >= rank:
+      return bound
+  return float("inf")
+
+def summary_lines(process, snapshot):
+  # compact text for OSC, histograms as count, mean, p50 and p90
+  lines = []
+  for kind, name, labels, value in sorted(snapshot, key=lambda m: (m[1], m[2])):
+    label = ",".join("{}={}".format(k, v) for k, v in labels)
+    if label != "":
+      name = name + "{" + label + "}"
+    if kind == "histogram":
+      buckets, counts, total, count = value
+      mean = total / count if count > 0 else 0.0
+      lines.append("{} n={} avg={:.4f} p50<={} p90<={}".format(
+        name, count, mean, quantile(value, 0.5), quantile(value, 0.9)))
+    else:
+      lines.append("{}={:g}".format(name, value))
+  return [process + " " + line for line in lines]
+
+def serve_http(aggregator, port, host=""):
+  # Prometheus scrape endpoint at http://<robot>:<port>/metrics
+  class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+      if self.path not in ("/", "/metrics"):
+        self.send_error(404)
+        return
+      body = prometheus_text(aggregator.snapshots()).encode()
+      self.send_response(200)
+      self.send_header("Content-Type", "text/plain; version=0.0.4")
+      self.send_header("Content-Length", str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def log_message(self, format, *args):
+      pass # no line per scrape
+
+  server = ThreadingHTTPServer((host, port), Handler)
+  server.daemon_threads = True
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+  return server
@@ -0,0 +1,148 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# the recognition models the toolkit knows about, described in models.json.
+#
+# each entry names the files and how to prepare a picture for the model:
+#   framework   caffe, onnx, tflite, tensorflow, darknet... anything cv2.dnn.readNet loads
+#   model       weights file, config: the separate network file some frameworks need
+#   labels      one class per line, "synset" files have an id before the name
+#   input_size  [width, height], mean: per channel values subtracted, scale: multiplied after
+#   swap_rb     true for models trained on RGB, crop: center crop instead of squashing
+#   softmax     true when the model outputs raw scores rather than probabilities
+#   task        classify (default) or detect
+# so a new model, e.g. a quantized MobileNet or EfficientNet-lite, is added by
+# putting its files in models/ and an entry in models.json. TFLite needs
+# OpenCV 4.8 or newer.
+#
+#   python3 model_registry.py list
+#   python3 model_registry.py benchmark [model ...] [--runs 20]
+# reports load time, memory and inference time for each model found on disk.
+
+import os
+import sys
+import json
+import time
+import logging
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+MANIFEST = "models.json"
+
+class ModelSpec(object):
+  def __init__(self, name, entry):
+    self.name = name
+    self.framework = entry.get("framework", "")
+    self.model = entry["model"]
+    self.config = entry.get("config", "")
+    self.labels = entry.get("labels", "")
+    self.labels_format = entry.get("labels_format", "synset" if "synset" in self.labels else "plain")
+    self.input_size = tuple(entry.get("input_size", (224, 224)))
+    self.mean = tuple(entry.get("mean", (0, 0, 0)))
+    self.scale = float(entry.get("scale", 1.0))
+    self.swap_rb = bool(entry.get("swap_rb", False))
+    self.crop = bool(entry.get("crop", False))
+    self.softmax = bool(entry.get("softmax", False))
+    self.task = entry.get("task", "classify")
+    self.extra = entry # anything else a task needs, e.g. a detection threshold
+
+  def files(self):
+    return [f for f in (self.model, self.config, self.labels) if f != ""]
+
+  def available(self):
+    return all(os.path.exists(f) for f in self.files())
+
+def load_manifest(path=MANIFEST):
+  with open(path) as f:
+    entries = json.load(f)
+  return dict((name, ModelSpec(name, entry)) for name, entry in entries.items())
+
+def load_net(spec):
+  import cv2
+  return cv2.dnn.readNet(spec.model, spec.config, spec.framework)
+
+def load_labels(spec):
+  rows = open(spec.labels).read().strip().split("\n")
+  if spec.labels_format == "synset":
+    # "n01440764 tench, Tinca tinca", only keep the first name
+    return [r[r.find(" ") + 1:].split(",")[0] for r in rows]
+  return [r.strip() for r in rows]
+
+def blob(spec, image):
+  import cv2
+  return cv2.dnn.blobFromImage(image, spec.scale, spec.input_size, spec.mean, spec.swap_rb, spec.crop)
+
+def probabilities(spec, preds):
+  preds = preds.reshape(-1)
+  if spec.softmax:
+    e = np.exp(preds - preds.max())
+    preds = e / e.sum()
+  return preds
+
+def rss_bytes():
+  # resident memory of this process, Linux only
+  try:
+    with open("/proc/self/status") as f:
+      for line in f:
+        if line.startswith("VmRSS:"):
+          return int(line.split()[1]) * 1024
+  except IOError:
+    pass
+  return 0
+
+def benchmark(specs, runs=20):
+  # loads each model and times runs forward passes on a random picture
+  import cv2
+  lines = ["{:<20} {:>8} {:>9} {:>9} {:>9} {:>9}".format("model", "load s", "mem MB", "first s", "p50 s", "p90 s")]
+  image = np.random.default_rng(0).integers(0, 255, (480, 640, 3)).astype(np.uint8)
+  for spec in specs:
+    if not spec.available():
+      lines.append("{:<20} missing {}".format(spec.name, " ".join(f for f in spec.files() if not os.path.exists(f))))
+      continue
+    before = rss_bytes()
+    start = time.perf_counter()
+    try:
+      net = load_net(spec)
+    except cv2.error as e:
+      lines.append("{:<20} can't load: {}".format(spec.name, str(e).strip().split("\n")[-1]))
+      continue
+    load = time.perf_counter() - start
+    input_blob = blob(spec, image)
+    times = []
+    for i in range(runs + 1):
+      start = time.perf_counter()
+      net.setInput(input_blob)
+      net.forward()
+      times.append(time.perf_counter() - start)
+    memory = (rss_bytes() - before) / 1e6
+    first, rest = times[0], sorted(times[1:])
+    lines.append("{:<20} {:>8.3f} {:>9.1f} {:>9.4f} {:>9.4f} {:>9.4f}".format(
+      spec.name, load, memory, first, rest[len(rest) // 2], rest[int(len(rest) * 0.9)]))
+    del net
+  return lines
+
+if __name__ == '__main__':
+  import argparse
+  parser = argparse.ArgumentParser(description="list or benchmark the models in " + MANIFEST)
+  parser.add_argument("command", choices=["list", "benchmark"])
+  parser.add_argument("models", nargs="*", help="model names, all of them if left out")
+  parser.add_argument("--runs", type=int, default=20, help="timed forward passes per model")
+  parser.add_argument("--threads", type=int, default=0, help="cv2 threads, 0 leaves the OpenCV default")
+  args = parser.parse_args()
+  registry = load_manifest()
+  names = args.models if len(args.models) > 0 else list(registry)
+  unknown = [n for n in names if n not in registry]
+  if len(unknown) > 0:
+    sys.exit("unknown model: " + " ".join(unknown))
+  if args.command == "list":
+    for name in names:
+      spec = registry[name]
+      print("{:<20} {:<8} {:<8} {}x{} {}".format(name, spec.framework, spec.task, spec.input_size[0],
+        spec.input_size[1], "ready" if spec.available() else "files missing"))
+  else:
+    if args.threads > 0:
+      import cv2
+      cv2.setNumThreads(args.threads)
+    print("\n".join(benchmark([registry[n] for n in names], args.runs)))
@@ -0,0 +1,153 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# timed and eased DC motor moves for the CRICKIT.
+#
+# a thread runs the motors at a fixed control rate. A move has a target throttle
+# per motor, a duration and one of the easings, and the throttle follows a
+# precomputed envelope over the move:
+#   none      - full throttle for the whole move
+#   easeIn    - ramps up at the start
+#   easeOut   - ramps down towards the end
+#   easeInOut - both
+# every move stops on its deadline, whatever the direction. A move without a
+# time only stops on a "stop" or after the safety timeout. The thread wakes up
+# exactly at the deadline rather than on the next tick, and how late the stop
+# was is recorded in the motion_stop_error_seconds metric.
+
+import time
+import logging
+import threading
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+EASINGS = ["none", "easeIn", "easeOut", "easeInOut"]
+CURVE_POINTS = 256
+RAMP_FRACTION = 0.3 # share of a move spent ramping at each eased end
+MAX_RAMP = 1.0 # seconds, so long moves do not crawl
+
+def smoothstep(x):
+  return x * x * (3 - 2 * x)
+
+# throttle over a ramp, sampled once at import so a tick is only a table lookup
+RAMP = [smoothstep(i / (CURVE_POINTS - 1)) for i in range(CURVE_POINTS)]
+
+def envelope(easing, elapsed, duration, ramp_time):
+  # 0..1 multiplier for the target throttle, elapsed seconds into the move
+  if easing == "none" or ramp_time <= 0:
+    return 1.0
+  level = 1.0
+  if easing in ("easeIn", "easeInOut") and elapsed < ramp_time:
+    level = min(level, RAMP[int(elapsed / ramp_time * (CURVE_POINTS - 1))])
+  remaining = duration - elapsed
+  if easing in ("easeOut", "easeInOut") and remaining < ramp_time:
+    level = min(level, RAMP[int(max(remaining, 0) / ramp_time * (CURVE_POINTS - 1))])
+  return level
+
+class Move(object):
+  def __init__(self, targets, duration, easing, start, timed):
+    self.targets = targets
+    self.duration = duration
+    self.easing = easing if easing in EASINGS else "none"
+    self.start = start
+    self.deadline = start + duration
+    self.timed = timed # False when only the safety timeout ends it
+    self.ramp_time = min(duration * RAMP_FRACTION, MAX_RAMP)
+
+class MotionEngine(object):
+  def __init__(self, motors, rate=100, safety_timeout=10.0, bus=None):
+    self.motors = motors # anything with a .throttle, e.g. crickit.dc_motor_1
+    self.bus = bus if bus != None else threading.Lock() # held for each write, shared with the rest of the I2C bus
+    self.period = 1.0 / rate
+    self.safety_timeout = safety_timeout
+    self.cond = threading.Condition()
+    self.move = None
+    self.written = [None] * len(motors) # last throttle sent to each motor
+    self.last_error = 0.0
+    self.thread = threading.Thread(target=self.run, name="motion", daemon=True)
+    self.thread.start()
+
+  def start_move(self, targets, duration=0, easing="none"):
+    # targets is a throttle (-1..1) for each motor, duration in seconds, 0 for no time limit
+    targets = [max(-1.0, min(float(t), 1.0)) for t in targets]
+    timed = duration > 0
+    if not timed:
+      duration = self.safety_timeout
+    with self.cond:
+      self.move = Move(targets, duration, easing, time.monotonic(), timed)
+      self.cond.notify()
+
+  def stop(self):
+    with self.cond:
+      self.move = Move([0.0] * len(self.motors), 0, "none", time.monotonic(), True)
+      self.cond.notify()
+
+  def run(self):
+    next_tick = time.monotonic()
+    while True:
+      with self.cond:
+        move = self.move
+        now = time.monotonic()
+        if move == None:
+          self.cond.wait() # idle, nothing to do until a move comes in
+          next_tick = time.monotonic()
+          continue
+        wake = min(next_tick, move.deadline)
+        if wake > now:
+          self.cond.wait(wake - now)
+          if self.move is not move:
+            next_tick = time.monotonic() # a new move, start it straight away
+            continue
+          now = time.monotonic()
+          if now < wake:
+            continue
+      if now >= move.deadline:
+        self.write([0.0] * len(self.motors))
+        self.finish(move, now)
+        continue
+      metrics.histogram("motion_tick_lateness_seconds").observe(now - next_tick)
+      level = envelope(move.easing, now - move.start, move.duration, move.ramp_time)
+      self.write([target * level for target in move.targets])
+      next_tick += self.period
+      if next_tick < now:
+        next_tick = now + self.period # fell behind, skip the missed ticks
+
+  def finish(self, move, now):
+    with self.cond:
+      if self.move is move:
+        self.move = None
+    if move.duration == 0:
+      return # a stop
+    error = now - move.deadline
+    self.last_error = error
+    metrics.histogram("motion_stop_error_seconds").observe(error)
+    if move.timed:
+      log.debug("move done %.3fs %s, stopped %.2fms after the deadline", move.duration, move.easing, error * 1000)
+    else:
+      log.warning("TIMEOUT -- STOPPING MOTORS")
+
+  def write(self, throttles):
+    # only changed values go out over I2C
+    with self.bus, metrics.histogram("i2c_write_seconds", device="motors").time():
+      for i, throttle in enumerate(throttles):
+        if throttle != self.written[i]:
+          self.motors[i].throttle = throttle
+          self.written[i] = throttle
+
+if __name__ == '__main__':
+  # runs some moves on simulated motors and prints how close each stop was to its deadline
+  from sim_crickit import SimMotor
+  motors = [SimMotor("left"), SimMotor("right")]
+  engine = MotionEngine(motors)
+  for easing in EASINGS:
+    for speed in (0.8, -0.8):
+      for m in motors:
+        m.clear()
+      start = time.monotonic()
+      engine.start_move([speed, -speed], 0.5, easing)
+      time.sleep(0.6)
+      stops = [m.stopped_at() for m in motors]
+      errors = ["{:.2f}ms".format((s - start - 0.5) * 1000) if s != None else "not stopped" for s in stops]
+      print("{:<10} {:>5} writes={:<3} stop error {}".format(easing, speed, len(motors[0].writes), " ".join(errors)))
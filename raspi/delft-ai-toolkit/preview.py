@@ -0,0 +1,248 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# shows what the robot's camera sees in a browser or in Unity, as MJPEG over HTTP:
+#   http://<robot>:<port>/          a page with the stream
+#   http://<robot>:<port>/stream    multipart/x-mixed-replace JPEGs
+#   http://<robot>:<port>/snapshot  one JPEG
+# it runs in a process of its own at a lower priority, reading the newest
+# frame from the frame bus. Frames are only shrunk and encoded while someone
+# is watching, at most fps a second and max_width pixels wide, and a viewer
+# that can't keep up gets the newest frame when it is ready rather than a
+# queue of old ones. The last recognition or detection result can be drawn on
+# top, the recognize process puts it in a small shared overlay buffer.
+#
+#   python3 preview.py [--port 8090] [--seconds 10]
+# serves a synthetic camera and reports how much encoding costs.
+
+import json
+import time
+import logging
+import threading
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+BOUNDARY = "frame"
+OVERLAY_SIZE = 4096
+
+PAGE = """<html><head><title>{name}</title></head>
+<body style="margin:0;background:#222"><img src="/stream" style="width:100%"></body></html>
+"""
+
+def overlay_buffer():
+  # made in the bridge before the workers are forked
+  return multiprocessing.Array("c", OVERLAY_SIZE)
+
+def publish_overlay(buffer, text, boxes=()):
+  # boxes are (label, score, (left, top, right, bottom)) with corners 0-1, as from detection.decode
+  data = json.dumps({"text": text, "boxes": [[b[0], b[1]] + list(b[2]) for b in boxes]}).encode("utf-8")
+  if len(data) >= OVERLAY_SIZE:
+    data = json.dumps({"text": text[:200], "boxes": []}).encode("utf-8")
+  with buffer.get_lock():
+    buffer.value = data
+
+def read_overlay(buffer):
+  with buffer.get_lock():
+    data = buffer.value
+  if len(data) == 0:
+    return "", []
+  overlay = json.loads(data.decode("utf-8"))
+  return overlay["text"], overlay["boxes"]
+
+class Preview(object):
+  def __init__(self, bus, max_width=320, fps=5.0, quality=60, overlay=None):
+    self.bus = bus
+    self.max_width = max_width
+    self.fps = fps
+    self.quality = quality
+    self.overlay = overlay # an overlay_buffer(), or None for no labels
+    self.cond = threading.Condition()
+    self.clients = 0
+    self.number = 0 # counts the JPEGs made
+    self.jpeg = None
+
+  def start(self):
+    thread = threading.Thread(target=self.run, name="preview", daemon=True)
+    thread.start()
+    return thread
+
+  def join(self):
+    with self.cond:
+      self.clients += 1
+      metrics.gauge("preview_clients").set(self.clients)
+      self.cond.notify_all()
+
+  def leave(self):
+    with self.cond:
+      self.clients -= 1
+      metrics.gauge("preview_clients").set(self.clients)
+
+  def next_jpeg(self, after, timeout=5.0):
+    # (number, jpeg) of the first JPEG newer than after, (after, None) on timeout
+    with self.cond:
+      if not self.cond.wait_for(lambda: self.number > after, timeout):
+        return after, None
+      return self.number, self.jpeg
+
+  def run(self):
+    import cv2
+    interval = 1.0 / self.fps
+    next_time = time.monotonic()
+    last = 0
+    while True:
+      with self.cond:
+        # nobody is watching, no work
+        self.cond.wait_for(lambda: self.clients > 0)
+      delay = next_time - time.monotonic()
+      if delay > 0:
+        time.sleep(delay)
+      frame = self.bus.wait(last, timeout=1.0)
+      if frame == None:
+        continue
+      start = time.perf_counter()
+      jpeg = self.encode(cv2, frame)
+      if jpeg == None:
+        metrics.counter("preview_frames_torn").inc()
+        continue
+      metrics.histogram("preview_encode_seconds").observe(time.perf_counter() - start)
+      metrics.counter("preview_frames").inc()
+      if last > 0 and frame.number > last + 1:
+        metrics.counter("preview_frames_skipped").inc(frame.number - last - 1)
+      last = frame.number
+      with self.cond:
+        self.number += 1
+        self.jpeg = jpeg
+        self.cond.notify_all()
+      next_time = max(next_time + interval, time.monotonic())
+
+  def encode(self, cv2, frame):
+    image = frame.image
+    height, width = image.shape[:2]
+    if width > self.max_width:
+      height = int(height * self.max_width / width)
+      width = self.max_width
+      small = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+    else:
+      small = image.copy()
+    if not frame.valid():
+      return None # the camera wrote over it while we were reading
+    if self.overlay != None:
+      text, boxes = read_overlay(self.overlay)
+      for label, score, left, top, right, bottom in boxes:
+        cv2.rectangle(small, (int(left * width), int(top * height)), (int(right * width), int(bottom * height)), (0, 0, 255), 1)
+        cv2.putText(small, "{} {:.2f}".format(label, score), (int(left * width) + 2, int(top * height) + 12),
+          cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0, 0, 255), 1)
+      if text != "":
+        cv2.putText(small, text.split("\\")[0], (4, height - 6), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (255, 255, 255), 1)
+    ok, jpeg = cv2.imencode(".jpg", small, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+    return jpeg.tobytes() if ok else None
+
+def serve(preview, port, host="", name="delft toolkit"):
+  class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+      if self.path == "/":
+        body = PAGE.format(name=name).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+      elif self.path.startswith("/stream"):
+        self.stream()
+      elif self.path.startswith("/snapshot"):
+        self.snapshot()
+      else:
+        self.send_error(404)
+
+    def stream(self):
+      self.connection.settimeout(10.0) # a stuck viewer does not hold its thread forever
+      self.send_response(200)
+      self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=" + BOUNDARY)
+      self.send_header("Cache-Control", "no-cache")
+      self.end_headers()
+      preview.join()
+      try:
+        number = 0
+        while True:
+          number, jpeg = preview.next_jpeg(number)
+          if jpeg == None:
+            continue
+          self.wfile.write("--{}\r\nContent-Type: image/jpeg\r\nContent-Length: {}\r\n\r\n".format(
+            BOUNDARY, len(jpeg)).encode() + jpeg + b"\r\n")
+      except (OSError, ValueError):
+        pass # the viewer went away
+      finally:
+        preview.leave()
+
+    def snapshot(self):
+      preview.join()
+      try:
+        number, jpeg = preview.next_jpeg(preview.number)
+      finally:
+        preview.leave()
+      if jpeg == None:
+        self.send_error(503, "no camera frames")
+        return
+      self.send_response(200)
+      self.send_header("Content-Type", "image/jpeg")
+      self.send_header("Content-Length", str(len(jpeg)))
+      self.end_headers()
+      self.wfile.write(jpeg)
+
+    def log_message(self, format, *args):
+      pass
+
+  server = ThreadingHTTPServer((host, port), Handler)
+  server.daemon_threads = True
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+  return server
+
+if __name__ == '__main__':
+  import argparse
+  import urllib.request
+  import frame_bus
+  parser = argparse.ArgumentParser(description="serve a synthetic camera as MJPEG")
+  parser.add_argument("--port", type=int, default=8090)
+  parser.add_argument("--seconds", type=float, default=5.0)
+  parser.add_argument("--fps", type=float, default=10.0)
+  parser.add_argument("--width", type=int, default=320)
+  args = parser.parse_args()
+
+  bus = frame_bus.FrameBus.create(640, 480, name=frame_bus.NAME + "_preview")
+  camera = threading.Thread(target=frame_bus.capture_loop, args=(bus, frame_bus.SyntheticSource(640, 480), 30), daemon=True)
+  camera.start()
+  overlay = overlay_buffer()
+  publish_overlay(overlay, "cat: 0.91000\\dog: 0.05000", [("cat", 0.91, (0.2, 0.2, 0.6, 0.7))])
+  preview = Preview(bus, args.width, args.fps, overlay=overlay)
+  preview.start()
+  serve(preview, args.port)
+
+  idle_cpu = time.process_time()
+  time.sleep(1.0)
+  idle_cpu = time.process_time() - idle_cpu
+  print("no viewers: {} frames encoded, {:.1f}% cpu for the synthetic camera alone".format(preview.number, idle_cpu * 100))
+
+  stream = urllib.request.urlopen("http://127.0.0.1:{}/stream".format(args.port))
+  start = time.monotonic()
+  cpu = time.process_time()
+  frames = 0
+  size = 0
+  while time.monotonic() - start < args.seconds:
+    line = stream.readline()
+    if line.startswith(b"Content-Length:"):
+      length = int(line.split(b":")[1])
+      stream.readline()
+      size += len(stream.read(length))
+      frames += 1
+  took = time.monotonic() - start
+  cpu = time.process_time() - cpu
+  stream.close()
+  encode = metrics.histogram("preview_encode_seconds")
+  print("one viewer: {} frames in {:.1f}s ({:.1f} fps), {:.1f} KB each, {:.1f}ms to encode, {:.1f}% cpu with the camera".format(
+    frames, took, frames / took, size / max(frames, 1) / 1024, encode.sum / max(encode.count, 1) * 1000, cpu / took * 100))
+  bus.close()
@@ -0,0 +1,209 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# on-demand profiling for a running robot, controlled over OSC with
+#   /profile/ start|stop|dump <process> [sampling|deterministic] [top n]
+#
+# sampling mode runs a thread that looks at the stacks of every other thread
+# a few hundred times a second, so it sees the OSC handler threads too.
+# deterministic mode uses cProfile in the thread that does a process's work,
+# that thread calls tick() once per loop and the profiler is switched on
+# there. While profiling is off, tick() is a single attribute check and no
+# thread or profile hook is installed.
+
+import os
+import sys
+import time
+import pstats
+import cProfile
+import logging
+import threading
+from collections import Counter
+
+log = logging.getLogger(__name__)
+
+MODES = ["sampling", "deterministic"]
+PROFILE_DIR = "profiles"
+
+class Sampler(object):
+  def __init__(self, interval=0.005):
+    self.interval = interval
+    self.stacks = Counter() # stack (outermost first) -> samples
+    self.samples = 0
+    self.lock = threading.Lock()
+    self.stop_e = threading.Event()
+    self.thread = threading.Thread(target=self.run, name="profile-sampler", daemon=True)
+
+  def start(self):
+    self.thread.start()
+
+  def stop(self):
+    self.stop_e.set()
+    self.thread.join()
+
+  def run(self):
+    me = threading.get_ident()
+    while not self.stop_e.wait(self.interval):
+      stacks = []
+      for ident, frame in sys._current_frames().items():
+        if ident == me:
+          continue
+        stack = []
+        while frame is not None:
+          code = frame.f_code
+          stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+          frame = frame.f_back
+        stack.reverse()
+        stacks.append(tuple(stack))
+      with self.lock:
+        for stack in stacks:
+          self.stacks[stack] += 1
+        self.samples += len(stacks)
+
+  def snapshot(self):
+    with self.lock:
+      return Counter(self.stacks), self.samples
+
+  def write(self, path):
+    # collapsed stacks, one "outer;inner;leaf count" line each, ready for flamegraph.pl
+    stacks, samples = self.snapshot()
+    with open(path, "w") as f:
+      for stack, count in stacks.most_common():
+        f.write(";".join("{}:{}".format(name, line) for file, line, name in stack))
+        f.write(" {}\n".format(count))
+
+  def top(self, n):
+    stacks, samples = self.snapshot()
+    own = Counter()
+    total = Counter()
+    for stack, count in stacks.items():
+      own[stack[-1]] += count
+      for frame in set(stack):
+        total[frame] += count
+    lines = ["{} samples, self% total% function".format(samples)]
+    samples = max(samples, 1)
+    for frame, count in own.most_common(n):
+      file, line, name = frame
+      lines.append("{:5.1f} {:5.1f} {} {}:{}".format(
+        100.0 * count / samples, 100.0 * total[frame] / samples, name, os.path.basename(file), line))
+    return lines
+
+class Profiler(object):
+  # create it in the thread that does the process's work and call tick() there
+  # once per loop, reply is called with the summary lines for every command
+  def __init__(self, process, reply):
+    self.process = process
+    self.reply = reply
+    self.owner = threading.get_ident()
+    self.attention = False # tick() returns straight away while this is False
+    self.lock = threading.Lock()
+    self.pending = [] # commands waiting for the owner thread, in order
+    self.mode = None
+    self.running = False
+    self.sampler = None
+    self.profile = None
+    self.enabled = False # cProfile hook installed in the owner thread
+    self.started = 0.0
+
+  def command(self, action, mode="sampling", n=10):
+    # handles one /profile/ action, can be called from any thread. cProfile
+    # only hooks the thread that enables it, so anything touching a
+    # deterministic profile is handed to the owner thread
+    with self.lock:
+      deterministic = (action == "start" and mode == "deterministic") or self.mode == "deterministic"
+      if threading.get_ident() != self.owner and (deterministic or len(self.pending) > 0):
+        self.pending.append((action, mode, n))
+        self.attention = True
+        return
+    self.reply(self.run(action, mode, n))
+
+  def tick(self):
+    if not self.attention:
+      return
+    with self.lock:
+      pending = self.pending
+      self.pending = []
+      self.attention = False
+    for action, mode, n in pending:
+      self.reply(self.run(action, mode, n))
+    if self.running and self.mode == "deterministic" and not self.enabled:
+      self.profile.enable()
+      self.enabled = True
+
+  def run(self, action, mode, n):
+    # never lets a profiling problem take down the loop that called it
+    try:
+      with self.lock:
+        return self._run(action, mode, n)
+    except Exception as e:
+      log.exception("%s profile %s failed", self.process, action)
+      return ["{} profile {} failed: {}".format(self.process, action, e)]
+
+  def _run(self, action, mode, n):
+    if action == "start":
+      self.start(mode)
+      return [self.process + " profiling started (" + self.mode + ")"]
+    elif action == "stop":
+      if not self.running:
+        return [self.process + " is not profiling"]
+      self.stop()
+      return self.dump(n)
+    elif action == "dump":
+      return self.dump(n)
+    return ["unknown profile action: " + str(action)]
+
+  def start(self, mode="sampling"):
+    if mode not in MODES:
+      mode = "sampling"
+    if self.running:
+      self.stop()
+    self.mode = mode
+    self.running = True
+    self.started = time.monotonic()
+    if mode == "sampling":
+      self.sampler = Sampler()
+      self.sampler.start()
+    else:
+      self.profile = cProfile.Profile()
+      self.attention = True # enabled on the next tick()
+    log.info("%s profiling started (%s)", self.process, mode)
+
+  def stop(self):
+    if not self.running:
+      return
+    if self.mode == "sampling":
+      self.sampler.stop()
+    elif self.enabled:
+      self.profile.disable()
+      self.enabled = False
+    self.running = False
+    log.info("%s profiling stopped", self.process)
+
+  def dump(self, n=10):
+    # writes the stats collected so far and returns a short top n summary
+    if self.mode == None:
+      return [self.process + " has not been profiled"]
+    if not os.path.isdir(PROFILE_DIR):
+      os.makedirs(PROFILE_DIR)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    header = "{} {} {:.1f}s".format(self.process, self.mode, time.monotonic() - self.started)
+    if self.mode == "sampling":
+      path = os.path.join(PROFILE_DIR, "{}-{}.folded".format(self.process, stamp))
+      self.sampler.write(path)
+      lines = self.sampler.top(n)
+    else:
+      path = os.path.join(PROFILE_DIR, "{}-{}.prof".format(self.process, stamp))
+      self.profile.dump_stats(path) # this also disables the hook
+      lines = top_deterministic(self.profile, n)
+      if self.enabled:
+        self.profile.enable() # keep going until stop
+    log.info("%s profile written to %s", self.process, path)
+    return [header + " -> " + path] + lines
+
+def top_deterministic(profile, n):
+  stats = pstats.Stats(profile).stats # (file, line, name) -> (cc, nc, tt, ct, callers)
+  lines = ["self(s) total(s) calls function"]
+  for func, (cc, nc, tt, ct, callers) in sorted(stats.items(), key=lambda s: s[1][2], reverse=True)[:n]:
+    file, line, name = func
+    lines.append("{:7.3f} {:7.3f} {:6d} {} {}:{}".format(tt, ct, nc, name, os.path.basename(file), line))
+  return lines
@@ -0,0 +1,155 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# records a session: every OSC command the bridge receives and every message
+# it sends, as the raw packets with the time they went through, so problems
+# seen on site (bursts of commands, floods of sensor data, slow recognitions)
+# can be replayed later with replay.py.
+#
+# the file starts with a header
+#   "DTKSESS1" <uint32 length> <json: when it started, anything else>
+# followed by one record per packet, appended as they happen
+#   <direction 1 byte, "i" in or "o" out> <float64 seconds since the start> <uint32 length> <packet>
+# recording only appends the packet to a deque, a thread writes them out every
+# half second, so it can stay on while the robot is in use:
+#   rec = Recorder("sessions/today.dtk")
+#   rec.record(INBOUND, dgram)
+#
+#   python3 recorder.py
+# measures how long record() takes.
+
+import os
+import json
+import time
+import struct
+import logging
+import threading
+from collections import deque
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"DTKSESS1"
+LENGTH = struct.Struct("<I")
+RECORD = struct.Struct("<cdI")
+INBOUND = b"i"
+OUTBOUND = b"o"
+
+def session_path(directory):
+  # a new file for each run of the bridge
+  return os.path.join(directory, time.strftime("session-%Y%m%d-%H%M%S.dtk"))
+
+class Recorder(object):
+  def __init__(self, path, flush_interval=0.5, max_bytes=200 * 1024 * 1024, meta=None):
+    directory = os.path.dirname(path)
+    if directory != "" and not os.path.isdir(directory):
+      os.makedirs(directory)
+    self.path = path
+    self.file = open(path, "wb")
+    self.start = time.monotonic()
+    header = {"started": time.time()}
+    header.update(meta or {})
+    header = json.dumps(header).encode("utf-8")
+    self.file.write(MAGIC + LENGTH.pack(len(header)) + header)
+    self.size = self.file.tell()
+    self.max_bytes = max_bytes
+    self.flush_interval = flush_interval
+    self.pending = deque() # appending to and popping from a deque is thread safe
+    self.full = False
+    self.records = 0
+    self.stop_e = threading.Event()
+    self.thread = threading.Thread(target=self.run, name="recorder", daemon=True)
+    self.thread.start()
+    log.info("recording the session to %s", path)
+
+  def record(self, direction, dgram):
+    # called for every packet, keep it cheap
+    self.pending.append((direction, time.monotonic(), dgram))
+
+  def run(self):
+    # the only writer until close() has stopped it
+    while not self.stop_e.wait(self.flush_interval):
+      self.flush()
+
+  def flush(self):
+    chunks = []
+    count = 0
+    while len(self.pending) > 0:
+      direction, at, dgram = self.pending.popleft()
+      chunks.append(RECORD.pack(direction, at - self.start, len(dgram)))
+      chunks.append(dgram)
+      count += 1
+    if count == 0 or self.full:
+      return
+    data = b"".join(chunks)
+    if self.size + len(data) > self.max_bytes:
+      self.full = True
+      log.warning("session file %s reached %d MB, stopped recording", self.path, self.max_bytes // (1024 * 1024))
+      return
+    self.file.write(data)
+    self.file.flush()
+    self.size += len(data)
+    self.records += count
+    metrics.counter("session_records").inc(count)
+    metrics.gauge("session_bytes").set(self.size)
+
+  def close(self):
+    # writes out everything recorded so far, safe to call more than once
+    if self.stop_e.is_set():
+      return
+    self.stop_e.set()
+    self.thread.join()
+    self.flush()
+    self.file.close()
+
+def tap(dispatcher, recorder):
+  # records each packet the OSC server hands to the dispatcher, before it is handled
+  call = dispatcher.call_handlers_for_packet
+  def recorded(data, client_address):
+    recorder.record(INBOUND, data)
+    return call(data, client_address)
+  dispatcher.call_handlers_for_packet = recorded
+
+def read(path):
+  # (header, [(direction, seconds, dgram)]) from a session file, a cut off last record is skipped
+  with open(path, "rb") as f:
+    data = f.read()
+  if data[:len(MAGIC)] != MAGIC:
+    raise ValueError("{} is not a session recording".format(path))
+  offset = len(MAGIC)
+  length, = LENGTH.unpack_from(data, offset)
+  offset += LENGTH.size
+  header = json.loads(data[offset:offset + length].decode("utf-8"))
+  offset += length
+  records = []
+  while offset + RECORD.size <= len(data):
+    direction, at, length = RECORD.unpack_from(data, offset)
+    offset += RECORD.size
+    if offset + length > len(data):
+      break
+    records.append((direction, at, data[offset:offset + length]))
+    offset += length
+  return header, records
+
+if __name__ == '__main__':
+  import tempfile
+  from pythonosc import osc_message_builder
+  builder = osc_message_builder.OscMessageBuilder(address="/num/analogin/1/")
+  builder.add_arg(512.0)
+  builder.add_arg(time.time(), osc_message_builder.OscMessageBuilder.ARG_TYPE_DOUBLE)
+  dgram = builder.build().dgram
+  path = os.path.join(tempfile.mkdtemp(), "bench.dtk")
+  rec = Recorder(path)
+  count = 200000
+  start = time.perf_counter()
+  for i in range(count):
+    rec.record(OUTBOUND, dgram)
+  took = time.perf_counter() - start
+  start = time.perf_counter()
+  rec.close()
+  flushed = time.perf_counter() - start
+  header, records = read(path)
+  print("record(): {:.2f}us per packet, writing {} packets took {:.3f}s ({:.2f}us each), {:.1f} bytes each on disk".format(
+    took / count * 1e6, len(records), flushed, flushed / count * 1e6, os.path.getsize(path) / count))
+  os.remove(path)
@@ -0,0 +1,195 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# plays back a session recorded with the bridge's --record option.
+#
+#   python3 replay.py show session.dtk
+# lists what was sent and received, per address.
+#
+#   python3 replay.py run session.dtk --to 127.0.0.1:5005 [--speed 4] [--out replayed.dtk]
+# sends the recorded commands to a bridge (usually one started with --simulate)
+# at the times they came in originally, divided by speed. It subscribes to
+# everything the bridge sends back, records that too, and then compares it
+# with the original session.
+#
+#   python3 replay.py diff session.dtk replayed.dtk
+# compares what the bridge sent in two sessions: how many messages each
+# address got, how many had different values, and how much later or earlier
+# they came (p50 and p90, in seconds of the second session). Timestamps the
+# bridge adds (OSC doubles) are left out of the comparison. Times count from
+# the first command in each session, messages sent before it are left out,
+# and the second session's speed is taken into account.
+
+import sys
+import time
+import socket
+import threading
+
+from pythonosc import osc_message_builder
+from pythonosc.osc_message import OscMessage
+
+import recorder
+
+# commands that only make sense in the original session: subscriptions for
+# hosts that are not here now, and clock sync answers to pings long gone
+SKIP = ["/subscribe/", "/unsubscribe/", "/pong/"]
+
+def padded(dgram, offset):
+  # an OSC string starting at offset and the offset after its padding
+  end = dgram.index(b"\0", offset)
+  return dgram[offset:end].decode("utf-8", "replace"), (end + 4) & ~3
+
+def parse(dgram):
+  # (address, args) of a message, without the double precision timestamps
+  if dgram.startswith(b"#bundle"):
+    return "#bundle", ()
+  try:
+    address, offset = padded(dgram, 0)
+    tags, offset = padded(dgram, offset)
+    params = OscMessage(dgram).params
+  except Exception:
+    return "?", ()
+  return address, tuple(p for t, p in zip(tags[1:], params) if t != "d")
+
+def load(path):
+  # header, [(seconds since the first command, direction, address, args)]
+  header, records = recorder.read(path)
+  inbound = [at for direction, at, dgram in records if direction == recorder.INBOUND]
+  t0 = inbound[0] if len(inbound) > 0 else 0.0
+  return header, [(at - t0, direction) + parse(dgram) for direction, at, dgram in records]
+
+def show(path):
+  header, messages = load(path)
+  lines = ["{} started {} {}".format(path, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(header["started"])),
+    " ".join("{}={}".format(k, v) for k, v in sorted(header.items()) if k != "started"))]
+  if len(messages) == 0:
+    return lines + ["no messages"]
+  lines.append("{:.1f} seconds, {} in, {} out".format(messages[-1][0] - messages[0][0],
+    sum(1 for m in messages if m[1] == recorder.INBOUND), sum(1 for m in messages if m[1] == recorder.OUTBOUND)))
+  counts = {}
+  for at, direction, address, args in messages:
+    key = (direction.decode(), address)
+    first, last, count = counts.get(key, (at, at, 0))
+    counts[key] = (first, at, count + 1)
+  lines.append("{:<3} {:<34} {:>7} {:>9} {:>9}".format("", "address", "count", "first s", "rate/s"))
+  for (direction, address), (first, last, count) in sorted(counts.items()):
+    rate = (count - 1) / (last - first) if last > first else 0.0
+    lines.append("{:<3} {:<34} {:>7} {:>9.2f} {:>9.1f}".format(direction, address, count, first, rate))
+  return lines
+
+def percentile(values, p):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(len(values) * p))]
+
+def diff(path_a, path_b):
+  header_a, a = load(path_a)
+  header_b, b = load(path_b)
+  # B's seconds for each of A's, when B was played faster or slower
+  scale = float(header_a.get("speed", 1.0)) / float(header_b.get("speed", 1.0))
+  def outbound(messages):
+    by_address = {}
+    for at, direction, address, args in messages:
+      if direction == recorder.OUTBOUND and at >= 0: # not what was sent before the first command
+        by_address.setdefault(address, []).append((at, args))
+    return by_address
+  out_a, out_b = outbound(a), outbound(b)
+  lines = ["{:<34} {:>6} {:>6} {:>8} {:>9} {:>9}".format("address", "a", "b", "differ", "shift p50", "shift p90")]
+  examples = []
+  for address in sorted(set(out_a) | set(out_b)):
+    ma, mb = out_a.get(address, []), out_b.get(address, [])
+    pairs = list(zip(ma, mb))
+    different = [(x, y) for x, y in pairs if x[1] != y[1]]
+    shifts = [y[0] - x[0] * scale for x, y in pairs]
+    lines.append("{:<34} {:>6} {:>6} {:>8} {:>9} {:>9}".format(address, len(ma), len(mb), len(different),
+      "{:.3f}".format(percentile(shifts, 0.5)) if shifts else "-", "{:.3f}".format(percentile(shifts, 0.9)) if shifts else "-"))
+    if len(different) > 0:
+      x, y = different[0]
+      examples.append("{} at {:.2f}s: {} != {}".format(address, x[0], list(x[1]), list(y[1])))
+  if len(examples) > 0:
+    lines += ["", "first difference for each address:"] + examples
+  return lines
+
+def local_ip(host, port):
+  # the address the bridge will see our packets come from
+  s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  try:
+    s.connect((host, port))
+    return s.getsockname()[0]
+  finally:
+    s.close()
+
+def message(address, args):
+  builder = osc_message_builder.OscMessageBuilder(address=address)
+  for arg in args:
+    builder.add_arg(arg)
+  return builder.build().dgram
+
+def run(path, target, speed, port, out, tail, skip):
+  header, records = recorder.read(path)
+  inbound = [(at, dgram) for direction, at, dgram in records
+    if direction == recorder.INBOUND and parse(dgram)[0] not in skip]
+  if len(inbound) == 0:
+    return ["no commands to replay in " + path]
+  session = recorder.Recorder(out, meta={"replay_of": path, "speed": speed})
+  sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  listener.bind(("", port))
+  def listen():
+    while True:
+      dgram, source = listener.recvfrom(65536)
+      session.record(recorder.OUTBOUND, dgram)
+  threading.Thread(target=listen, daemon=True).start()
+  me = local_ip(*target)
+  # everything the bridge sends, with no rate limit and no expiry
+  sock.sendto(message("/subscribe/", [me, port, "*", 0, 0]), target)
+  time.sleep(0.2)
+
+  t0 = inbound[0][0]
+  start = time.monotonic()
+  late = []
+  for at, dgram in inbound:
+    due = start + (at - t0) / speed
+    delay = due - time.monotonic()
+    if delay > 0:
+      time.sleep(delay)
+    late.append(time.monotonic() - due)
+    session.record(recorder.INBOUND, dgram)
+    sock.sendto(dgram, target)
+  time.sleep(tail) # answers to the last commands
+  sock.sendto(message("/unsubscribe/", [me, port]), target)
+  session.close()
+  took = time.monotonic() - start
+  lines = ["sent {} commands in {:.2f}s at {}x, sending p90 {:.1f}ms late, {} messages back, saved in {}".format(
+    len(inbound), took, speed, percentile(late, 0.9) * 1000, session.records - len(inbound), out)]
+  return lines + diff(path, out)
+
+if __name__ == '__main__':
+  import argparse
+  parser = argparse.ArgumentParser(description="show, replay and compare recorded sessions")
+  commands = parser.add_subparsers(dest="command")
+  p = commands.add_parser("show", help="what is in a session")
+  p.add_argument("session")
+  p = commands.add_parser("run", help="replay a session's commands to a bridge")
+  p.add_argument("session")
+  p.add_argument("--to", default="127.0.0.1:5005", help="host:port of the bridge")
+  p.add_argument("--speed", type=float, default=1.0, help="2 plays twice as fast")
+  p.add_argument("--port", type=int, default=5016, help="port to receive the bridge's messages on")
+  p.add_argument("--out", default="replayed.dtk", help="file to record the replay in")
+  p.add_argument("--tail", type=float, default=3.0, help="seconds to wait for answers after the last command")
+  p.add_argument("--skip", default=",".join(SKIP), help="addresses not to replay, comma separated")
+  p = commands.add_parser("diff", help="compare what the bridge sent in two sessions")
+  p.add_argument("a")
+  p.add_argument("b")
+  args = parser.parse_args()
+  if args.command == "show":
+    lines = show(args.session)
+  elif args.command == "run":
+    host, port = args.to.rsplit(":", 1)
+    lines = run(args.session, (host, int(port)), args.speed, args.port, args.out, args.tail,
+      [s for s in args.skip.split(",") if s != ""])
+  elif args.command == "diff":
+    lines = diff(args.a, args.b)
+  else:
+    parser.print_help()
+    sys.exit(1)
+  print("\n".join(lines))
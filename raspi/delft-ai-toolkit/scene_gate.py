@@ -0,0 +1,110 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# skips recognition when the camera sees the same scene as last time.
+#
+# each frame is shrunk to a small grey thumbnail (32x24 by default) with its
+# average brightness taken out, so sensor noise and small exposure changes do
+# not count. If the mean difference from the thumbnail of the last recognized
+# frame is below threshold (in grey levels, 0-255) the last result is used
+# again, unless it is older than max_age seconds or was for another model.
+#   gate = SceneGate(threshold=4.0, max_age=5.0)
+#   result = gate.check(frame, model)
+#   if result == None:
+#     result = infer(frame)
+#     gate.store(result, model)
+# 'python3 scene_gate.py' runs it on made up frame sequences.
+
+import time
+
+import numpy as np
+
+import metrics
+
+class SceneGate(object):
+  def __init__(self, threshold=4.0, max_age=5.0, size=(32, 24)):
+    self.threshold = threshold # 0 turns the gate off
+    self.max_age = max_age
+    self.size = size # thumbnail columns, rows
+    self.signature = None # thumbnail of the last recognized frame
+    self.pending = None # thumbnail of the frame being recognized
+    self.key = None
+    self.result = None
+    self.stored_at = 0.0
+    self.last_difference = 0.0
+    self.checked = 0
+    self.skipped = 0
+
+  def thumbnail(self, frame):
+    cols, rows = self.size
+    if frame.ndim == 3:
+      frame = frame.mean(axis=2)
+    # take every few pixels first, then average blocks, so big frames stay cheap
+    step = max(1, min(frame.shape[0] // (rows * 4), frame.shape[1] // (cols * 4)))
+    frame = frame[::step, ::step].astype(np.float32)
+    h = frame.shape[0] // rows
+    w = frame.shape[1] // cols
+    thumb = frame[:h * rows, :w * cols].reshape(rows, h, cols, w).mean(axis=(1, 3))
+    return thumb - thumb.mean()
+
+  def check(self, frame, key=None, now=None):
+    # the cached result if the scene has not changed, None if it needs recognizing
+    if now == None:
+      now = time.monotonic()
+    self.checked += 1
+    if self.threshold <= 0:
+      self.pending = None
+      return self.count(False)
+    self.pending = self.thumbnail(frame)
+    if self.signature is None or key != self.key or now - self.stored_at > self.max_age:
+      return self.count(False)
+    self.last_difference = float(np.abs(self.pending - self.signature).mean())
+    if self.last_difference >= self.threshold:
+      return self.count(False)
+    return self.count(True)
+
+  def count(self, skipped):
+    metrics.counter("scene_gate_frames", outcome="skipped" if skipped else "inferred").inc()
+    if skipped:
+      self.skipped += 1
+      return self.result
+    return None
+
+  def store(self, result, key=None, now=None):
+    # the result for the frame passed to the last check()
+    self.signature = self.pending
+    self.key = key
+    self.result = result
+    self.stored_at = time.monotonic() if now == None else now
+
+  def skip_rate(self):
+    return self.skipped / self.checked if self.checked > 0 else 0.0
+
+if __name__ == '__main__':
+  # made up 320x240 frames: a still scene with sensor noise, a flickering
+  # exposure, a square moving across, and a scene that changes once
+  rng = np.random.default_rng(1)
+  base = rng.integers(40, 200, (240, 320, 3)).astype(np.float32)
+  base = np.repeat(np.repeat(base[::40, ::40], 40, axis=0), 40, axis=1)[:240, :320]
+  def noisy(frame):
+    return np.clip(frame + rng.normal(0, 6, frame.shape), 0, 255).astype(np.uint8)
+  def moving(i):
+    frame = base.copy()
+    x = 10 + i * 10
+    frame[100:160, x:x + 60] = 255
+    return noisy(frame)
+  sequences = [
+    ("still", [noisy(base) for i in range(30)]),
+    ("exposure", [noisy(base * (1.0 + 0.04 * (i % 3))) for i in range(30)]),
+    ("moving", [moving(i) for i in range(25)]),
+    ("cut", [noisy(base) for i in range(15)] + [noisy(255 - base) for i in range(15)])
+  ]
+  for name, frames in sequences:
+    gate = SceneGate()
+    inferred = []
+    for i, frame in enumerate(frames):
+      now = i * 0.1 # ten frames a second
+      if gate.check(frame, "squeezenet", now) == None:
+        inferred.append(i)
+        gate.store("result " + str(i), "squeezenet", now)
+    print("{:<9} frames={} skip rate={:.0%} inferred at {}".format(name, len(frames), gate.skip_rate(), inferred))
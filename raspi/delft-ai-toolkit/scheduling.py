@@ -0,0 +1,175 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# keeps the control path (OSC commands, the control loop, motors, servos and
+# LEDs in the bridge process) from waiting on recognition and speech.
+#
+#   --affinity "bridge=0;recognize=2-3;audio=1;listen=1"   cores each process may run on
+#   --nice "recognize=5;listen=2"                           lower priority for the workers
+#   --control_rt 10                                         SCHED_FIFO priority for the control threads
+#   --cv_threads 2                                          OpenCV threads, by default one per recognize core
+# processes are bridge, audio, listen, recognize, camera and preview. Each one
+# applies its own settings first thing, before it starts any threads, so its
+# threads all inherit them. A real-time priority only goes to the bridge's
+# control loop and the motion, servo and LED threads, and needs root or
+# CAP_SYS_NICE; without it the toolkit carries on and says so.
+#
+#   python3 scheduling.py [--seconds 5]
+# measures how late a 100Hz control loop wakes up while every core is busy
+# with a synthetic inference load, with and without isolation.
+
+import os
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+def parse_cpus(text):
+  # "0-1,3" -> {0, 1, 3}
+  cpus = set()
+  for part in text.split(","):
+    part = part.strip()
+    if part == "":
+      continue
+    if "-" in part:
+      first, last = part.split("-")
+      cpus.update(range(int(first), int(last) + 1))
+    else:
+      cpus.add(int(part))
+  return cpus
+
+def parse_settings(text):
+  # "bridge=0;recognize=2-3" -> {"bridge": "0", "recognize": "2-3"}
+  settings = {}
+  for item in text.split(";"):
+    if "=" in item:
+      name, value = item.split("=", 1)
+      settings[name.strip()] = value.strip()
+  return settings
+
+def set_affinity(cpus):
+  available = os.sched_getaffinity(0)
+  cpus = cpus & available
+  if len(cpus) == 0:
+    log.warning("none of those cores are available, keeping %s", sorted(available))
+    return available
+  os.sched_setaffinity(0, cpus)
+  return cpus
+
+def realtime(priority, tid=0):
+  # SCHED_FIFO for one thread (0 is the calling one), False if not allowed
+  try:
+    os.sched_setscheduler(tid, os.SCHED_FIFO, os.sched_param(priority))
+    return True
+  except (PermissionError, OSError, AttributeError) as e:
+    log.warning("can't give thread %s real-time priority %s: %s", tid or "", priority, e)
+    return False
+
+def configure(name, FLAGS):
+  # applies this process's affinity, niceness and OpenCV threads from the flags
+  parts = []
+  cpus = None
+  affinity = parse_settings(FLAGS.affinity).get(name)
+  if affinity != None:
+    cpus = set_affinity(parse_cpus(affinity))
+    parts.append("cores " + ",".join(str(c) for c in sorted(cpus)))
+  nice = parse_settings(FLAGS.nice).get(name)
+  if nice != None:
+    try:
+      os.nice(int(nice))
+      parts.append("nice " + nice)
+    except PermissionError:
+      log.warning("%s can't change its niceness to %s", name, nice)
+  if name in ("recognize", "preview") and (FLAGS.cv_threads > 0 or cpus != None):
+    import cv2
+    threads = FLAGS.cv_threads if FLAGS.cv_threads > 0 else len(cpus)
+    cv2.setNumThreads(threads)
+    parts.append("{} OpenCV threads".format(threads))
+  if len(parts) > 0:
+    log.info("%s runs on %s", name, ", ".join(parts))
+  return cpus
+
+def control_realtime(FLAGS, threads=()):
+  # the calling thread (the control loop) and the given ones
+  if FLAGS.control_rt <= 0:
+    return
+  given = [realtime(FLAGS.control_rt)]
+  for thread in threads:
+    if thread != None and thread.native_id != None:
+      given.append(realtime(FLAGS.control_rt, thread.native_id))
+  if all(given):
+    log.info("control loop and %d engine threads at real-time priority %s", len(given) - 1, FLAGS.control_rt)
+
+def percentile(values, p):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(len(values) * p))]
+
+if __name__ == '__main__':
+  import argparse
+  import multiprocessing
+  import numpy as np
+  parser = argparse.ArgumentParser(description="control loop jitter with and without isolation")
+  parser.add_argument("--seconds", type=float, default=5.0)
+  parser.add_argument("--rate", type=float, default=100.0, help="control loop ticks a second")
+  parser.add_argument("--rt", type=int, default=0, help="also try SCHED_FIFO at this priority")
+  args = parser.parse_args()
+  cores = sorted(os.sched_getaffinity(0))
+
+  def inference(cpus, nice, stop):
+    # stands in for net.forward(): big matrix multiplies on every core it has
+    if cpus != None:
+      os.sched_setaffinity(0, cpus)
+    os.nice(nice)
+    a = np.random.default_rng(0).random((400, 400), dtype=np.float32)
+    while not stop.is_set():
+      a = np.tanh(a @ a)
+
+  def control(seconds, rate, rt):
+    # wakes at fixed deadlines like the motion engine, returns how late each wake up was
+    if rt > 0:
+      realtime(rt)
+    interval = 1.0 / rate
+    late = []
+    deadline = time.monotonic() + interval
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+      delay = deadline - time.monotonic()
+      if delay > 0:
+        time.sleep(delay)
+      late.append(time.monotonic() - deadline)
+      deadline += interval
+    return late
+
+  scenarios = [("idle", None, None, 0, 0), ("shared", None, None, 0, len(cores))]
+  if len(cores) > 1:
+    control_cpus, load_cpus = {cores[0]}, set(cores[1:])
+    scenarios.append(("isolated", control_cpus, load_cpus, 10, len(cores)))
+  else:
+    scenarios.append(("niced", None, None, 10, len(cores)))
+  if args.rt > 0:
+    name, control_cpus, load_cpus, nice, workers = scenarios[-1]
+    scenarios.append((name + "+rt", control_cpus, load_cpus, nice, workers))
+
+  print("{} cores, control loop at {:g}Hz, {:g}s each".format(len(cores), args.rate, args.seconds))
+  print("{:<12} {:>9} {:>9} {:>9} {:>9}".format("", "p50 ms", "p99 ms", "max ms", "> 2ms"))
+  for name, control_cpus, load_cpus, nice, workers in scenarios:
+    stop = multiprocessing.Event()
+    load = [multiprocessing.Process(target=inference, args=(load_cpus, nice, stop), daemon=True) for i in range(workers)]
+    for p in load:
+      p.start()
+    time.sleep(0.5)
+    saved = os.sched_getaffinity(0)
+    if control_cpus != None:
+      os.sched_setaffinity(0, control_cpus)
+    late = control(args.seconds, args.rate, args.rt if name.endswith("+rt") else 0)
+    os.sched_setaffinity(0, saved)
+    if name.endswith("+rt"):
+      try:
+        os.sched_setscheduler(0, os.SCHED_OTHER, os.sched_param(0))
+      except OSError:
+        pass
+    stop.set()
+    for p in load:
+      p.join()
+    print("{:<12} {:>9.3f} {:>9.3f} {:>9.3f} {:>8.1%}".format(name, percentile(late, 0.5) * 1000,
+      percentile(late, 0.99) * 1000, max(late) * 1000, sum(1 for l in late if l > 0.002) / len(late)))
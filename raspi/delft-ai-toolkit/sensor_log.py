@@ -0,0 +1,281 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# samples sensors on the Pi faster than the network could carry them, keeps
+# the samples in a ring log on disk, and sends Unity only the summaries it
+# asks for.
+#
+#   /sensorlog/ start <analog|touch> <port> [rate] [seconds]   sample rate times a second, for seconds (0 until stopped)
+#   /sensorlog/ stop <analog|touch> <port>
+#   /sensorlog/ summary <analog|touch> <port> [seconds]         min, max, mean of the last seconds (0 for all)
+#   /sensorlog/ series <analog|touch> <port> [seconds] [points] the last seconds resampled to points means
+#   /sensorlog/ clear <analog|touch> <port>
+#   /sensorlog/ list
+# the CRICKIT's seesaw waits about 8ms for its ADC on every analog read, so a
+# port can't be read more than CRICKIT_RATE times a second and faster rates
+# are turned down to it. Ports captured at the same time share the I2C bus
+# with each other, /analogin/ and the motors, servos and LEDs, so together
+# they get less.
+#
+# answers come back on /str/sensorlog/ as a line of text followed by the numbers
+# and, like other sensor messages, the time of the first sample on the shared clock:
+#   summary: <text> <count> <min> <max> <mean> <seconds covered> <time>
+#   series:  <text> <step> <value> <value>... <time>   (empty buckets are repeated from the one before)
+#
+# each sensor has a ring of capacity (time.monotonic(), value) samples in a
+# numpy memmap file, e.g. sensorlog/analog-1.ring, so a capture is still
+# there after the bridge stops. The first 8 bytes of the file count the
+# samples ever written, the ring starts after them. time.monotonic() starts
+# again after a reboot, so a sample older than the last one in the ring
+# clears it and the ring starts over.
+
+import os
+import time
+import logging
+import threading
+
+import numpy as np
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+SAMPLE = np.dtype([("t", "<f8"), ("v", "<f4")])
+HEADER = 8
+MAX_POINTS = 1000 # keeps a series in one UDP packet
+FLUSH_INTERVAL = 5.0
+CRICKIT_RATE = 100.0 # reads a second, one analog read takes a bit over 8ms
+
+class SensorRing(object):
+  def __init__(self, path, capacity):
+    size = HEADER + capacity * SAMPLE.itemsize
+    if not os.path.exists(path) or os.path.getsize(path) != size:
+      with open(path, "wb") as f:
+        f.truncate(size)
+    self.path = path
+    self.capacity = capacity
+    self.count = np.memmap(path, dtype="<i8", mode="r+", shape=(1,))
+    self.samples = np.memmap(path, dtype=SAMPLE, mode="r+", offset=HEADER, shape=(capacity,))
+    self.lock = threading.Lock()
+    n = int(self.count[0])
+    self.last = float(self.samples[(n - 1) % capacity]["t"]) if n > 0 else None
+
+  def append(self, t, value):
+    with self.lock:
+      n = int(self.count[0])
+      if self.last != None and t < self.last:
+        # written before a reboot, on a clock that has started again since
+        log.info("%s is from before the clock restarted, starting it again", self.path)
+        n = 0
+      self.samples[n % self.capacity] = (t, value)
+      self.count[0] = n + 1
+      self.last = t
+
+  def ordered(self):
+    # copies of the times and values, oldest first
+    with self.lock:
+      n = int(self.count[0])
+      if n <= self.capacity:
+        data = np.array(self.samples[:n])
+      else:
+        head = n % self.capacity
+        data = np.concatenate((self.samples[head:], self.samples[:head]))
+    # only the samples since the clock last went backwards, the ones before it can't be compared
+    back = np.flatnonzero(np.diff(data["t"]) < 0)
+    if len(back) > 0:
+      data = data[back[-1] + 1:]
+    return data["t"], data["v"]
+
+  def window(self, seconds):
+    # the samples of the last seconds, all of them if seconds is 0
+    t, v = self.ordered()
+    if seconds > 0 and len(t) > 0:
+      start = np.searchsorted(t, t[-1] - seconds)
+      t, v = t[start:], v[start:]
+    return t, v
+
+  def clear(self):
+    with self.lock:
+      self.count[0] = 0
+      self.last = None
+
+  def flush(self):
+    self.count.flush()
+    self.samples.flush()
+
+def summary(t, v):
+  # count, min, max, mean
+  if len(v) == 0:
+    return 0, 0.0, 0.0, 0.0
+  return len(v), float(v.min()), float(v.max()), float(v.mean())
+
+def resample(t, v, points):
+  # means of points equal time buckets: (start, step, values)
+  if len(t) == 0:
+    return 0.0, 0.0, []
+  start, end = t[0], t[-1]
+  step = (end - start) / points if end > start else 1.0
+  bucket = np.minimum(((t - start) / step).astype(np.int64), points - 1)
+  counts = np.bincount(bucket, minlength=points)
+  sums = np.bincount(bucket, weights=v, minlength=points)
+  filled = counts > 0
+  means = np.zeros(points)
+  means[filled] = sums[filled] / counts[filled]
+  # an empty bucket repeats the one before it
+  last = np.maximum.accumulate(np.where(filled, np.arange(points), 0))
+  return float(start), float(step), means[last].tolist()
+
+class Capture(object):
+  def __init__(self, key, rate, until):
+    self.key = key
+    self.rate = rate
+    self.until = until # time.monotonic() to stop at, 0 for never
+    self.stop_e = threading.Event()
+    self.samples = 0
+    self.late = 0
+
+class SensorLog(object):
+  def __init__(self, read, reply, directory="sensorlog", capacity=65536, max_rate=0.0):
+    self.read = read # read(kind, port) returns the sensor's value
+    self.max_rate = max_rate # the fastest read() can go, 0 for no limit
+    self.reply = reply # reply(args, captured) sends an answer, captured is a time.monotonic() or None for now
+    self.directory = directory
+    self.capacity = capacity
+    self.lock = threading.Lock()
+    self.rings = {}
+    self.captures = {}
+
+  def ring(self, key):
+    with self.lock:
+      ring = self.rings.get(key)
+      if ring == None:
+        if not os.path.isdir(self.directory):
+          os.makedirs(self.directory)
+        ring = SensorRing(os.path.join(self.directory, key.replace("/", "-") + ".ring"), self.capacity)
+        self.rings[key] = ring
+      return ring
+
+  def command(self, action, kind="analog", port=1, a=None, b=None):
+    key = "{}/{}".format(kind, int(port))
+    if action == "list":
+      self.reply([self.status()])
+      return
+    if kind not in ("analog", "touch"):
+      self.reply(["unknown sensor " + str(kind)])
+      return
+    if action == "start":
+      self.start(key, kind, int(port), 100.0 if a == None else float(a), 0.0 if b == None else float(b))
+    elif action == "stop":
+      self.stop(key)
+    elif action == "summary":
+      t, v = self.ring(key).window(0.0 if a == None else float(a))
+      count, low, high, mean = summary(t, v)
+      self.reply(["{} summary n={} min={:g} max={:g} mean={:.2f}".format(key, count, low, high, mean),
+        count, low, high, mean, float(t[-1] - t[0]) if count > 0 else 0.0], t[0] if count > 0 else None)
+    elif action == "series":
+      points = max(1, min(MAX_POINTS, 100 if b == None else int(b)))
+      t, v = self.ring(key).window(0.0 if a == None else float(a))
+      start, step, values = resample(t, v, points)
+      self.reply(["{} series {} points every {:.4f}s".format(key, len(values), step), step] + values,
+        start if len(values) > 0 else None)
+    elif action == "clear":
+      self.ring(key).clear()
+      self.reply([key + " cleared"])
+    else:
+      self.reply(["unknown sensorlog action: " + str(action)])
+
+  def start(self, key, kind, port, rate, seconds):
+    if rate <= 0:
+      self.reply([key + " needs a rate above 0"])
+      return
+    asked = rate
+    if self.max_rate > 0:
+      rate = min(rate, self.max_rate)
+    ring = self.ring(key)
+    self.stop(key)
+    capture = Capture(key, rate, time.monotonic() + seconds if seconds > 0 else 0.0)
+    with self.lock:
+      self.captures[key] = capture
+    thread = threading.Thread(target=self.sample, args=(capture, ring, kind, port),
+      name="sensorlog-" + key, daemon=True)
+    thread.start()
+    self.reply(["{} capturing at {:g}/s{}{}".format(key, rate, " for {:g}s".format(seconds) if seconds > 0 else "",
+      " ({:g}/s asked for, the most it can read is {:g}/s)".format(asked, self.max_rate) if rate < asked else "")])
+
+  def stop(self, key):
+    with self.lock:
+      capture = self.captures.pop(key, None)
+    if capture != None:
+      capture.stop_e.set()
+
+  def sample(self, capture, ring, kind, port):
+    # reads on a fixed schedule; when a read runs long the missed samples are skipped, not bunched up
+    interval = 1.0 / capture.rate
+    next_time = time.monotonic()
+    next_flush = next_time + FLUSH_INTERVAL
+    counted = 0
+    while not capture.stop_e.is_set():
+      now = time.monotonic()
+      if capture.until > 0 and now >= capture.until:
+        break
+      try:
+        value = float(self.read(kind, port))
+      except Exception:
+        log.exception("sensorlog can't read %s", capture.key)
+        break
+      ring.append(now, value)
+      capture.samples += 1
+      next_time += interval
+      now = time.monotonic()
+      if now > next_time:
+        missed = int((now - next_time) / interval) + 1
+        capture.late += missed
+        next_time += missed * interval
+      if now > next_flush:
+        ring.flush()
+        next_flush = now + FLUSH_INTERVAL
+        metrics.counter("sensorlog_samples", sensor=capture.key).inc(capture.samples - counted)
+        counted = capture.samples
+      capture.stop_e.wait(max(0.0, next_time - time.monotonic()))
+    ring.flush()
+    metrics.counter("sensorlog_samples", sensor=capture.key).inc(capture.samples - counted)
+    metrics.counter("sensorlog_missed", sensor=capture.key).inc(capture.late)
+    with self.lock:
+      if self.captures.get(capture.key) is capture:
+        del self.captures[capture.key]
+    self.reply(["{} stopped after {} samples, {} missed".format(capture.key, capture.samples, capture.late)])
+
+  def status(self):
+    with self.lock:
+      rings = dict(self.rings)
+      captures = dict(self.captures)
+    items = []
+    for key in sorted(rings):
+      count = min(int(rings[key].count[0]), self.capacity)
+      items.append("{}:{}{}".format(key, count,
+        "@{:g}/s".format(captures[key].rate) if key in captures else ""))
+    return "sensorlog " + (" ".join(items) if items else "empty")
+
+if __name__ == '__main__':
+  # samples a made up sensor at 1kHz for two seconds and asks for summaries, only a
+  # made up one can go faster than CRICKIT_RATE
+  import math
+  import tempfile
+  logging.basicConfig(level=logging.INFO)
+  def read(kind, port):
+    return 512 + 400 * math.sin(time.monotonic() * 2 * math.pi * port)
+  def reply(args, captured=None):
+    print(args[0], ["{:.3f}".format(a) if isinstance(a, float) else a for a in args[1:8]],
+      "..." if len(args) > 8 else "")
+  sensors = SensorLog(read, reply, tempfile.mkdtemp(), capacity=4096)
+  sensors.command("start", "analog", 1, 1000, 2)
+  time.sleep(2.2)
+  sensors.command("summary", "analog", 1)
+  sensors.command("summary", "analog", 1, 0.25)
+  sensors.command("series", "analog", 1, 1.0, 8)
+  sensors.command("list")
+  t, v = sensors.ring("analog/1").ordered()
+  start = time.perf_counter()
+  for i in range(100):
+    resample(t, v, 200)
+  print("resampling {} samples to 200 points: {:.3f}ms".format(len(t), (time.perf_counter() - start) * 10))
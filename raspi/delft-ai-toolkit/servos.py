@@ -0,0 +1,133 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# smooth servo moves for the CRICKIT.
+#
+# one /servo/ message starts a whole move: with type "varspeed" the servo
+# travels to the new angle at a speed set by varspeed (1-255, like the Arduino
+# VarSpeedServo library) following the easing, "immediate" or a varspeed of 0
+# jumps straight there. A thread works out the angles of all four servos
+# together with numpy at a fixed rate and only writes servos whose whole degree
+# angle changed, so servos that are not moving cost nothing on the I2C bus.
+
+import time
+import logging
+import threading
+
+import numpy as np
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+EASINGS = ["none", "easeIn", "easeOut", "easeInOut"]
+CURVE_POINTS = 256
+MAX_DEG_PER_SEC = 400.0 # varspeed 255, about what a hobby servo can do
+
+def make_curves(points=CURVE_POINTS):
+  # share of the move covered, one row per easing, sampled over 0..1 of the move's time
+  u = np.linspace(0.0, 1.0, points)
+  return np.stack([
+    u, # none
+    u * u, # easeIn
+    1 - (1 - u) ** 2, # easeOut
+    u * u * (3 - 2 * u) # easeInOut
+  ])
+
+CURVES = make_curves()
+
+def varspeed_to_deg_per_sec(varspeed):
+  # 0 means as fast as possible, i.e. jump
+  varspeed = max(0, min(int(varspeed), 255))
+  return varspeed / 255.0 * MAX_DEG_PER_SEC
+
+class ServoEngine(object):
+  def __init__(self, servos, rate=50, bus=None):
+    self.servos = servos # anything with an .angle, e.g. crickit.servo_1
+    self.bus = bus if bus != None else threading.Lock() # held for each write, shared with the rest of the I2C bus
+    self.period = 1.0 / rate
+    self.cond = threading.Condition()
+    n = len(servos)
+    # one entry per servo, all updated together each tick
+    self.start = np.zeros(n)
+    self.target = np.zeros(n)
+    self.t0 = np.zeros(n)
+    self.duration = np.zeros(n)
+    self.easing = np.zeros(n, dtype=int)
+    self.moving = np.zeros(n, dtype=bool)
+    self.written = np.full(n, np.nan) # last whole angle sent, nan until the first write
+    self.thread = threading.Thread(target=self.run, name="servos", daemon=True)
+    self.thread.start()
+
+  def move(self, index, angle, varspeed=0, easing="none"):
+    angle = float(max(0, min(angle, 180)))
+    speed = varspeed_to_deg_per_sec(varspeed)
+    with self.cond:
+      now = time.monotonic()
+      current = self.position(now)[index]
+      if np.isnan(current) or speed <= 0:
+        duration = 0.0 # position unknown or no speed, go straight there
+        current = angle
+      else:
+        duration = abs(angle - current) / speed
+      self.start[index] = current
+      self.target[index] = angle
+      self.t0[index] = now
+      self.duration[index] = duration
+      self.easing[index] = EASINGS.index(easing) if easing in EASINGS else 0
+      self.moving[index] = True
+      self.cond.notify()
+
+  def position(self, now):
+    # where every servo should be at now, the written angle for servos that are not moving
+    elapsed = now - self.t0
+    u = np.where(self.duration > 0, elapsed / np.maximum(self.duration, 1e-9), 1.0)
+    u = np.clip(u, 0.0, 1.0)
+    share = CURVES[self.easing, (u * (CURVE_POINTS - 1)).astype(int)]
+    return np.where(self.moving, self.start + (self.target - self.start) * share, self.written)
+
+  def run(self):
+    next_tick = time.monotonic()
+    while True:
+      with self.cond:
+        while not self.moving.any():
+          self.cond.wait()
+          next_tick = time.monotonic()
+        now = time.monotonic()
+        angles = np.rint(self.position(now))
+        # finished once the move's time is up
+        self.moving &= (now - self.t0) < self.duration
+        changed = np.flatnonzero((angles != self.written) & ~np.isnan(angles))
+        self.written[changed] = angles[changed]
+      if len(changed) > 0:
+        with self.bus, metrics.histogram("i2c_write_seconds", device="servo").time():
+          for i in changed:
+            self.servos[i].angle = int(angles[i])
+      next_tick += self.period
+      delay = next_tick - time.monotonic()
+      if delay > 0:
+        time.sleep(delay)
+      else:
+        next_tick = time.monotonic() # fell behind, skip the missed ticks
+
+if __name__ == '__main__':
+  # moves simulated servos and prints how many I2C writes each move took
+  from sim_crickit import SimServo
+  servos = [SimServo("servo_" + str(i + 1)) for i in range(4)]
+  engine = ServoEngine(servos)
+  for i in range(4):
+    engine.move(i, 0) # the first move jumps, the position is not known before
+  time.sleep(0.1)
+  for easing in EASINGS:
+    for s in servos:
+      s.clear()
+    start = time.monotonic()
+    engine.move(0, 180, 255, easing)
+    engine.move(1, 90, 127, easing)
+    time.sleep(1.0)
+    for s in servos[:3]:
+      took = s.writes[-1][0] - start if len(s.writes) > 0 else 0.0
+      print("{:<10} {} writes={:<3} angle={} took={:.2f}s".format(easing, s.name, len(s.writes), s.angle, took))
+    engine.move(0, 0)
+    engine.move(1, 0)
+    time.sleep(0.1)
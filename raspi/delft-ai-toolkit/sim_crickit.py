@@ -0,0 +1,134 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# stand-ins for the CRICKIT parts the toolkit drives, for trying things out
+# without a robot. Every write is kept with its time.monotonic() so timing
+# can be checked afterwards.
+
+import math
+import time
+import threading
+
+class SimMotor(object):
+  # behaves like crickit.dc_motor_N
+  def __init__(self, name="motor"):
+    self.name = name
+    self.lock = threading.Lock()
+    self.writes = [] # (time, throttle)
+    self._throttle = 0.0
+
+  @property
+  def throttle(self):
+    return self._throttle
+
+  @throttle.setter
+  def throttle(self, value):
+    with self.lock:
+      self._throttle = value
+      self.writes.append((time.monotonic(), value))
+
+  def clear(self):
+    with self.lock:
+      self.writes = []
+
+  def stopped_at(self):
+    # time of the last write that brought the motor to 0, or None if it is still running
+    with self.lock:
+      if self._throttle != 0 or len(self.writes) == 0:
+        return None
+      for i in range(len(self.writes) - 1, 0, -1):
+        if self.writes[i - 1][1] != 0:
+          return self.writes[i][0]
+      return self.writes[0][0]
+
+class SimServo(object):
+  # behaves like crickit.servo_N
+  def __init__(self, name="servo"):
+    self.name = name
+    self.lock = threading.Lock()
+    self.writes = [] # (time, angle)
+    self._angle = None
+
+  @property
+  def angle(self):
+    return self._angle
+
+  @angle.setter
+  def angle(self, value):
+    with self.lock:
+      self._angle = value
+      self.writes.append((time.monotonic(), value))
+
+  def clear(self):
+    with self.lock:
+      self.writes = []
+
+class SimPixels(object):
+  # behaves like a seesaw NeoPixel made with auto_write=False, counts the I2C transfers
+  def __init__(self, n):
+    self.n = n
+    self.buffer = [(0, 0, 0, 0)] * n # what was sent to the seesaw
+    self.lit = list(self.buffer) # what the LEDs show
+    self.transfers = 0
+    self.shows = 0
+
+  def __len__(self):
+    return self.n
+
+  def __setitem__(self, index, color):
+    self.buffer[index] = tuple(color)
+    self.transfers += 1
+
+  def __getitem__(self, index):
+    return self.buffer[index]
+
+  def fill(self, color):
+    self.buffer = [tuple(color)] * self.n
+    self.transfers += 1
+
+  def show(self):
+    self.lit = list(self.buffer)
+    self.shows += 1
+
+  def clear(self):
+    self.transfers = 0
+    self.shows = 0
+
+class SimSeesaw(object):
+  # analog inputs step along a sine wave, a different one on each pin, so a
+  # replayed session reads the same values in the same order
+  def __init__(self):
+    self.reads = {} # pin -> reads so far
+
+  def analog_read(self, pin):
+    n = self.reads.get(pin, 0)
+    self.reads[pin] = n + 1
+    return int(512 + 400 * math.sin(n * 0.3 + pin))
+
+class SimTouch(object):
+  # touched for one second out of every four, each pad a second later than the last
+  def __init__(self, index):
+    self.index = index
+    self.start = time.monotonic()
+
+  @property
+  def value(self):
+    return int(time.monotonic() - self.start - self.index) % 4 == 0
+
+class SimCrickit(object):
+  # stands in for adafruit_crickit.crickit
+  def __init__(self):
+    self.dc_motor_1 = SimMotor("motor_1")
+    self.dc_motor_2 = SimMotor("motor_2")
+    self.servo_1 = SimServo("servo_1")
+    self.servo_2 = SimServo("servo_2")
+    self.servo_3 = SimServo("servo_3")
+    self.servo_4 = SimServo("servo_4")
+    self.touch_1 = SimTouch(1)
+    self.touch_2 = SimTouch(2)
+    self.touch_3 = SimTouch(3)
+    self.touch_4 = SimTouch(4)
+    self.seesaw = SimSeesaw()
+    # the CRICKIT's signal pin numbers
+    self.SIGNAL1, self.SIGNAL2, self.SIGNAL3, self.SIGNAL4 = 2, 3, 40, 41
+    self.SIGNAL5, self.SIGNAL6, self.SIGNAL7, self.SIGNAL8 = 11, 10, 9, 8
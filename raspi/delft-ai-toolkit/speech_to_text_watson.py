@@ -8,16 +8,18 @@
 
 import time
 import sys
+import logging
 
 import pyaudio
 
 from ibm_watson import SpeechToTextV1
 from ibm_watson.websocket import RecognizeCallback, AudioSource
-from threading import Thread
+from threading import Thread, Event, Lock
 from ibm_cloud_sdk_core.authenticators import IAMAuthenticator
 
-import queue
-from queue import Empty
+import metrics
+
+log = logging.getLogger(__name__)
 
 try:
     from Queue import Queue, Full
@@ -38,32 +40,31 @@ class stt_watson(object):
 
     # define callback for the speech to text service
     class MyRecognizeCallback(RecognizeCallback):
-        def __init__(self, q):
+        def __init__(self, stt):
             RecognizeCallback.__init__(self)
             self.transcript = "no transcript"
-            self.q = q
+            self.stt = stt
             self.keep_thread_alive = True
 
         def on_transcription(self, transcript):
             pass
 
         def on_connected(self):
-            print('Watson Connection was successful')
+            log.info('Watson Connection was successful')
             pass
 
         def on_error(self, error):
-          print('Watson Error received: {}'.format(error))
-          self.q.put((True, self.transcript))
+          log.error('Watson Error received: %s', error)
+          self.stt.deliver(True, self.transcript)
           #self.keep_thread_alive = False
 
         def on_inactivity_timeout(self, error):
-          print('Watson Inactivity timeout: {}'.format(error))
-          #self.q.put((True, self.transcript))
+          log.warning('Watson Inactivity timeout: %s', error)
           #self.keep_thread_alive = False
           #thread.exit()
 
         def on_listening(self):
-          print('Watson STT is listening...')
+          log.debug('Watson STT is listening...')
 
         def on_hypothesis(self, hypothesis):
           # print("hypo: " + hypothesis)
@@ -73,19 +74,36 @@ class stt_watson(object):
           result = data['results'][0]['alternatives'][0]['transcript']
           final = data['results'][0]['final']
           self.transcript = result
-          self.q.put((final, result))
+          self.stt.deliver(final, result)
           if (final):
-            print("final: " + result)
+            log.info("final: %s", result)
           else:
-            print("interim: " + result)
+            log.debug("interim: %s", result)
 
         def on_close(self):
-          print("Connection closed by Watson")
-          self.q.put((False, "process shut down"))
+          log.info("Connection closed by Watson")
+          self.stt.deliver(False, "process shut down")
           self.keep_thread_alive = False
           #thread.exit()
 
-
+    # rate limits and de-duplicates the interim hypotheses forwarded to Unity
+    class InterimFilter(object):
+        def __init__(self, send, min_interval):
+            self.send = send
+            self.min_interval = min_interval
+            self.last_text = ""
+            self.last_time = 0.0
+
+        def __call__(self, text):
+            text = text.strip()
+            if text == "" or text == self.last_text:
+                return
+            now = time.monotonic()
+            if now - self.last_time < self.min_interval:
+                return # the next hypothesis or the final will catch up
+            self.last_text = text
+            self.last_time = now
+            self.send(text)
 
 
     def __init__(self, iamkey, url, lang, timeout):
@@ -100,7 +118,7 @@ class stt_watson(object):
         # try: self.thread_running
         # except NameError: self.thread_running = None
 
-        print("INIT STARTED")
+        log.debug("INIT STARTED")
         # print("thread_running: " + thread_running)
         # if hasattr(self,'thread_running'):
         #     print("thread_running: " + thread_running)
@@ -132,11 +150,15 @@ class stt_watson(object):
         # Buffer to store audio
         self.q_aud = Queue(maxsize=int(round(self.BUF_MAX_SIZE / self.CHUNK)))
 
-        # queue for the websocket process to send to main
-        self.q_soc= Queue()
-
-        # queue to send data from main to websoc thread
-        self.q_proc= Queue()
+        # the websocket thread hands results to transcribe() through these
+        self.result_lock = Lock()
+        self.final_e = Event()
+        self.final_e.set() # set whenever no transcribe() is waiting
+        self.transcript = "no transcription collected"
+        self.got_final = False
+        self.final_at = None # time.monotonic() the last final transcript arrived
+        self.cancel_requested = False
+        self.on_interim = None
         authenticator = IAMAuthenticator(self.iamkey)
         # if url == "" or url == "default":
         #   url = "https://stream.watsonplatform.net/speech-to-text/api"
@@ -166,14 +188,14 @@ class stt_watson(object):
         #timeout = -1 # go forever
         # if hasattr(self,'thread_running'):
         #     if not self.thread_running:
-        print("spawn thread")
-        self.recognize_thread = Thread(target=self.recog_thread, args=(self.q_soc,self.q_proc, self.audio, self.audio_source, self.stream, langnew, self.timeout))
+        log.debug("spawn thread")
+        self.recognize_thread = Thread(target=self.recog_thread, args=(self.audio, self.audio_source, self.stream, langnew, self.timeout))
         #recognize_thread.setDaemon(True)
         # self.test_thread = Thread(target=self.test, args=("a"))
         self.recognize_thread.start()
         # self.test_thread.start()
         self.thread_running = True
-        print("finished spawn thread")
+        log.debug("finished spawn thread")
         # self.keep_thread_alive = True
 
     def restart(self,langnew):
@@ -205,11 +227,46 @@ class stt_watson(object):
         )
 
         lang = self.get_lang(langnew)
-        self.recognize_thread = Thread(target=self.recog_thread, args=(self.q_soc,self.q_proc, self.audio, self.audio_source, self.stream, lang, self.timeout))
+        self.recognize_thread = Thread(target=self.recog_thread, args=(self.audio, self.audio_source, self.stream, lang, self.timeout))
         #recognize_thread.setDaemon(True)
         self.recognize_thread.start()
         self.thread_running = True
 
+    # called from the websocket thread for every interim, final or shutdown result
+    def deliver(self, final, transcript):
+        with self.result_lock:
+            if transcript == "process shut down":
+                self.transcript = "no transcription"
+                self.thread_running = False
+                self.final_e.set()
+                return
+            if self.final_e.is_set():
+                return # nobody is waiting for this result
+            self.transcript = transcript
+            on_interim = self.on_interim
+            if final:
+                log.debug("got a final")
+                self.got_final = True
+                self.final_at = time.monotonic()
+                self.final_e.set()
+        if not final and on_interim != None:
+            on_interim(transcript)
+
+    # makes the running (or the next) transcribe() return None straight away
+    def cancel(self):
+        with self.result_lock:
+            self.cancel_requested = True
+            self.final_e.set()
+
+    def clear_cancel(self):
+        with self.result_lock:
+            self.cancel_requested = False
+
+    def stop_listening(self):
+        if not self.audio_paused:
+            self.stream.stop_stream()
+            self.audio_paused = True
+
     # define callback for pyaudio to store the recording in queue
     def pyaudio_callback(self, in_data, frame_count, time_info, status):
         try:
@@ -219,19 +276,18 @@ class stt_watson(object):
         return (None, pyaudio.paContinue)
 
     # this function will initiate the recognize service and pass in the AudioSource
-    def recog_thread(self, q_soc, q_proc, audio, audio_source, stream, lang, timeout):
-        print("starting recognize thread")
-        print("lang: " + lang)
+    def recog_thread(self, audio, audio_source, stream, lang, timeout):
+        log.info("starting recognize thread, lang: %s", lang)
         audio_source.restart_recording()
         stream.start_stream()
         self.audio_paused = False
         self.streaming = True
 
-        mycallback = self.MyRecognizeCallback(q_soc)
+        mycallback = self.MyRecognizeCallback(self)
         #timeout = int(timeout + 2)
 
         while mycallback.keep_thread_alive:
-            print("starting websocket connection...")
+            log.info("starting websocket connection...")
             try:
                 self.speech_to_text.recognize_using_websocket(audio=audio_source,
                                                          content_type='audio/l16; rate=44100',
@@ -241,10 +297,10 @@ class stt_watson(object):
                                                          interim_results=True,
                                                          inactivity_timeout=-1)
             except:
-                print("Waston disconnected")
-            print("keep: ",mycallback.keep_thread_alive)
+                log.warning("Waston disconnected")
+            log.debug("keep: %s", mycallback.keep_thread_alive)
         # shut it all down
-        print("recognize thread shutting down")
+        log.info("recognize thread shutting down")
         # stream.stop_stream()
         # stream.close()
         # audio.terminate()
@@ -270,59 +326,54 @@ class stt_watson(object):
       ###############################################
       #### Initiate recognition ########
       ###############################################
-    def transcribe(self, lang, time_limit):
+    def transcribe(self, lang, time_limit, on_interim=None, keep_streaming=False):
+        # on_interim is called with each interim hypothesis while we wait for the final
+        # returns None if the request was cancelled, keep_streaming leaves the
+        # microphone open for back to back utterances
 
         if self.audio_paused:
-            print("trans start stream")
+            log.debug("trans start stream")
             self.stream.start_stream()
             self.audio_paused = False
             self.thread_running = True
 
         if lang != self.lang or not self.thread_running:
-            print("Current language is: " + self.lang + " new lang is: " + lang)
-            print("restarting this process to change languages")
+            log.info("Current language is: %s new lang is: %s", self.lang, lang)
+            log.info("restarting this process to change languages")
 
             self.restart(lang)
 
-        transcript = "no transcription collected"
-        print("starting transcription...")
+        with self.result_lock:
+            self.transcript = "no transcription collected"
+            self.got_final = False
+            self.on_interim = on_interim
+            if not self.cancel_requested:
+                self.final_e.clear()
+        log.debug("starting transcription...")
+        start = time.monotonic()
         try:
-          # recognize_thread = Thread(target=self.recognize_using_weboscket, args=(self.q,self.audio_source, lang, time_limit))
-          # #recognize_thread.setDaemon(True)
-          # recognize_thread.start()
-          #self.recognize_using_weboscket(q,self.audio_source, lang, timeout)
-          timeout = time.time() + time_limit
-          print(time.time())
-          #transcript = "no transcription"
-          status = False
-          while status == False and time.time() < timeout:
-            try:
-              message = self.q_soc.get(True,2)
-              if message != None:
-                print("the message:",message[0],message[1])
-                if message[0]:
-                    status = True
-                    print("got a final")
-                transcript = message[1]
-                if transcript == "process shut down":
-                    transcript = "no transcription"
-                    self.thread_running = False
-            except Empty:
-            #except:
-              pass
-            time.sleep(0.001)
-          print(timeout,"time is up...")
+          # block until the websocket thread delivers a final, we are cancelled or the time is up
+          if not self.final_e.wait(time_limit):
+            log.debug("%s time is up...", time_limit)
         except BaseException as e:
-        #except:
-          print('Error: ' + str(e))
-          print("all done...")
+          log.error('Error: %s', e)
         finally:
-          print("finishing transcribe...")
-          self.stream.stop_stream()
-          self.audio_paused = True
+          log.debug("finishing transcribe...")
+          with self.result_lock:
+            self.final_e.set() # stop accepting results for this request
+            self.on_interim = None
+            transcript = self.transcript
+            if self.cancel_requested:
+              self.cancel_requested = False
+              transcript = None
+            elif self.got_final:
+              metrics.histogram("stt_time_to_final_seconds").observe(time.monotonic() - start)
+            else:
+              metrics.counter("stt_timeouts").inc()
+          if not keep_streaming:
+            self.stop_listening()
           #self.stream.close()
           # self.audio.terminate()
           # self.audio_source.completed_recording()
 
         return transcript
-        #sys.exit()
@@ -0,0 +1,58 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# keeps track of how long each subsystem takes to come up at startup.
+# Worker processes report phases through a multiprocessing queue as
+# (subsystem, phase, start, end) tuples using time.monotonic(), which is
+# shared by all processes on the Pi, so the bridge can line them up.
+
+import time
+
+# the phase name a subsystem reports when it is ready to take commands
+READY = "ready"
+
+def report(q, subsystem, phase, start):
+  # send one finished phase to the bridge
+  q.put((subsystem, phase, start, time.monotonic()))
+
+class StartupReport(object):
+  def __init__(self, subsystems, t0):
+    self.t0 = t0 # monotonic time the bridge process started
+    self.subsystems = list(subsystems)
+    self.phases = [] # (subsystem, phase, start, end)
+    self.ready = {} # subsystem -> seconds after t0 it became ready
+
+  def add(self, subsystem, phase, start, end):
+    self.phases.append((subsystem, phase, start, end))
+    if phase == READY:
+      self.ready[subsystem] = end - self.t0
+
+  def is_ready(self, subsystem):
+    return subsystem in self.ready
+
+  def all_ready(self):
+    for subsystem in self.subsystems:
+      if subsystem not in self.ready:
+        return False
+    return True
+
+  def status(self):
+    # short one line summary, e.g. "control:0.02 hardware:0.61 recognize:loading"
+    items = []
+    for subsystem in self.subsystems:
+      if subsystem in self.ready:
+        items.append("{}:{:.2f}".format(subsystem, self.ready[subsystem]))
+      else:
+        items.append(subsystem + ":loading")
+    return " ".join(items)
+
+  def breakdown(self):
+    # table of every phase, in the order they started, relative to t0
+    lines = ["startup breakdown (seconds since launch)",
+      "{:<12} {:<14} {:>8} {:>8} {:>8}".format("subsystem", "phase", "start", "end", "took")]
+    for subsystem, phase, start, end in sorted(self.phases, key=lambda p: p[2]):
+      lines.append("{:<12} {:<14} {:>8.3f} {:>8.3f} {:>8.3f}".format(
+        subsystem, phase, start - self.t0, end - self.t0, end - start))
+    if self.all_ready():
+      lines.append("all subsystems ready after {:.3f}".format(max(self.ready.values())))
+    return "\n".join(lines)
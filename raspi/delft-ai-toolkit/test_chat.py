@@ -0,0 +1,96 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# the chat pipeline with the stub speech engines, run with python3 -m pytest
+
+import time
+import threading
+
+import chat
+
+class Listener(chat.StubListener):
+  # remembers when each listen started
+  def __init__(self, lines):
+    chat.StubListener.__init__(self, lines, words_per_second=100.0)
+    self.started = []
+
+  def listen(self):
+    self.started.append(time.monotonic())
+    return chat.StubListener.listen(self)
+
+class Speaker(chat.StubSpeaker):
+  # remembers what it played
+  def __init__(self, **kwargs):
+    chat.StubSpeaker.__init__(self, **kwargs)
+    self.played = []
+
+  def play(self, seconds):
+    self.played.append(seconds)
+    chat.StubSpeaker.play(self, seconds)
+
+def slow(text, history):
+  # three sentences, a while apart
+  for i in range(3):
+    time.sleep(0.1)
+    yield "Sentence {}. ".format(i + 1)
+
+def test_sentences_from_pieces():
+  pieces = ["Hel", "lo there. How", " are you? Fine", "! And the rest"]
+  assert list(chat.sentences(pieces)) == ["Hello there.", "How are you?", "Fine!", "And the rest"]
+  assert list(chat.sentences("One. Two.")) == ["One.", "Two."]
+
+def test_stages_overlap():
+  turns = []
+  speaker = Speaker(synthesize_seconds=0.05, per_char=0.0, chars_per_second=100.0)
+  pipeline = chat.ChatPipeline(Listener(["hello"]), slow, speaker, turns.append)
+  assert pipeline.run() == 1
+  turn = turns[0]
+  assert turn.said == ["Sentence 1.", "Sentence 2.", "Sentence 3."]
+  assert len(speaker.played) == 3
+  # the first sentence was playing before the responder had finished
+  assert turn.times["sound"] < turn.heard_at + turn.busy["respond"]
+  # and the whole turn took less than the stages one after another
+  assert turn.after("played") < sum(turn.busy.values())
+  first_sentence, first_audio, first_sound, done, sequential = turn.timing()
+  assert 0 <= first_sentence <= first_audio <= first_sound <= done
+
+def test_listens_again_only_after_playing():
+  turns = []
+  listener = Listener(["one", "two"])
+  pipeline = chat.ChatPipeline(listener, chat.echo, Speaker(chars_per_second=100.0), turns.append)
+  assert pipeline.run() == 2
+  assert all(turn.done.is_set() for turn in turns)
+  # the microphone opened for the second turn once the first one had been played
+  assert listener.started[1] >= turns[0].times["played"]
+
+def test_history_goes_to_the_responder():
+  seen = []
+  def respond(text, history):
+    seen.append(list(history))
+    return "ok."
+  pipeline = chat.ChatPipeline(Listener(["a", "b", "c"]), respond, Speaker(chars_per_second=1000.0), lambda turn: None, history=1)
+  pipeline.run()
+  assert seen == [[], [("a", "ok.")], [("b", "ok.")]]
+
+def test_responder_failure_still_ends_the_turn():
+  turns = []
+  def broken(text, history):
+    yield "Fine so far. "
+    raise RuntimeError("no answer")
+  pipeline = chat.ChatPipeline(Listener(["hi", "again"]), broken, Speaker(chars_per_second=1000.0), turns.append)
+  assert pipeline.run() == 2
+  assert [turn.said for turn in turns] == [["Fine so far."], ["Fine so far."]]
+
+def test_stop_while_speaking():
+  turns = []
+  speaker = Speaker(synthesize_seconds=0.0, per_char=0.0, chars_per_second=5.0) # a couple of seconds a sentence
+  pipeline = chat.ChatPipeline(Listener(["hello", "never heard"]), slow, speaker, turns.append)
+  stopper = threading.Timer(0.5, pipeline.stop)
+  stopper.start()
+  start = time.monotonic()
+  pipeline.run()
+  stopper.join()
+  # the sentence being played was cut short and nothing after it was played
+  assert time.monotonic() - start < 1.5
+  assert len(speaker.played) == 1
+  assert len(turns) == 1 and turns[0].done.is_set()
@@ -0,0 +1,56 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# filtering and suppression of single shot detector output, run with python3 -m pytest
+
+import numpy as np
+
+import detection
+
+LABELS = ["background", "cat", "dog"]
+
+def output(*rows):
+  # SSD output of rows of [class, score, left, top, right, bottom]
+  return np.array([[0.0] + list(row) for row in rows], dtype=np.float32).reshape(1, 1, len(rows), 7)
+
+def test_background_and_low_scores_are_dropped():
+  found = detection.decode(output(
+    [0, 0.99, 0.1, 0.1, 0.5, 0.5], # background
+    [1, 0.30, 0.1, 0.1, 0.5, 0.5], # below the threshold
+    [2, 0.80, 0.6, 0.6, 0.9, 0.9]), LABELS, confidence=0.4)
+  assert [(label, round(score, 2)) for label, score, box in found] == [("dog", 0.8)]
+
+def test_boxes_are_clipped_and_inverted_ones_dropped():
+  found = detection.decode(output(
+    [1, 0.9, -0.2, 0.1, 0.5, 1.3],
+    [2, 0.8, 0.7, 0.2, 0.3, 0.6], # right of its right edge
+    [2, 0.7, 0.2, 1.2, 0.6, 1.5]), LABELS) # all of it below the picture
+  assert len(found) == 1
+  label, score, box = found[0]
+  assert label == "cat"
+  assert np.allclose(box, (0.0, 0.1, 0.5, 1.0))
+
+def test_an_overlapping_weaker_box_of_the_same_class_is_suppressed():
+  found = detection.decode(output(
+    [1, 0.6, 0.12, 0.1, 0.52, 0.5],
+    [1, 0.9, 0.1, 0.1, 0.5, 0.5],
+    [1, 0.7, 0.6, 0.6, 0.9, 0.9]), LABELS) # a second cat, somewhere else
+  assert [round(score, 2) for label, score, box in found] == [0.9, 0.7]
+
+def test_the_same_box_of_another_class_is_kept():
+  found = detection.decode(output(
+    [1, 0.9, 0.1, 0.1, 0.5, 0.5],
+    [2, 0.6, 0.1, 0.1, 0.5, 0.5]), LABELS)
+  assert [label for label, score, box in found] == ["cat", "dog"]
+
+def test_nms_threshold():
+  boxes = np.array([[0.0, 0.0, 1.0, 1.0], [0.0, 0.0, 1.0, 0.6]])
+  scores = np.array([0.9, 0.8])
+  classes = np.array([1, 1])
+  # the two boxes overlap by 0.6
+  assert detection.nms(boxes, scores, classes, 0.5).tolist() == [0]
+  assert detection.nms(boxes, scores, classes, 0.7).tolist() == [0, 1]
+
+def test_nothing_found():
+  assert detection.decode(output([1, 0.1, 0.1, 0.1, 0.5, 0.5]), LABELS) == []
+  assert detection.osc_args([], 7) == ["", 7, 0]
@@ -0,0 +1,114 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# the frame bus fed by the synthetic camera, run with python3 -m pytest
+
+import os
+
+import numpy as np
+import pytest
+from multiprocessing import shared_memory
+
+import frame_bus
+
+W, H = 64, 48
+
+@pytest.fixture
+def name(tmp_path):
+  # a bus of its own for each test, so a run never meets a bridge's
+  return frame_bus.bus_name("test_{}_{}".format(os.getpid(), tmp_path.name))
+
+@pytest.fixture
+def bus(name):
+  bus = frame_bus.FrameBus.create(W, H, name=name)
+  yield bus
+  bus.close()
+
+def fill(bus, source, frames):
+  frame_bus.capture_loop(bus, source, 0, frames=frames)
+
+def expected(frames):
+  # what the synthetic camera's last frame of frames looks like
+  source = frame_bus.SyntheticSource(W, H)
+  image = np.zeros((H, W, 3), dtype=np.uint8)
+  for i in range(frames):
+    source.capture(image)
+  return image
+
+def test_head_counts_the_frames(bus):
+  assert bus.head() == 0
+  assert bus.latest() == None
+  assert bus.read() == (None, 0.0)
+  source = frame_bus.SyntheticSource(W, H)
+  fill(bus, source, 3)
+  assert bus.head() == 3
+  fill(bus, source, 7)
+  assert bus.head() == 10
+
+def test_latest_is_the_newest_frame_read_only(bus):
+  fill(bus, frame_bus.SyntheticSource(W, H), 6)
+  frame = bus.latest()
+  assert frame.number == 6
+  assert np.array_equal(frame.image, expected(6))
+  assert not frame.image.flags.writeable
+  with pytest.raises(ValueError):
+    frame.image[0, 0] = 0
+
+def test_a_view_goes_stale_once_its_slot_is_reused(bus):
+  source = frame_bus.SyntheticSource(W, H)
+  fill(bus, source, 1)
+  frame = bus.latest()
+  fill(bus, source, bus.slots - 1)
+  assert frame.valid() # good for slots - 1 more frames
+  fill(bus, source, 1)
+  assert not frame.valid()
+
+def test_read_is_a_copy(bus):
+  source = frame_bus.SyntheticSource(W, H)
+  fill(bus, source, 2)
+  image, captured = bus.read()
+  assert captured == bus.latest().captured
+  assert np.array_equal(image, expected(2))
+  fill(bus, source, bus.slots)
+  # every slot has been written since, the copy is still frame 2
+  assert np.array_equal(image, expected(2))
+  out = np.empty_like(image)
+  assert bus.read(out)[0] is out
+
+def left_behind(name, owner):
+  # a bus's shared memory with owner as its creator, as a bridge leaves it
+  other = frame_bus.FrameBus.create(W, H, name=name)
+  other.header[6] = owner
+  other.owner = False # closing it leaves it behind
+  frame_bus.untrack(other.shm)
+  return other
+
+def dead_pid():
+  pid = os.fork()
+  if pid == 0:
+    os._exit(0)
+  os.waitpid(pid, 0)
+  return pid
+
+def test_create_takes_over_a_bus_whose_owner_is_gone(name):
+  old = left_behind(name, dead_pid())
+  bus = frame_bus.FrameBus.create(W, H, name=name)
+  try:
+    assert int(bus.header[6]) == os.getpid()
+    assert bus.head() == 0
+  finally:
+    old.close()
+    bus.close()
+
+def test_create_leaves_a_running_bridges_bus_alone(name):
+  old = left_behind(name, os.getppid())
+  try:
+    with pytest.raises(FileExistsError):
+      frame_bus.FrameBus.create(W, H, name=name)
+    # still there for its owner
+    again = frame_bus.FrameBus.attach(name)
+    assert int(again.header[6]) == os.getppid()
+    again.close()
+  finally:
+    old.close()
+    shared_memory.SharedMemory(name=name).unlink()
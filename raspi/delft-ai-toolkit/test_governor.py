@@ -0,0 +1,58 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# the governor on made up readings, run with python3 -m pytest
+
+import governor
+
+def make(temperatures, hold=4.0, throttled=False, load=0.5):
+  applied = {}
+  lines = []
+  def apply(name, value):
+    applied[name] = value
+  g = governor.Governor(governor.FakeSource(temperatures, throttled, load), apply, lines.append, hold=hold)
+  return g, applied, lines
+
+def run(g, steps, interval=2.0, start=0):
+  return [g.step(now=(start + i) * interval) for i in range(steps)]
+
+def test_levels_rise_with_the_temperature():
+  g, applied, lines = make([55, 71, 78, 83])
+  assert run(g, 4) == [0, 1, 2, 3]
+  assert len(lines) == 3
+  limits = g.limits
+  assert governor.recognize_interval() == limits.recognize_intervals[3]
+  assert governor.recognize_model() == limits.models[3]
+  assert applied == {"sensor_scale": limits.sensor_scales[3], "led_fps": limits.led_fps[3]}
+
+def test_jumps_straight_to_the_level_it_needs():
+  g, applied, lines = make([55, 84])
+  assert run(g, 2) == [0, 3]
+  assert len(lines) == 1
+
+def test_a_low_clock_alone_changes_nothing():
+  g, applied, lines = make([45])
+  assert g.wanted(governor.Reading(45.0, False, 0.1)) == (0, "")
+  assert g.wanted(governor.Reading(45.0, True, 0.1)) == (2, "throttled")
+  assert g.wanted(governor.Reading(45.0, None, 2.0)) == (1, "load")
+
+def test_hysteresis_on_the_way_down_to_normal():
+  # just under the 70C warm threshold is not cool enough to leave warm
+  g, applied, lines = make([71] + [69.5] * 20)
+  assert run(g, 21) == [1] * 21
+
+def test_holds_before_stepping_down():
+  # 66C is more than 3C under the warm threshold, it has to stay there for hold seconds
+  g, applied, lines = make([71, 66, 66, 66, 66], hold=4.0)
+  assert run(g, 5) == [1, 1, 1, 0, 0]
+  assert applied["sensor_scale"] == 1.0
+  assert governor.recognize_interval() == 0.0
+  assert governor.recognize_model() == ""
+
+def test_a_warm_spell_restarts_the_hold():
+  g, applied, lines = make([71, 66, 66, 69, 66, 66, 66], hold=4.0)
+  assert run(g, 7) == [1, 1, 1, 1, 1, 1, 0]
+
+def test_steps_down_one_level_at_a_time_as_it_cools():
+  g, applied, lines = make([83, 78, 78, 78, 72, 72, 72], hold=4.0)
+  assert run(g, 7) == [3, 3, 3, 2, 2, 2, 1]
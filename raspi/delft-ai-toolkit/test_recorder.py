@@ -0,0 +1,72 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# session recordings and the simulated robot they are replayed against, run with python3 -m pytest
+
+import time
+
+from pythonosc import osc_message_builder
+
+import recorder
+import replay
+import sim_crickit
+
+def message(address, *args):
+  builder = osc_message_builder.OscMessageBuilder(address=address)
+  for arg in args:
+    builder.add_arg(arg)
+  return builder.build().dgram
+
+def test_round_trip(tmp_path):
+  path = str(tmp_path / "sessions" / "s.dtk")
+  rec = recorder.Recorder(path, flush_interval=10.0, meta={"robot_id": "ding1"})
+  sent = [(recorder.INBOUND, message("/move/", "forward", 1.0, 0.5, "none")),
+    (recorder.OUTBOUND, message("/num/analogin/1/", 512.0, 100, 999)),
+    (recorder.INBOUND, message("/recognize/", "once", "squeezenet"))]
+  for direction, dgram in sent:
+    rec.record(direction, dgram)
+  rec.close() # well before the writer's next flush, close writes them out
+  header, records = recorder.read(path)
+  assert header["robot_id"] == "ding1"
+  assert [(direction, dgram) for direction, at, dgram in records] == sent
+  times = [at for direction, at, dgram in records]
+  assert times == sorted(times) and times[0] >= 0
+  assert replay.parse(records[1][2]) == ("/num/analogin/1/", (512.0, 100, 999))
+
+def test_close_twice_and_record_after(tmp_path):
+  path = str(tmp_path / "s.dtk")
+  rec = recorder.Recorder(path, flush_interval=0.01)
+  rec.record(recorder.INBOUND, message("/ready/"))
+  time.sleep(0.05)
+  rec.close()
+  rec.close()
+  rec.record(recorder.INBOUND, message("/ready/")) # too late, but harmless
+  assert len(recorder.read(path)[1]) == 1
+
+def test_a_cut_off_last_record_is_skipped(tmp_path):
+  path = str(tmp_path / "s.dtk")
+  rec = recorder.Recorder(path)
+  rec.record(recorder.INBOUND, message("/ready/"))
+  rec.record(recorder.INBOUND, message("/stats/"))
+  rec.close()
+  with open(path, "rb") as f:
+    data = f.read()
+  with open(path, "wb") as f:
+    f.write(data[:-3]) # the bridge died mid write
+  header, records = recorder.read(path)
+  assert [replay.parse(dgram)[0] for direction, at, dgram in records] == ["/ready/"]
+
+def test_stops_at_max_bytes(tmp_path):
+  path = str(tmp_path / "s.dtk")
+  rec = recorder.Recorder(path, max_bytes=200)
+  for i in range(20):
+    rec.record(recorder.OUTBOUND, message("/num/touch/1/", 1023, 100, 999))
+  rec.close()
+  assert rec.full
+  assert len(recorder.read(path)[1]) == 0
+
+def test_simulated_sensors_repeat_in_a_replay():
+  first, second = sim_crickit.SimSeesaw(), sim_crickit.SimSeesaw()
+  reads = [(pin, first.analog_read(pin)) for pin in (2, 3, 2, 2, 3)]
+  assert reads == [(pin, second.analog_read(pin)) for pin in (2, 3, 2, 2, 3)]
+  assert all(0 <= value <= 1023 for pin, value in reads)
@@ -0,0 +1,75 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# the scene gate on made up frame sequences, run with python3 -m pytest
+
+import numpy as np
+
+import scene_gate
+
+rng = np.random.default_rng(1)
+# 320x240 of 40 pixel blocks, something for the thumbnails to see
+base = rng.integers(40, 200, (240, 320, 3)).astype(np.float32)
+base = np.repeat(np.repeat(base[::40, ::40], 40, axis=0), 40, axis=1)[:240, :320]
+
+def noisy(frame):
+  return np.clip(frame + rng.normal(0, 6, frame.shape), 0, 255).astype(np.uint8)
+
+def moving(i):
+  frame = base.copy()
+  x = 10 + i * 10
+  frame[100:160, x:x + 60] = 255
+  return noisy(frame)
+
+def inferred(frames, gate=None, key="squeezenet", interval=0.1):
+  # the frames that had to be recognized, ten a second unless told otherwise
+  gate = gate if gate != None else scene_gate.SceneGate()
+  done = []
+  for i, frame in enumerate(frames):
+    now = i * interval
+    if gate.check(frame, key, now) == None:
+      done.append(i)
+      gate.store("result " + str(i), key, now)
+  return done
+
+def test_a_still_scene_is_recognized_once():
+  assert inferred([noisy(base) for i in range(30)]) == [0]
+
+def test_flickering_exposure_is_skipped():
+  assert inferred([noisy(base * (1.0 + 0.04 * (i % 3))) for i in range(30)]) == [0]
+
+def test_a_moving_square_is_recognized_again():
+  # 10 pixels a frame is too little to notice, 20 is not
+  done = inferred([moving(i) for i in range(25)])
+  assert done[0] == 0 and done[-1] >= 23
+  assert max(np.diff(done)) <= 2
+
+def test_a_hard_cut_is_recognized_again():
+  frames = [noisy(base) for i in range(15)] + [noisy(255 - base) for i in range(15)]
+  assert inferred(frames) == [0, 15]
+
+def test_the_cached_result_comes_back():
+  gate = scene_gate.SceneGate()
+  assert gate.check(noisy(base), "squeezenet", 0.0) == None
+  gate.store("a cat", "squeezenet", 0.0)
+  assert gate.check(noisy(base), "squeezenet", 0.1) == "a cat"
+  assert gate.skip_rate() == 0.5
+
+def test_results_expire_after_max_age():
+  gate = scene_gate.SceneGate(max_age=1.0)
+  # a frame a second and a half, each one is too old to use
+  assert inferred([noisy(base) for i in range(5)], gate, interval=0.6) == [0, 2, 4]
+
+def test_another_model_is_recognized_again():
+  gate = scene_gate.SceneGate()
+  frame = noisy(base)
+  assert gate.check(frame, "squeezenet", 0.0) == None
+  gate.store("a cat", "squeezenet", 0.0)
+  assert gate.check(frame, "alexnet", 0.1) == None
+  gate.store("a dog", "alexnet", 0.1)
+  assert gate.check(frame, "alexnet", 0.2) == "a dog"
+
+def test_threshold_0_never_skips():
+  gate = scene_gate.SceneGate(threshold=0.0)
+  assert inferred([noisy(base) for i in range(10)], gate) == list(range(10))
+  assert gate.skipped == 0
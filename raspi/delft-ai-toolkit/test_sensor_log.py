@@ -0,0 +1,86 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# the sensor rings and their summaries, run with python3 -m pytest
+
+import numpy as np
+
+import sensor_log
+
+def ring(tmp_path, capacity=8):
+  return sensor_log.SensorRing(str(tmp_path / "analog-1.ring"), capacity)
+
+def test_resample_means_each_bucket():
+  t = np.array([0.0, 0.1, 0.2, 0.3, 0.4, 1.0])
+  v = np.array([1.0, 3.0, 5.0, 7.0, 9.0, 11.0])
+  start, step, values = sensor_log.resample(t, v, 2)
+  assert (start, step) == (0.0, 0.5)
+  assert values == [5.0, 11.0]
+
+def test_resample_repeats_the_bucket_before_an_empty_one():
+  t = np.array([0.0, 0.1, 0.9, 1.0])
+  v = np.array([2.0, 4.0, 6.0, 8.0])
+  start, step, values = sensor_log.resample(t, v, 4)
+  assert values == [3.0, 3.0, 3.0, 7.0]
+
+def test_resample_nothing():
+  assert sensor_log.resample(np.array([]), np.array([]), 10) == (0.0, 0.0, [])
+
+def test_window_keeps_the_last_seconds(tmp_path):
+  r = ring(tmp_path)
+  for i in range(6):
+    r.append(10.0 + i, float(i))
+  t, v = r.window(2.0)
+  assert t.tolist() == [13.0, 14.0, 15.0]
+  assert v.tolist() == [3.0, 4.0, 5.0]
+  assert len(r.window(0.0)[0]) == 6
+  assert sensor_log.summary(t, v) == (3, 3.0, 5.0, 4.0)
+
+def test_ring_wraps_oldest_first(tmp_path):
+  r = ring(tmp_path, capacity=4)
+  for i in range(10):
+    r.append(float(i), float(i))
+  t, v = r.ordered()
+  assert t.tolist() == [6.0, 7.0, 8.0, 9.0]
+
+def test_samples_survive_reopening(tmp_path):
+  r = ring(tmp_path)
+  r.append(1.0, 5.0)
+  r.append(2.0, 6.0)
+  r.flush()
+  again = ring(tmp_path)
+  assert again.ordered()[1].tolist() == [5.0, 6.0]
+
+def test_a_clock_that_started_again_starts_the_ring_again(tmp_path):
+  # written before a reboot, then time.monotonic() is small again
+  r = ring(tmp_path)
+  r.append(5000.0, 1.0)
+  r.append(5001.0, 1.0)
+  r.flush()
+  r = ring(tmp_path)
+  r.append(12.0, 2.0)
+  r.append(13.0, 2.0)
+  t, v = r.window(0.0)
+  assert t.tolist() == [12.0, 13.0]
+  start, step, values = sensor_log.resample(t, v, 4)
+  assert values == [2.0, 2.0, 2.0, 2.0]
+
+def test_only_samples_since_the_clock_went_back_are_used(tmp_path):
+  # a ring written before rings started over on their own
+  r = ring(tmp_path)
+  r.samples[:4] = [(5000.0, 1.0), (5001.0, 1.0), (12.0, 2.0), (13.0, 2.0)]
+  r.count[0] = 4
+  t, v = r.window(1.0)
+  assert t.tolist() == [12.0, 13.0]
+  start, step, values = sensor_log.resample(t, v, 10)
+  assert (start, step) == (12.0, 0.1)
+  assert values == [2.0] * 10
+
+def test_rate_is_capped_at_what_can_be_read(tmp_path):
+  replies = []
+  sensors = sensor_log.SensorLog(lambda kind, port: 1.0, lambda args, captured=None: replies.append(args),
+    str(tmp_path), capacity=16, max_rate=sensor_log.CRICKIT_RATE)
+  sensors.command("start", "analog", 1, 1000)
+  assert sensors.captures["analog/1"].rate == sensor_log.CRICKIT_RATE
+  assert "1000/s asked for" in replies[0][0]
+  sensors.command("stop", "analog", 1)
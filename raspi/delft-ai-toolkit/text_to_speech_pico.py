@@ -1,14 +1,58 @@
 # part of the delft toolkit for smart things
 # by Philip van Allen, pva@philvanallen.com
 
-import os.path
-import os
+# speaks with the SVOX pico engine inside this process, through ctypes and
+# libttspico (the library pico2wave is built on, in the libttspico0 package).
+# Samples go from the engine straight to the audio output while the rest of
+# the utterance is still being synthesized, with no shell, no fork and no wav
+# file, so quotes in the text are spoken as written and two callers never
+# share a file. Each voice keeps its engine, with its lingware loaded, for
+# the life of the process, and one voice synthesizes one utterance at a time.
+#
+# without libttspico or its lingware it falls back to running pico2wave into
+# a temporary file of its own, still without a shell.
+#
+#   python3 text_to_speech_pico.py ["some text"] [--voice enUS] [--play]
+# compares the time to the first sample of both ways.
 
+import os
 import time
+import wave
+import ctypes
+import ctypes.util
+import logging
+import tempfile
+import threading
+import subprocess
+from subprocess import Popen, PIPE, STDOUT
 
-def speak(utterance, vc):
-  utterance = utterance.replace("'","")
-  utterance = utterance.replace('"',"")
+import metrics
+
+log = logging.getLogger(__name__)
+
+LANG_DIR = "/usr/share/pico/lang"
+RATE = 16000 # pico makes 16 bit mono at 16kHz
+MEMORY = 2500000 # what pico2wave gives the engine
+BLOCK = 2048 # bytes handed to the audio output at a time, 64ms
+
+# the text analysis and signal generation lingware of each voice
+LINGWARE = {
+  "en-US": ("en-US_ta.bin", "en-US_lh0_sg.bin"),
+  "en-GB": ("en-GB_ta.bin", "en-GB_kh0_sg.bin"),
+  "de-DE": ("de-DE_ta.bin", "de-DE_gl0_sg.bin"),
+  "es-ES": ("es-ES_ta.bin", "es-ES_zl0_sg.bin"),
+  "fr-FR": ("fr-FR_ta.bin", "fr-FR_nk0_sg.bin"),
+  "it-IT": ("it-IT_ta.bin", "it-IT_cm0_sg.bin")
+}
+
+PICO_STEP_IDLE = 200
+PICO_STEP_BUSY = 201
+PICO_RESET_SOFT = 0x10
+
+class PicoError(Exception):
+  pass
+
+def voice_for(vc):
   # https://www.openhab.org/addons/voice/picotts/
   # German (de-DE)
   # English, US (en-US)
@@ -17,22 +61,257 @@ def speak(utterance, vc):
   # French (fr-FR)
   # Italian (it-IT)
   if vc == "" or vc.startswith('enUS'):
-    voice = "en-US"
+    return "en-US"
   elif "GB" in vc:
-    voice = "en-GB"
+    return "en-GB"
   elif "es" in vc:
-    voice = "es-ES"
+    return "es-ES"
   elif "FR" in vc:
-    voice = "fr-FR"
+    return "fr-FR"
   elif "IT" in vc:
-    voice = "it-IT"
+    return "it-IT"
   elif "DE" in vc:
-    voice = "de-DE"
+    return "de-DE"
   else:
-    voice = "en-US"
+    return "en-US"
+
+_lib = None
+_engines = {}
+_engines_lock = threading.Lock()
+
+def library():
+  # libttspico with its argument types, None if it is not installed
+  global _lib
+  if _lib == None:
+    name = ctypes.util.find_library("ttspico")
+    if name == None:
+      return None
+    lib = ctypes.CDLL(name)
+    handle = ctypes.c_void_p
+    out = ctypes.POINTER(ctypes.c_void_p)
+    text = ctypes.c_char_p
+    for function, argtypes in (
+      ("pico_initialize", [ctypes.c_void_p, ctypes.c_uint32, out]),
+      ("pico_terminate", [out]),
+      ("pico_getSystemStatusMessage", [handle, ctypes.c_int16, ctypes.c_char_p]),
+      ("pico_loadResource", [handle, text, out]),
+      ("pico_unloadResource", [handle, out]),
+      ("pico_getResourceName", [handle, handle, ctypes.c_char_p]),
+      ("pico_createVoiceDefinition", [handle, text]),
+      ("pico_addResourceToVoiceDefinition", [handle, text, text]),
+      ("pico_releaseVoiceDefinition", [handle, text]),
+      ("pico_newEngine", [handle, text, out]),
+      ("pico_disposeEngine", [handle, out]),
+      ("pico_resetEngine", [handle, ctypes.c_int32]),
+      ("pico_putTextUtf8", [handle, text, ctypes.c_int16, ctypes.POINTER(ctypes.c_int16)]),
+      ("pico_getData", [handle, ctypes.c_void_p, ctypes.c_int16, ctypes.POINTER(ctypes.c_int16), ctypes.POINTER(ctypes.c_int16)])):
+      getattr(lib, function).argtypes = argtypes
+      getattr(lib, function).restype = ctypes.c_int16
+    _lib = lib
+  return _lib
+
+class PicoEngine(object):
+  # a pico system with one voice's lingware loaded and an engine for it
+  def __init__(self, lib, voice, lang_dir=LANG_DIR):
+    self.lib = lib
+    self.voice = voice
+    self.name = voice.encode()
+    self.lock = threading.Lock()
+    self.memory = ctypes.create_string_buffer(MEMORY) # the engine's heap, kept alive with it
+    self.system = ctypes.c_void_p()
+    self.resources = []
+    self.engine = ctypes.c_void_p()
+    self.check(lib.pico_initialize(self.memory, MEMORY, ctypes.byref(self.system)), "initialize")
+    try:
+      self.check(lib.pico_createVoiceDefinition(self.system, self.name), "create voice")
+      for filename in LINGWARE[voice]:
+        resource = ctypes.c_void_p()
+        self.check(lib.pico_loadResource(self.system, os.path.join(lang_dir, filename).encode(), ctypes.byref(resource)),
+          "load " + filename)
+        self.resources.append(resource)
+        name = ctypes.create_string_buffer(200)
+        self.check(lib.pico_getResourceName(self.system, resource, name), "name " + filename)
+        self.check(lib.pico_addResourceToVoiceDefinition(self.system, self.name, name.value), "add " + filename)
+      self.check(lib.pico_newEngine(self.system, self.name, ctypes.byref(self.engine)), "new engine")
+    except PicoError:
+      self.close()
+      raise
+
+  def check(self, status, what):
+    if status < 0:
+      message = ctypes.create_string_buffer(200)
+      if self.system:
+        self.lib.pico_getSystemStatusMessage(self.system, status, message)
+      raise PicoError("pico {} {}: {} ({})".format(self.voice, what, message.value.decode("utf-8", "replace"), status))
+
+  def synthesize(self, utterance, on_samples):
+    # calls on_samples(bytes) with 16 bit samples as they are made
+    text = utterance.encode("utf-8") + b"\0" # the 0 tells the engine the text is complete
+    sent = ctypes.c_int16()
+    received = ctypes.c_int16()
+    data_type = ctypes.c_int16()
+    buffer = ctypes.create_string_buffer(BLOCK)
+    pending = b""
+    with self.lock:
+      try:
+        offset = 0
+        while offset < len(text):
+          chunk = text[offset:offset + 32767]
+          self.check(self.lib.pico_putTextUtf8(self.engine, chunk, len(chunk), ctypes.byref(sent)), "put text")
+          offset += sent.value
+          status = PICO_STEP_BUSY
+          while status == PICO_STEP_BUSY:
+            status = self.lib.pico_getData(self.engine, buffer, BLOCK, ctypes.byref(received), ctypes.byref(data_type))
+            if status != PICO_STEP_BUSY and status != PICO_STEP_IDLE:
+              self.check(status, "get data")
+            pending += buffer.raw[:received.value]
+            if len(pending) >= BLOCK:
+              on_samples(pending)
+              pending = b""
+        if len(pending) > 0:
+          on_samples(pending)
+      except BaseException:
+        # leaves the engine ready for the next utterance
+        self.lib.pico_resetEngine(self.engine, PICO_RESET_SOFT)
+        raise
+
+  def close(self):
+    lib = self.lib
+    if not self.system:
+      return
+    if self.engine:
+      lib.pico_disposeEngine(self.system, ctypes.byref(self.engine))
+    lib.pico_releaseVoiceDefinition(self.system, self.name)
+    for resource in reversed(self.resources):
+      lib.pico_unloadResource(self.system, ctypes.byref(resource))
+    lib.pico_terminate(ctypes.byref(self.system))
 
-  os.system("pico2wave -l " + voice + " -w audio/speaknow.wav '" + utterance + "' && play -q -V1 audio/speaknow.wav")
-  #os.system("pico2wave -l " + lang + " -w audio/speaknow.wav '" + utterance + "' && sox audio/speaknow.wav -c 2 audio/speaknowstereo.wav && aplay -Dhw:1 audio/speaknowstereo.wav" )
+def engine_for(voice):
+  # the voice's engine, made the first time it is asked for, None to use pico2wave
+  with _engines_lock:
+    if voice not in _engines:
+      engine = None
+      try:
+        lib = library()
+        if lib == None:
+          log.info("libttspico not found, speaking with pico2wave")
+      except (OSError, AttributeError) as e:
+        log.warning("can't load libttspico (%s), speaking with pico2wave", e)
+        lib = None
+      if lib != None:
+        try:
+          start = time.monotonic()
+          engine = PicoEngine(lib, voice)
+          log.info("pico %s loaded in %.2fs", voice, time.monotonic() - start)
+        except (PicoError, OSError, ctypes.ArgumentError) as e:
+          log.warning("%s, speaking with pico2wave", e)
+      _engines[voice] = engine
+    return _engines[voice]
+
+def pico2wave(utterance, voice, on_samples):
+  # the fallback, a file of our own and the text as one argument, so no quoting is needed
+  handle, path = tempfile.mkstemp(suffix=".wav", prefix="pico")
+  os.close(handle)
+  try:
+    try:
+      if subprocess.call(["pico2wave", "-l", voice, "-w", path, "--", utterance]) != 0:
+        log.warning("pico2wave failed for voice %s", voice)
+        return False
+    except OSError as e:
+      log.warning("can't run pico2wave: %s", e)
+      return False
+    with wave.open(path, "rb") as w:
+      on_samples(w.readframes(w.getnframes()))
+    return True
+  finally:
+    os.remove(path)
+
+def synthesize(utterance, vc, on_samples):
+  # calls on_samples(bytes) with 16 bit 16kHz mono samples as they are made
+  voice = voice_for(vc)
+  engine = engine_for(voice)
+  start = time.monotonic()
+  first = []
+  def samples(data):
+    if len(first) == 0:
+      first.append(time.monotonic())
+      metrics.histogram("tts_first_sample_seconds", engine="pico" if engine != None else "pico2wave").observe(first[0] - start)
+    on_samples(data)
+  if engine != None:
+    try:
+      engine.synthesize(utterance, samples)
+    except (PicoError, ctypes.ArgumentError) as e:
+      # an engine that fails once is not trusted again, the voice goes over to pico2wave
+      log.warning("%s, speaking %s with pico2wave from now on", e, voice)
+      metrics.counter("tts_errors", engine="pico").inc()
+      with _engines_lock:
+        _engines[voice] = None
+      if len(first) > 0:
+        return False # part of it was spoken already, don't start again
+      engine = None
+  if engine == None and not pico2wave(utterance, voice, samples):
+    return False
+  metrics.histogram("tts_synthesis_seconds", engine="pico" if engine != None else "pico2wave").observe(time.monotonic() - start)
+  return True
+
+def pcm(utterance, vc):
+  # the whole utterance as samples in memory, None if it could not be synthesized
+  blocks = []
+  if not synthesize(utterance, vc, blocks.append):
+    return None
+  return b"".join(blocks)
+
+_audio = None
+
+class Output(object):
+  # plays samples as they are written, through pyaudio, or aplay where pyaudio is missing
+  def __init__(self, rate=RATE):
+    global _audio
+    self.stream = None
+    self.process = None
+    try:
+      import pyaudio
+      if _audio == None:
+        _audio = pyaudio.PyAudio() # slow to start, so only once
+      self.stream = _audio.open(format=pyaudio.paInt16, channels=1, rate=rate, output=True)
+    except ImportError:
+      self.process = Popen(["aplay", "-q", "-t", "raw", "-f", "S16_LE", "-r", str(rate), "-c", "1"], stdin=PIPE)
+
+  def write(self, samples):
+    if self.stream != None:
+      self.stream.write(samples)
+    else:
+      self.process.stdin.write(samples)
+
+  def close(self):
+    if self.stream != None:
+      self.stream.stop_stream() # waits for the last samples to play
+      self.stream.close()
+    else:
+      self.process.stdin.close()
+      self.process.wait()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+def play(samples, stopped=None):
+  # samples from pcm(), a block at a time so a set stopped event cuts it short
+  with Output() as out:
+    for i in range(0, len(samples), BLOCK):
+      if stopped != None and stopped.is_set():
+        break
+      out.write(samples[i:i + BLOCK])
+
+def speak(utterance, vc):
+  # the first samples play while the rest are still being synthesized
+  try:
+    with Output() as out:
+      synthesize(utterance, vc, out.write)
+  except (OSError, IOError) as e:
+    log.warning("can't speak: %s", e)
 
 def isAudioPlaying():
 
@@ -50,3 +329,43 @@ def isAudioPlaying():
       break
 
   return audioPlaying
+
+if __name__ == '__main__':
+  import argparse
+  parser = argparse.ArgumentParser(description="time to the first sample, in process and with pico2wave")
+  parser.add_argument("text", nargs="?", default='She said "it\'s ready", then the robot moved.')
+  parser.add_argument("--voice", default="enUS")
+  parser.add_argument("--runs", type=int, default=5)
+  parser.add_argument("--play", action="store_true", help="also speak it")
+  args = parser.parse_args()
+  logging.basicConfig(level=logging.INFO)
+  voice = voice_for(args.voice)
+
+  def first_sample(run):
+    # seconds to the first samples and the number of samples
+    start = time.monotonic()
+    first = []
+    blocks = []
+    def samples(data):
+      if len(first) == 0:
+        first.append(time.monotonic() - start)
+      blocks.append(data)
+    run(samples)
+    return first[0] if first else float("nan"), sum(len(b) for b in blocks) // 2
+
+  import shutil
+  ways = []
+  engine = engine_for(voice)
+  if engine != None:
+    ways.append(("in process", lambda samples: engine.synthesize(args.text, samples)))
+  if shutil.which("pico2wave") != None:
+    ways.append(("pico2wave", lambda samples: pico2wave(args.text, voice, samples)))
+  if len(ways) == 0:
+    print("neither libttspico nor pico2wave is installed")
+  for name, run in ways:
+    times = [first_sample(run) for i in range(args.runs)]
+    firsts = sorted(t for t, n in times)
+    print("{:<12} first sample {:.1f}ms median, {:.1f}ms best, {:.2f}s of audio".format(
+      name, firsts[len(firsts) // 2] * 1000, firsts[0] * 1000, times[0][1] / RATE))
+  if args.play:
+    speak(args.text, args.voice)
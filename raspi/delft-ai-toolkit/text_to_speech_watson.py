@@ -3,11 +3,17 @@
 
 import os
 import json
+import time
+import logging
 from os.path import join, dirname
 from ibm_watson import TextToSpeechV1
 from ibm_watson.websocket import SynthesizeCallback
 from ibm_cloud_sdk_core.authenticators import IAMAuthenticator
 
+import metrics
+
+log = logging.getLogger(__name__)
+
 class tts_watson(object):
 
   class MySynthesizeCallback(SynthesizeCallback):
@@ -17,27 +23,27 @@ class tts_watson(object):
           self.fd = open(self.file_path, 'wb+')
 
       def on_connected(self):
-          print('Connection was successful')
+          log.debug('Connection was successful')
 
       def on_error(self, error):
-          print('Error received: {}'.format(error))
+          log.error('Error received: %s', error)
 
       def on_content_type(self, content_type):
-          print('Content type: {}'.format(content_type))
+          log.debug('Content type: %s', content_type)
 
       def on_timing_information(self, timing_information):
-          print(timing_information)
+          log.debug("%s", timing_information)
 
       def on_audio_stream(self, audio_stream):
           self.fd.write(audio_stream)
 
       def on_close(self):
           self.fd.close()
-          print('Done synthesizing. Closing the connection')
+          log.debug('Done synthesizing. Closing the connection')
 
 
   def __init__(self, iamkey, url):
-    print(iamkey,url)
+    log.info("Watson TTS url: %s", url)
     authenticator = IAMAuthenticator(iamkey)
     self.service = TextToSpeechV1(authenticator=authenticator)
     # if url == "" or url == "default":
@@ -74,10 +80,12 @@ class tts_watson(object):
     else:
       voice = "en-US_MichaelVoice"
 
-    print(voice)
+    log.debug("voice: %s", voice)
+    start = time.monotonic()
     self.service.synthesize_using_websocket(utterance,
       synthesize_callback,
       accept='audio/wav; rate=44100',
       voice=voice
     )
+    metrics.histogram("tts_synthesis_seconds", engine="watson").observe(time.monotonic() - start)
     os.system("play -q -V1 audio/watson.wav") 
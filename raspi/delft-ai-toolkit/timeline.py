@@ -0,0 +1,187 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# named sequences of commands that run on the Pi, so the steps of a behavior
+# are not each held up by the network.
+#
+#   /timeline/ upload <name> <json>   store a sequence
+#   /timeline/ start <name> [loops]   run it, loops 0 repeats until stopped
+#   /timeline/ pause|resume|stop <name>
+#   /timeline/ list
+#
+# a sequence is a JSON list of OSC commands, e.g.
+#   [["/move/", "forward", 1.0, 0.5, "easeIn"], ["/delay/", "pause", 1.0],
+#    ["/leds/", "blink", 0.1, 3, "0,0,127"]]
+# commands run one after the other, and a /delay/ waits before the next one.
+# Every step is due at a fixed offset from the start on time.monotonic(), so
+# the time a command takes does not push the steps after it back. Progress
+# ("<name> step 3/7"), loops, pauses and the end are sent back on /str/timeline/.
+
+import json
+import time
+import logging
+import threading
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+class Sequence(object):
+  def __init__(self, name, steps, length):
+    self.name = name
+    self.steps = steps # (offset seconds, address, args)
+    self.length = length # seconds, including any /delay/ after the last step
+
+def parse(name, text, commands):
+  # turns the uploaded JSON into a Sequence, raises ValueError if it is not valid
+  try:
+    items = json.loads(text)
+  except ValueError as e:
+    raise ValueError("not valid JSON: " + str(e))
+  if not isinstance(items, list):
+    raise ValueError("a timeline is a list of commands")
+  steps = []
+  offset = 0.0
+  for item in items:
+    if not isinstance(item, list) or len(item) == 0:
+      raise ValueError("each command is a list starting with its address")
+    address, args = item[0], item[1:]
+    if address == "/delay/":
+      # /delay/ type time, like the message Unity sends
+      if len(args) == 0:
+        raise ValueError("/delay/ needs a time")
+      offset += float(args[-1])
+      continue
+    if address not in commands:
+      raise ValueError("unknown command " + str(address))
+    steps.append((offset, address, args))
+  return Sequence(name, steps, offset)
+
+class Run(object):
+  # one sequence playing
+  def __init__(self, sequence, loops):
+    self.sequence = sequence
+    self.loops = loops
+    self.stop_e = threading.Event()
+    self.resume_e = threading.Event()
+    self.resume_e.set()
+    self.paused_at = None
+    self.t0 = 0.0
+
+class Timelines(object):
+  def __init__(self, commands, reply):
+    self.commands = commands # address -> callback, as in the bridge's dispatcher
+    self.reply = reply # called with a progress line
+    self.lock = threading.Lock()
+    self.sequences = {}
+    self.runs = {}
+
+  def command(self, action, name="", arg=None):
+    if action == "upload":
+      self.upload(name, arg)
+    elif action == "start":
+      self.start(name, 1 if arg == None else int(arg))
+    elif action == "pause":
+      self.pause(name)
+    elif action == "resume":
+      self.resume(name)
+    elif action == "stop":
+      self.stop(name)
+    elif action == "list":
+      with self.lock:
+        names = sorted(self.sequences)
+        running = set(self.runs)
+      self.reply("timelines: " + " ".join(n + ("*" if n in running else "") for n in names))
+    else:
+      self.reply("unknown timeline action: " + str(action))
+
+  def upload(self, name, text):
+    try:
+      sequence = parse(name, text, self.commands)
+    except ValueError as e:
+      self.reply(name + " upload failed: " + str(e))
+      return
+    with self.lock:
+      self.sequences[name] = sequence
+    self.reply("{} uploaded {} steps {:.3f}s".format(name, len(sequence.steps), sequence.length))
+
+  def start(self, name, loops=1):
+    with self.lock:
+      sequence = self.sequences.get(name)
+      if sequence == None:
+        self.reply(name + " is not uploaded")
+        return
+      if loops <= 0 and sequence.length <= 0:
+        self.reply(name + " has no delays, it can not loop forever")
+        return
+      old = self.runs.get(name)
+      run = Run(sequence, loops)
+      self.runs[name] = run
+    if old != None:
+      old.stop_e.set() # starting again restarts it
+      old.resume_e.set()
+    threading.Thread(target=self.play, args=(run,), name="timeline-" + name, daemon=True).start()
+
+  def pause(self, name):
+    run = self.runs.get(name)
+    if run != None and run.paused_at == None:
+      run.paused_at = time.monotonic()
+      run.resume_e.clear()
+      self.reply(name + " paused")
+
+  def resume(self, name):
+    run = self.runs.get(name)
+    if run != None and run.paused_at != None:
+      run.t0 += time.monotonic() - run.paused_at # the rest of the steps move back by the pause
+      run.paused_at = None
+      run.resume_e.set()
+      self.reply(name + " resumed")
+
+  def stop(self, name):
+    run = self.runs.get(name)
+    if run != None:
+      run.stop_e.set()
+      run.resume_e.set()
+
+  def play(self, run):
+    sequence = run.sequence
+    total = len(sequence.steps)
+    loop = 0
+    run.t0 = time.monotonic()
+    self.reply("{} started".format(sequence.name))
+    while not run.stop_e.is_set():
+      for i, (offset, address, args) in enumerate(sequence.steps):
+        if not self.wait_until(run, offset):
+          break
+        lateness = time.monotonic() - (run.t0 + offset)
+        metrics.histogram("timeline_step_lateness_seconds").observe(lateness)
+        try:
+          self.commands[address](address, *args)
+        except Exception:
+          log.exception("timeline %s step %s %s failed", sequence.name, i + 1, address)
+        self.reply("{} step {}/{}".format(sequence.name, i + 1, total))
+      # any /delay/ after the last step is part of the sequence too
+      if run.stop_e.is_set() or not self.wait_until(run, sequence.length):
+        break
+      loop += 1
+      if run.loops > 0 and loop >= run.loops:
+        break
+      # the next loop starts exactly one length after this one, so loops do not drift
+      run.t0 += sequence.length
+      self.reply("{} loop {}".format(sequence.name, loop + 1))
+    with self.lock:
+      if self.runs.get(sequence.name) is run:
+        del self.runs[sequence.name]
+    self.reply("{} {}".format(sequence.name, "stopped" if run.stop_e.is_set() else "done"))
+
+  def wait_until(self, run, offset):
+    # sleeps until a step is due, through any pauses, False if the run was stopped
+    while True:
+      run.resume_e.wait()
+      if run.stop_e.is_set():
+        return False
+      delay = run.t0 + offset - time.monotonic()
+      if delay <= 0 and run.resume_e.is_set():
+        return True
+      if run.stop_e.wait(max(delay, 0)):
+        return False
@@ -0,0 +1,95 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# logging for the toolkit processes.
+#
+# log records are handed to a background thread that does the actual writing,
+# so a slow SSH session or journald pipe never blocks the control loop. If the
+# writer falls behind, records are dropped and counted instead of waiting.
+# Hot paths log at DEBUG with %-style arguments, which costs a single level
+# check when DEBUG is off, and can be rate limited per call site:
+#   log.debug("analog %s %s", port, value, extra=toolkit_log.every(1.0))
+
+import sys
+import time
+import queue
+import logging
+import logging.handlers
+import threading
+
+LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR"]
+
+listener = None
+
+def every(seconds):
+  # extra= argument that lets a call site log at most once every seconds
+  return {"min_interval": seconds}
+
+class RateLimitFilter(logging.Filter):
+  # keyed by call site (file and line), counts what it suppressed
+  def __init__(self):
+    logging.Filter.__init__(self)
+    self.lock = threading.Lock()
+    self.sites = {} # (pathname, lineno) -> [next allowed time, suppressed]
+
+  def filter(self, record):
+    interval = getattr(record, "min_interval", 0)
+    if interval <= 0:
+      return True
+    key = (record.pathname, record.lineno)
+    now = time.monotonic()
+    with self.lock:
+      site = self.sites.get(key)
+      if site == None:
+        site = [0.0, 0]
+        self.sites[key] = site
+      if now < site[0]:
+        site[1] += 1
+        return False
+      suppressed = site[1]
+      site[0] = now + interval
+      site[1] = 0
+    if suppressed > 0:
+      record.msg = str(record.msg) + " (%d similar suppressed)" % suppressed
+    return True
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+  # never blocks the caller, a full queue drops the record
+  def __init__(self, q):
+    logging.handlers.QueueHandler.__init__(self, q)
+    self.dropped = 0
+
+  def enqueue(self, record):
+    try:
+      self.queue.put_nowait(record)
+    except queue.Full:
+      self.dropped += 1
+
+def setup(process, level="INFO", maxsize=1000):
+  # call once at the start of every process, including the forked workers,
+  # since the writer thread does not survive fork()
+  global listener
+  if listener != None:
+    try:
+      listener.stop()
+    except Exception:
+      pass
+  q = queue.Queue(maxsize)
+  writer = logging.StreamHandler(sys.stdout)
+  writer.setFormatter(logging.Formatter("%(asctime)s " + process + " %(levelname)s %(message)s", "%H:%M:%S"))
+  handler = DroppingQueueHandler(q)
+  handler.addFilter(RateLimitFilter())
+  root = logging.getLogger()
+  for old in list(root.handlers):
+    root.removeHandler(old)
+  root.addHandler(handler)
+  set_level(level)
+  listener = logging.handlers.QueueListener(q, writer)
+  listener.start()
+  return handler
+
+def set_level(level):
+  level = str(level).upper()
+  if level not in LEVELS:
+    level = "INFO"
+  logging.getLogger().setLevel(level)
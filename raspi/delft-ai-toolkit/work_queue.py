@@ -0,0 +1,123 @@
+# part of the delft toolkit for smart things
+# by Philip van Allen, pva@philvanallen.com
+
+# work queues between the OSC bridge and the worker processes.
+#
+# put() is called in the bridge, get() in the one worker process that owns the
+# queue. Items travel over a multiprocessing.Queue, and get() drains everything
+# that has arrived before picking the next item, so the policy sees all waiting work:
+#   fifo     - first in first out, put() drops new work once maxsize items are waiting
+#   latest   - only the newest item for each key is kept, older ones are dropped
+#   priority - highest priority first, fifo within the same priority
+# depth, drops and wait times live in shared memory so any process can report them.
+
+import time
+import heapq
+import queue
+import multiprocessing
+
+import metrics
+
+POLICIES = ["fifo", "latest", "priority"]
+
+class Work(object):
+  # one item taken off a WorkQueue
+  def __init__(self, id, item, key, priority, queued_at):
+    self.id = id # request id, use it to tag the result
+    self.item = item
+    self.key = key
+    self.priority = priority
+    self.queued_at = queued_at
+    self.wait = 0.0 # seconds spent in the queue
+
+class WorkQueue(object):
+  def __init__(self, name, policy="fifo", maxsize=0):
+    if policy not in POLICIES:
+      raise ValueError("unknown queue policy: " + policy)
+    self.name = name
+    self.policy = policy
+    self.maxsize = maxsize
+    self._q = multiprocessing.Queue()
+    # shared stats, the lock on depth also guards the other counters
+    self._depth = multiprocessing.Value('i', 0)
+    self._next_id = multiprocessing.Value('i', 0, lock=False)
+    self._dropped = multiprocessing.Value('i', 0, lock=False)
+    self._taken = multiprocessing.Value('i', 0, lock=False)
+    self._wait_total = multiprocessing.Value('d', 0.0, lock=False)
+    self._wait_max = multiprocessing.Value('d', 0.0, lock=False)
+    # only used in the consuming process
+    self._pending = []
+    self._order = 0
+
+  def put(self, item, key=None, priority=0, id=None):
+    # returns the request id, or None if a full fifo queue dropped the item
+    with self._depth.get_lock():
+      if self.policy == "fifo" and self.maxsize > 0 and self._depth.value >= self.maxsize:
+        self._dropped.value += 1
+        return None
+      self._depth.value += 1
+      if id == None:
+        self._next_id.value += 1
+        id = self._next_id.value
+    self._q.put((id, item, key, priority, time.monotonic()))
+    return id
+
+  def get(self):
+    # blocks until there is work, then returns the Work picked by the policy
+    while not self._pending:
+      self._add(self._q.get())
+    self._drain()
+    if self.policy == "priority":
+      work = heapq.heappop(self._pending)[2]
+    else:
+      work = self._pending.pop(0)
+    work.wait = time.monotonic() - work.queued_at
+    with self._depth.get_lock():
+      self._depth.value -= 1
+      self._taken.value += 1
+      self._wait_total.value += work.wait
+      self._wait_max.value = max(self._wait_max.value, work.wait)
+    metrics.histogram("queue_wait_seconds", queue=self.name).observe(work.wait)
+    return work
+
+  def _drain(self):
+    # pick up everything already sent without blocking
+    while True:
+      try:
+        self._add(self._q.get_nowait())
+      except queue.Empty:
+        return
+
+  def _add(self, message):
+    id, item, key, priority, queued_at = message
+    work = Work(id, item, key, priority, queued_at)
+    if self.policy == "priority":
+      self._order += 1
+      heapq.heappush(self._pending, (-priority, self._order, work))
+      return
+    if self.policy == "latest":
+      for i, old in enumerate(self._pending):
+        if old.key == key:
+          del self._pending[i]
+          with self._depth.get_lock():
+            self._depth.value -= 1
+            self._dropped.value += 1
+          break
+    self._pending.append(work)
+
+  def stats(self):
+    with self._depth.get_lock():
+      taken = self._taken.value
+      return {
+        "depth": self._depth.value,
+        "dropped": self._dropped.value,
+        "taken": taken,
+        "wait_avg": self._wait_total.value / taken if taken > 0 else 0.0,
+        "wait_max": self._wait_max.value
+      }
+
+  def summary(self):
+    stats = self.stats()
+    return "{} {} depth={} dropped={} taken={} wait_avg={:.3f} wait_max={:.3f}".format(
+      self.name, self.policy, stats["depth"], stats["dropped"], stats["taken"],
+      stats["wait_avg"], stats["wait_max"])
@@ -142,6 +142,12 @@ public class DingControlPhysical : DingControlBase {
 							//print("Received Event" + address + value);
 							if (DelftToolkit.DingSignal.onSignalEvent != null)
 								DelftToolkit.DingSignal.onSignalEvent(new DelftToolkit.DingSignal(thisDevice, AiGlobals.SensorSource.phys, address, value));
+						} else if (address.StartsWith("/sync/ping/")) {
+							// clock sync: send the ping back with when it arrived and when it is answered
+							List<object> pong = new List<object>(item.Value.packets[msgIndex].Data);
+							pong.Add(UnixSeconds(item.Value.packets[msgIndex].TimeStamp));
+							pong.Add(UnixSeconds(DateTime.Now.Ticks));
+							OSCHandler.Instance.SendMessageToClient(serverClientID, "/pong/", pong);
 						}
 						//print(OSC_SERVER_CLIENT + ": " + address + " " + float.Parse(item.Value.packets[msgIndex].Data[0].ToString()));
 					}
@@ -151,6 +157,12 @@ public class DingControlPhysical : DingControlBase {
 		}
 	}
 
+	// local DateTime ticks as Unix time in seconds, the clock the robots sync to
+	private static double UnixSeconds(long ticks) {
+		DateTime utc = new DateTime(ticks, DateTimeKind.Local).ToUniversalTime();
+		return (utc - new DateTime(1970, 1, 1, 0, 0, 0, DateTimeKind.Utc)).TotalSeconds;
+	}
+
 	public override void handleAction() {
 		//base.Update ();
 		List<object> oscValues = new List<object>();